@@ -20,5 +20,8 @@ pip install . -t $LIBDIR
 
 # Copy static content
 cp -rf ../audio-annotator/static ./
+mkdir -p data/jamendo
+cp -f ../data/instrument_taxonomy_v0.json data/
+cp -f ../data/jamendo/*.json data/jamendo/
 
 gcloud app deploy
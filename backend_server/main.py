@@ -16,22 +16,32 @@ Or, to use GCP backend by default:
 Endpoints
 ---------
   - /audio : POST
+  - /audio/exists : POST
   - /audio/<uri> : GET
+  - /audio/<uri>/peaks : GET
+  - /audio/<uri>/spectrogram : GET
+  - /audio/<uri>/spectrogram/<hop_length>/<index> : GET
   - /annotation/submit : POST
+  - /annotation/submit/bulk : POST
   - /annotation/taxonomy : GET
+  - /metrics : GET
 """
 import argparse
+import atexit
+import codecs
+import collections
 import datetime
-import io
+import itertools
 import json
 import logging
 import mimetypes
+import operator
 import os
 import random
-import requests
+import tempfile
 import yaml
 
-from flask import Flask, Response, request, send_file
+from flask import Flask, Response, request, stream_with_context
 from flask import session, redirect, url_for, jsonify, render_template
 
 from functools import wraps
@@ -47,7 +57,28 @@ app.secret_key = 'development'
 
 SOURCE = "https://cosmir.github.io/open-mic/"
 AUDIO_EXTENSIONS = set(['wav', 'ogg', 'mp3', 'au', 'aiff'])
+MAX_EXISTS_BATCH = 1000
+MAX_ANNOTATION_BATCH = 10000
+# Annotations written per database round trip in bulk submissions.
+ANNOTATION_PUT_BATCH = 500
+NDJSON_MIMETYPES = set(['application/x-ndjson', 'application/jsonl'])
+# For responses derived from content-addressed data.
+CACHE_FOREVER = 'public, max-age=31536000, immutable'
+# Record holding the tag co-occurrence counts behind suggestions.
+SUGGEST_URI = 'suggest:cooccurrence'
+# Seconds between merges of annotation counts into audio records.
+COUNT_MERGE_INTERVAL = 1.0
+# Bundled taxonomies served if none is configured, relative to the application
+# directory: as deployed, or in a checkout; the first that exists is used.
+TAXONOMY_PATHS = ['data/instrument_taxonomy_v0.json',
+                  '../data/instrument_taxonomy_v0.json']
 OAUTH = None
+CLIENTS = None
+TAXONOMY = None
+HIERARCHY = None
+SUGGEST = None
+SUGGEST_COUNTS = None
+AUDIO_COUNTS = None
 
 
 def configure(cfg):
@@ -65,6 +96,219 @@ def configure(cfg):
     global OAUTH
     OAUTH = pybackend.oauth.OAuth(app, session)
 
+    write_behind = cfg.get('write_behind')
+    if write_behind is not None:
+        filepath = write_behind.get('filepath')
+        if not filepath or is_temporary(filepath):
+            raise ValueError("The write-behind journal must be on persistent "
+                             "disk, not {}".format(filepath))
+
+    global CLIENTS
+    shutdown()
+    CLIENTS = pybackend.registry.Registry(
+        project=cfg['cloud']['project'],
+        database=cfg['cloud']['database'],
+        storage=cfg['cloud']['storage'],
+        scheduler=cfg.get('scheduler'),
+        ingest=cfg.get('ingest'),
+        write_behind=write_behind)
+
+    # Counted in the background, so that submitting an annotation doesn't
+    # wait on a transaction over the audio record.
+    global AUDIO_COUNTS
+    AUDIO_COUNTS = pybackend.database.Accumulator(
+        CLIENTS.database, add_tallies, merge_tally,
+        on_merge=lambda uri, record: CLIENTS.scheduler.sync(
+            uri, record[pybackend.scheduler.COUNT_FIELD]),
+        flush_interval=COUNT_MERGE_INTERVAL)
+
+    global TAXONOMY
+    tax_cfg = dict(cfg.get('taxonomy') or {})
+    if not tax_cfg:
+        tax_cfg['path'] = next(
+            (path for path in TAXONOMY_PATHS if os.path.exists(
+                os.path.join(os.path.dirname(__file__), path))),
+            TAXONOMY_PATHS[0])
+    if tax_cfg.get('path'):
+        tax_cfg['path'] = os.path.join(os.path.dirname(__file__),
+                                       tax_cfg['path'])
+    TAXONOMY = pybackend.taxonomy.Taxonomy(**tax_cfg)
+
+    global HIERARCHY
+    HIERARCHY = None
+    if cfg.get('hierarchy'):
+        HIERARCHY = pybackend.taxonomy.Hierarchy(**{
+            key: os.path.join(os.path.dirname(__file__), path)
+            for key, path in cfg['hierarchy'].items()})
+
+    global SUGGEST, SUGGEST_COUNTS
+    SUGGEST = None
+    if cfg.get('suggest'):
+        suggest_cfg = dict(cfg['suggest'])
+        tracks = os.path.join(os.path.dirname(__file__),
+                              suggest_cfg.pop('tracks'))
+        merge_interval = suggest_cfg.pop('merge_interval', 5.0)
+        SUGGEST = pybackend.suggest.CoOccurrence(
+            TAXONOMY.instruments, HIERARCHY, **suggest_cfg)
+        load_suggestions(tracks)
+        # Every annotation counts towards the one stored record, so counts
+        # are merged into it in the background, rather than contending for
+        # it in each request.
+        SUGGEST_COUNTS = pybackend.database.Accumulator(
+            CLIENTS.database, operator.add, merge_suggestions,
+            on_merge=lambda uri, record: SUGGEST.load(record),
+            flush_interval=merge_interval)
+
+
+def is_temporary(path):
+    """Whether a path is under a temporary directory, which may be cleared
+    on restart, or not shared between instances."""
+    path = os.path.realpath(path)
+    return any(path.startswith(os.path.join(os.path.realpath(tmp), ''))
+               for tmp in set([tempfile.gettempdir(), '/tmp', '/var/tmp']))
+
+
+def load_suggestions(tracks):
+    """Load the stored tag co-occurrence counts into `SUGGEST`, storing them
+    first, as counted over `tracks`, if there are none yet.
+
+    Parameters
+    ----------
+    tracks : str
+        Path to the Jamendo per-track instrument tags.
+    """
+    record = CLIENTS.database.get(SUGGEST_URI)
+    if record is None:
+        counts, _ = SUGGEST.tally(pybackend.suggest.load_tracks(tracks))
+        seeded = SUGGEST.to_record(counts)
+        # Another instance may be seeding at the same time; keep theirs.
+        CLIENTS.database.update_many(
+            [SUGGEST_URI], lambda uri, rec: seeded if rec is None else None)
+        record = CLIENTS.database.get(SUGGEST_URI)
+    SUGGEST.load(record)
+
+
+def add_tallies(tally, later):
+    """Combine two tallies of annotations of an audio item.
+
+    Parameters
+    ----------
+    tally, later : tuple of (int, set)
+        Number of annotations, and the instrument tags heard in them.
+
+    Returns
+    -------
+    tally : tuple of (int, set)
+        Both tallies together.
+    """
+    return tally[0] + later[0], tally[1] | later[1]
+
+
+def merge_tally(uri, record, tally):
+    """Add a tally of annotations to an audio record.
+
+    Parameters
+    ----------
+    uri : str
+        URI of the audio.
+
+    record : dict or None
+        The audio record, or None if there is none.
+
+    tally : tuple of (int, set)
+        Number of annotations, and the instrument tags heard in them.
+
+    Returns
+    -------
+    record : dict or None
+        The updated record, or None to leave it as is.
+    """
+    if record is None:
+        app.logger.warning("Annotated audio not found: {}".format(uri))
+        return None
+    field = pybackend.scheduler.COUNT_FIELD
+    count, tags = tally
+    record[field] = record.get(field, 0) + count
+    if tags:
+        record['tags'] = sorted(set(record.get('tags', [])) | tags)
+    return record
+
+
+def merge_suggestions(uri, record, delta):
+    """Add co-occurrence counts to those stored, e.g. by other instances.
+
+    Parameters
+    ----------
+    uri : str
+        URI of the record, i.e. `SUGGEST_URI`.
+
+    record : dict or None
+        Stored counts, as given by `SUGGEST.to_record`, if any.
+
+    delta : np.ndarray
+        Counts to add, as returned by `SUGGEST.tally`.
+
+    Returns
+    -------
+    record : dict
+        The summed counts.
+    """
+    if record is not None:
+        delta = delta + SUGGEST.from_record(record)
+    return SUGGEST.to_record(delta)
+
+
+def rebuild_suggestions(tracks):
+    """Recount tag co-occurrence over `tracks` and every stored annotation,
+    and replace the stored counts.
+
+    Annotations submitted while this runs may go uncounted, so it's meant
+    for maintenance, e.g. after changing the vocabulary, not for serving.
+
+    Parameters
+    ----------
+    tracks : str
+        Path to the Jamendo per-track instrument tags.
+
+    Returns
+    -------
+    count : int
+        Number of annotations with at least one known tag.
+    """
+    dbase = CLIENTS.annotations
+
+    def tag_sets():
+        for uris in pybackend.utils.chunks(dbase.uris(kind='annotation'),
+                                           1000):
+            for record in dbase.get_many(uris):
+                if record:
+                    record = pybackend.models.AnnotationResponse.from_flat(
+                        **record)
+                    yield pybackend.suggest.annotation_tags(
+                        record.get('response'))
+
+    # Pending counts are of stored annotations, which are recounted here.
+    SUGGEST_COUNTS.flush()
+    counts, _ = SUGGEST.tally(pybackend.suggest.load_tracks(tracks))
+    annotated, count = SUGGEST.tally(tag_sets())
+    record = SUGGEST.to_record(counts + annotated)
+    CLIENTS.database.put(SUGGEST_URI, record)
+    SUGGEST.load(record)
+    return count
+
+
+@atexit.register
+def shutdown():
+    """Merge pending counts, and release the application's database /
+    storage clients."""
+    global SUGGEST_COUNTS, AUDIO_COUNTS
+    for counts in [AUDIO_COUNTS, SUGGEST_COUNTS]:
+        if counts is not None:
+            counts.close()
+    SUGGEST_COUNTS = AUDIO_COUNTS = None
+    if CLIENTS is not None:
+        CLIENTS.close()
+
 
 # Default configuration
 CONFIG = os.path.join(os.path.dirname(__file__), '.config.yaml')
@@ -179,6 +423,13 @@ def audio_upload():
 
     $ curl -F "audio=@some_file.mp3" localhost:8080/api/v0.1/audio
 
+    The audio is stored and indexed right away, and a 202 returned with its
+    URI; ingest stages then run in the background, after which the audio's
+    `status` changes from 'pending' to 'ready' (or 'failed'). If no ingest
+    workers are configured, the stages run before responding, and a 200 is
+    returned instead. Audio that is already indexed, by this process or
+    another, is left untouched, and a 200 returned with its URI.
+
     TODOs:
       - Store user data (who uploaded this? IP address?)
       - File metadata
@@ -191,35 +442,151 @@ def audio_upload():
         app.logger.exception('Attempted upload of unsupported filetype.')
         return 'Filetype not supported.', 400
 
-    bytestring = audio_data.stream.read()
-    app.logger.info("Uploaded data: type={}, len={}"
-                    .format(type(bytestring), len(bytestring)))
-
-    # Copy to cloud storage
-    store = pybackend.storage.Storage(
-        project=app.config['cloud']['project'],
-        **app.config['cloud']['storage'])
-
-    gid = str(pybackend.utils.uuid(bytestring))
-    store.put(gid, bytestring)
-
-    # Index in the database
-    dbase = pybackend.database.Database(
-        project=app.config['cloud']['project'],
-        **app.config['cloud']['database'])
-
+    # Hash while spooling, so memory use doesn't grow with the file size.
+    spool, gid, num_bytes = pybackend.utils.spool(audio_data.stream)
+    gid = str(gid)
     uri = pybackend.urilib.join('audio', gid)
+    app.logger.info("Uploaded data: len={}".format(num_bytes))
+
+    def already_have():
+        app.logger.info("Already have {}".format(uri))
+        response_data = dict(
+            uri=uri,
+            message="Already have {} bytes of data.".format(num_bytes))
+        resp = Response(json.dumps(response_data), status=200,
+                        mimetype=mimetypes.types_map[".json"])
+        resp.headers['Link'] = SOURCE
+        return resp
+
+    # Audio is content-addressed, so anything already stored is unchanged.
+    with spool:
+        if audio_exists(uri):
+            return already_have()
+
+        # Copy to cloud storage
+        CLIENTS.storage.put_file(gid, spool)
+
+    # Index in the database, unless another process already has: the index
+    # of known audio is per process, so missing from it is not conclusive.
+    status_field = pybackend.ingest.STATUS_FIELD
     record = dict(file_ext=file_ext,
                   created=str(datetime.datetime.now()),
                   remote_addr=request.remote_addr,
-                  num_bytes=len(bytestring),
+                  num_bytes=num_bytes,
                   **request.form)
-    dbase.put(uri, record)
+    record[status_field] = pybackend.ingest.PENDING
+    existing = dict()
+
+    def create(uri, entity):
+        existing.update(record=entity)
+        return record if entity is None else None
+
+    CLIENTS.database.update_many([uri], create)
+    CLIENTS.known_audio.add(uri)
+    if existing['record'] is not None:
+        CLIENTS.scheduler.add(uri, count=existing['record'].get(
+            pybackend.scheduler.COUNT_FIELD, 0))
+        return already_have()
+    CLIENTS.scheduler.add(uri)
+
+    # Queue the rest of ingest, or run it now if there are no workers.
+    workers = CLIENTS.ingest
+    if workers is None:
+        try:
+            fields = pybackend.ingest.run(gid, file_ext, CLIENTS.storage)
+        except Exception:
+            app.logger.exception("Ingest failed for {}".format(gid))
+            fields = None
+
+        def finish(uri, entity):
+            if entity is not None:
+                entity.update(fields or {})
+                entity[status_field] = (pybackend.ingest.FAILED
+                                        if fields is None
+                                        else pybackend.ingest.READY)
+            return entity
+
+        CLIENTS.database.update_many([uri], finish)
+    else:
+        workers.submit(gid, file_ext)
     response_data = dict(
         uri=uri,
-        message="Received {} bytes of data.".format(len(bytestring)))
+        message="Received {} bytes of data.".format(num_bytes))
+
+    resp = Response(json.dumps(response_data),
+                    status=200 if workers is None else 202,
+                    mimetype=mimetypes.types_map[".json"])
+    resp.headers['Link'] = SOURCE
+    return resp
+
+
+def audio_exists(uri):
+    """Return whether audio is both indexed and stored.
+
+    Most new audio is ruled out by the in-memory index without any lookups.
+
+    Parameters
+    ----------
+    uri : str
+        URI of the audio.
+    """
+    return (audio_exists_many([uri])[0] and
+            CLIENTS.storage.exists(pybackend.urilib.split(uri)[1]))
 
-    resp = Response(json.dumps(response_data), status=200,
+
+def audio_exists_many(uris):
+    """Return whether each of many audio items is indexed.
+
+    Audio is only indexed once its data is stored, so this takes one batched
+    lookup, rather than checking storage for each item.
+
+    Parameters
+    ----------
+    uris : list of str
+        URIs of the audio.
+
+    Returns
+    -------
+    exists : list of bool
+        Whether each URI exists, in order.
+    """
+    exists = [uri in CLIENTS.known_audio for uri in uris]
+    candidates = [uri for uri, known in zip(uris, exists) if known]
+    records = dict(zip(candidates, CLIENTS.database.get_many(candidates)))
+    return [known and records[uri] is not None
+            for uri, known in zip(uris, exists)]
+
+
+@app.route('/api/v0.1/audio/exists', methods=['POST'])
+@authenticate
+def audio_exists_bulk():
+    """
+    To check which of many audio items are already stored, by gid:
+
+    $ curl -H "Content-type: application/json" \
+        -X POST localhost:8080/api/v0.1/audio/exists \
+        -d '{"gids": ["bbdde322-c604-4753-b828-9fe8addf17b9"]}'
+
+    Gids are computed from the data as with `pybackend.utils.uuid`, so
+    clients can skip uploading audio that is already stored. Returns an
+    object mapping each gid to true or false; at most MAX_EXISTS_BATCH gids
+    may be checked per request.
+    """
+    body = request.get_json(silent=True)
+    gids = body.get('gids') if isinstance(body, dict) else None
+    if not isinstance(gids, list) or len(gids) > MAX_EXISTS_BATCH:
+        status = 400
+        data = dict(message="Expected up to {} gids, as a JSON object "
+                            "with a list of `gids`.".format(MAX_EXISTS_BATCH))
+    else:
+        status = 200
+        try:
+            uris = [pybackend.urilib.join('audio', str(gid)) for gid in gids]
+            data = dict(exists=dict(zip(gids, audio_exists_many(uris))))
+        except ValueError as derp:
+            status, data = 400, dict(message=str(derp))
+
+    resp = Response(json.dumps(data), status=status,
                     mimetype=mimetypes.types_map[".json"])
     resp.headers['Link'] = SOURCE
     return resp
@@ -233,14 +600,19 @@ def audio_download(gid):
 
     $ curl -XGET localhost:8080/api/v0.1/audio/\
         bbdde322-c604-4753-b828-9fe8addf17b9
-    """
-    dbase = pybackend.database.Database(
-        project=app.config['cloud']['project'],
-        **app.config['cloud']['database'])
 
+    Single byte ranges are supported, e.g. `-H "Range: bytes=0-1023"`, and
+    the data is streamed back in chunks.
+
+    Query Parameters
+    ----------------
+    rendition : {preview, original}, default=preview
+        Which version of the audio to return; the original upload is returned
+        if there is no preview.
+    """
     uri = pybackend.urilib.join('audio', gid)
 
-    entity = dbase.get(uri)
+    entity = CLIENTS.database.get(uri)
     if entity is None:
         msg = "Resource not found: {}".format(uri)
         app.logger.info(msg)
@@ -249,23 +621,155 @@ def audio_download(gid):
             status=404)
 
     else:
-        store = pybackend.storage.Storage(
-            project=app.config['cloud']['project'],
-            **app.config['cloud']['storage'])
+        preview = entity.get('preview')
+        if preview and request.args.get('rendition') != 'original':
+            resp = stream_audio(preview['key'], preview['file_ext'])
+        else:
+            resp = stream_audio(gid, entity['file_ext'])
 
-        data = store.get(gid)
-        app.logger.debug("Returning {} bytes".format(len(data)))
+    resp.headers['Link'] = SOURCE
+    return resp
 
-        filename = os.path.extsep.join([gid, entity['file_ext']])
-        resp = send_file(
-            io.BytesIO(data),
-            attachment_filename=filename,
-            mimetype=pybackend.utils.mimetype_for_file(filename))
+
+@app.route('/api/v0.1/audio/<gid>/peaks', methods=['GET'])
+@authenticate
+def audio_peaks(gid):
+    """
+    To GET the precomputed waveform peaks of an audio item:
+
+    $ curl -XGET localhost:8080/api/v0.1/audio/\
+        bbdde322-c604-4753-b828-9fe8addf17b9/peaks
+
+    Peaks are derived from content-addressed audio, so they never change and
+    may be cached indefinitely.
+    """
+    uri = pybackend.urilib.join('audio', gid)
+
+    entity = CLIENTS.database.get(uri)
+    if entity is None or not entity.get('peaks'):
+        msg = "Peaks not found: {}".format(uri)
+        app.logger.info(msg)
+        resp = Response(
+            json.dumps(dict(message=msg)),
+            status=404)
+
+    else:
+        resp = Response(CLIENTS.storage.get(entity['peaks']),
+                        mimetype=mimetypes.types_map[".json"])
+        resp.headers['Cache-Control'] = CACHE_FOREVER
 
     resp.headers['Link'] = SOURCE
     return resp
 
 
+@app.route('/api/v0.1/audio/<gid>/spectrogram', methods=['GET'])
+@authenticate
+def audio_spectrogram(gid):
+    """
+    To GET the layout of the precomputed spectrogram tiles of an audio item:
+
+    $ curl -XGET localhost:8080/api/v0.1/audio/\
+        bbdde322-c604-4753-b828-9fe8addf17b9/spectrogram
+
+    Tiles are then fetched individually, by hop length and index.
+    """
+    uri = pybackend.urilib.join('audio', gid)
+
+    entity = CLIENTS.database.get(uri)
+    if entity is None or not entity.get('spectrogram'):
+        msg = "Spectrogram not found: {}".format(uri)
+        app.logger.info(msg)
+        resp = Response(
+            json.dumps(dict(message=msg)),
+            status=404)
+
+    else:
+        resp = Response(json.dumps(entity['spectrogram']),
+                        mimetype=mimetypes.types_map[".json"])
+
+    resp.headers['Link'] = SOURCE
+    return resp
+
+
+@app.route('/api/v0.1/audio/<gid>/spectrogram/<int:hop_length>/<int:index>',
+           methods=['GET'])
+@authenticate
+def audio_spectrogram_tile(gid, hop_length, index):
+    """
+    To GET a precomputed spectrogram tile, as a greyscale PNG:
+
+    $ curl -XGET localhost:8080/api/v0.1/audio/\
+        bbdde322-c604-4753-b828-9fe8addf17b9/spectrogram/256/0
+
+    Tiles are derived from content-addressed audio, so they never change and
+    may be cached indefinitely.
+    """
+    uri = pybackend.urilib.join('audio', gid)
+
+    entity = CLIENTS.database.get(uri) or {}
+    levels = dict((level['hop_length'], level['num_tiles'])
+                  for level in entity.get('spectrogram', {}).get('levels', []))
+    if index >= levels.get(hop_length, 0):
+        msg = "Spectrogram tile not found: {}/{}/{}".format(
+            uri, hop_length, index)
+        app.logger.info(msg)
+        resp = Response(
+            json.dumps(dict(message=msg)),
+            status=404)
+
+    else:
+        key = pybackend.ingest.tile_key(gid, hop_length, index)
+        resp = Response(CLIENTS.storage.get(key), mimetype='image/png')
+        resp.headers['Cache-Control'] = CACHE_FOREVER
+
+    resp.headers['Link'] = SOURCE
+    return resp
+
+
+def stream_audio(key, file_ext):
+    """Build a streaming response for an audio blob, honoring Range requests.
+
+    Parameters
+    ----------
+    key : str
+        Key of the audio data in storage.
+
+    file_ext : str
+        File extension of the audio, for the mimetype.
+
+    Returns
+    -------
+    resp : flask.Response
+        A 200 with the full data, a 206 with the requested byte range, or a
+        416 if the requested range can't be satisfied.
+    """
+    size = CLIENTS.storage.size(key)
+    filename = os.path.extsep.join([key, file_ext])
+    mimetype = pybackend.utils.mimetype_for_file(filename)
+
+    start, stop, status = 0, size, 200
+    if request.range is not None:
+        bounds = request.range.range_for_length(size)
+        if bounds is not None:
+            (start, stop), status = bounds, 206
+        elif len(request.range.ranges) == 1:
+            resp = Response(status=416)
+            resp.headers['Content-Range'] = 'bytes */{}'.format(size)
+            return resp
+        # Otherwise, e.g. for multiple ranges, ignore the header.
+
+    app.logger.debug("Returning bytes {}-{} of {}".format(start, stop, size))
+    resp = Response(
+        stream_with_context(CLIENTS.storage.iter_range(key, start, stop)),
+        status=status, mimetype=mimetype, direct_passthrough=True)
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Content-Length'] = str(stop - start)
+    if status == 206:
+        resp.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, stop - 1, size)
+    return resp
+
+
 @app.route('/api/v0.1/annotation/submit', methods=['POST'])
 @authenticate
 def annotation_submit():
@@ -279,21 +783,18 @@ def annotation_submit():
     if request.headers['Content-Type'] == 'application/json':
         app.logger.info("Received Annotation:\n{}"
                         .format(json.dumps(request.json, indent=2)))
-        # Do a thing with the annotation
-        # Return some progress stats?
-        data = json.dumps(dict(message='Success!'))
-        status = 200
+        error = validate_annotation(request.json)
+        if error:
+            status = 400
+            data = json.dumps(dict(message=error))
+        else:
+            data = json.dumps(dict(message='Success!'))
+            status = 200
 
-        db = pybackend.database.Database(
-            project=app.config['cloud']['project'],
-            **app.config['cloud']['database'])
-        gid = str(pybackend.utils.uuid(json.dumps(request.json)))
-        uri = pybackend.urilib.join('annotation', gid)
-        record = pybackend.models.AnnotationResponse(
-            created=str(datetime.datetime.now()),
-            response=request.json,
-            user_id='anonymous')
-        db.put(uri, record.flatten())
+            uri, record = annotation_record(request.json)
+            CLIENTS.annotations.put(uri, record)
+            count_annotation(request.json.get('recordingIndex'),
+                             pybackend.suggest.annotation_tags(request.json))
     else:
         status = 400
         data = json.dumps(dict(message='Invalid Content-Type; '
@@ -305,18 +806,238 @@ def annotation_submit():
     return resp
 
 
-def get_taxonomy():
-    tax_url = ("https://raw.githubusercontent.com/cosmir/open-mic/"
-               "master/data/instrument_taxonomy_v0.json")
-    res = requests.get(tax_url)
-    values = []
-    try:
-        schema = res.json()
-        values = schema['tag_open_mic_instruments']['value']['enum']
-    except BaseException as derp:
-        app.logger.error("Failed loading taxonomy: {}".format(derp))
+def annotation_record(response):
+    """Return the URI and flattened record under which to store an annotation.
 
-    return values
+    Parameters
+    ----------
+    response : dict
+        Annotation, as submitted.
+
+    Returns
+    -------
+    uri : str
+        URI of the annotation, derived from its content.
+
+    record : dict
+        Flattened `pybackend.models.AnnotationResponse`.
+    """
+    gid = str(pybackend.utils.uuid(json.dumps(response)))
+    uri = pybackend.urilib.join('annotation', gid)
+    record = pybackend.models.AnnotationResponse(
+        created=str(datetime.datetime.now()),
+        response=response,
+        user_id='anonymous')
+    return uri, record.flatten()
+
+
+def known_tag(tag):
+    """Whether a tag names an instrument in the taxonomy or the hierarchy."""
+    return (tag in TAXONOMY.instruments or
+            (HIERARCHY is not None and tag in HIERARCHY))
+
+
+def validate_annotation(response):
+    """Check the shape and tags of a submitted annotation.
+
+    Parameters
+    ----------
+    response : object
+        Annotation, as decoded from JSON.
+
+    Returns
+    -------
+    error : str or None
+        Description of the problem, or None if the annotation is valid.
+    """
+    if not isinstance(response, dict):
+        return "Expected a JSON object."
+    uri = response.get('recordingIndex')
+    if uri is not None:
+        try:
+            kind, _ = pybackend.urilib.split(uri)
+        except (ValueError, TypeError, AttributeError):
+            kind = None
+        if kind != 'audio':
+            return "Invalid recordingIndex: {}".format(uri)
+    if not isinstance(response.get('annotations', []), list):
+        return "Expected `annotations` to be a list."
+    unknown = [tag for tag in pybackend.suggest.annotation_tags(response)
+               if not known_tag(tag)]
+    if unknown:
+        return "Unknown instrument tags: {}".format(", ".join(unknown))
+    return None
+
+
+def count_annotation(uri, tags=()):
+    """Count an annotation against the audio item it describes.
+
+    The tally is stored on the audio record, so that the scheduler can be
+    re-seeded without scanning annotations, along with the tags heard so far,
+    from which later tasks for the clip draw suggestions. The tags are also
+    counted towards the stored co-occurrence counts behind suggestions. Both
+    are merged into the database in the background.
+
+    Parameters
+    ----------
+    uri : str or None
+        URI of the annotated audio, as given by the task's `recordingIndex`;
+        if None, only the tags are counted.
+
+    tags : list of str, default=()
+        Instrument tags of the annotation.
+    """
+    count_annotations([(uri, tags)])
+
+
+def count_annotations(annotations):
+    """Count many annotations against the audio items they describe.
+
+    Counts are merged into the database in the background, in transactions
+    of their own; the scheduler counts them right away.
+
+    Parameters
+    ----------
+    annotations : iterable of (uri, tags) tuples
+        URI of the annotated audio and instrument tags of each annotation;
+        see `count_annotation`.
+    """
+    tag_sets = []
+    for uri, tags in annotations:
+        tag_sets.append(tags)
+        if uri is None:
+            continue
+        try:
+            kind, gid = pybackend.urilib.split(uri or '')
+        except (ValueError, TypeError, AttributeError):
+            app.logger.warning("Annotation has no valid recordingIndex: {}"
+                               .format(uri))
+            continue
+        if kind != 'audio':
+            app.logger.warning("Annotated audio not found: {}".format(uri))
+            continue
+        AUDIO_COUNTS.add(uri, (1, set(tags)))
+        CLIENTS.scheduler.record(uri)
+
+    if SUGGEST is not None:
+        delta, count = SUGGEST.tally(tag_sets)
+        if count:
+            SUGGEST_COUNTS.add(SUGGEST_URI, delta)
+
+
+def iter_annotations(stream, mimetype):
+    """Decode the annotations of a bulk submission, one at a time.
+
+    Parameters
+    ----------
+    stream : file-like
+        Binary request body; a JSON array, or one JSON object per line.
+
+    mimetype : str
+        Mimetype of the body.
+
+    Yields
+    ------
+    response : object or ValueError
+        Each decoded annotation, or in its place the error decoding its line
+        of NDJSON. A malformed JSON array ends with its error.
+    """
+    if mimetype not in NDJSON_MIMETYPES:
+        try:
+            for response in pybackend.utils.iter_json_array(
+                    codecs.getreader('utf-8')(stream)):
+                yield response
+        except ValueError as derp:
+            yield derp
+        return
+
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line.decode('utf-8'))
+        except ValueError as derp:
+            yield derp
+
+
+@app.route('/api/v0.1/annotation/submit/bulk', methods=['POST'])
+@authenticate
+def annotation_submit_bulk():
+    """
+    To POST many annotations to this endpoint, as a JSON array:
+
+    $ curl -H "Content-type: application/json" \
+        -X POST localhost:8080/api/v0.1/annotation/submit/bulk \
+        -d '[{"recordingIndex": "audio:abc", "annotations": []}]'
+
+    or as newline-delimited JSON, with Content-type application/x-ndjson.
+
+    The body is decoded and validated as it is read, and annotations written
+    in batches of ANNOTATION_PUT_BATCH, so memory doesn't grow with the size
+    of the request. Returns a result per annotation, in order: either its
+    `uri`, or an `error` if it was rejected. At most MAX_ANNOTATION_BATCH
+    annotations are read per request; any more are answered with 413, as is
+    a malformed array with 400, after storing those that came before.
+    """
+    if request.mimetype != 'application/json' and \
+            request.mimetype not in NDJSON_MIMETYPES:
+        status = 400
+        data = dict(message='Invalid Content-Type; only accepts '
+                            'application/json or application/x-ndjson')
+        resp = Response(json.dumps(data), status=status,
+                        mimetype=mimetypes.types_map[".json"])
+        resp.headers['Link'] = SOURCE
+        return resp
+
+    ndjson = request.mimetype in NDJSON_MIMETYPES
+    status, message = 200, 'Success!'
+    results = []
+    responses = itertools.islice(
+        iter_annotations(request.stream, request.mimetype),
+        MAX_ANNOTATION_BATCH + 1)
+    for batch in pybackend.utils.chunks(responses, ANNOTATION_PUT_BATCH):
+        # Identical annotations share a URI, so are stored once.
+        records, counted = collections.OrderedDict(), []
+        for response in batch:
+            if isinstance(response, ValueError) and not ndjson:
+                status, message = 400, str(response)
+                break
+            if len(results) >= MAX_ANNOTATION_BATCH:
+                status = 413
+                message = "Stopped after {} annotations.".format(
+                    MAX_ANNOTATION_BATCH)
+                break
+            if isinstance(response, ValueError):
+                error = "Malformed JSON: {}".format(response)
+            else:
+                error = validate_annotation(response)
+            if error:
+                results.append(dict(error=error))
+                continue
+            uri, record = annotation_record(response)
+            records[uri] = record
+            results.append(dict(uri=uri))
+            counted.append((response.get('recordingIndex'),
+                            pybackend.suggest.annotation_tags(response)))
+
+        if records:
+            CLIENTS.annotations.put_many(records)
+            count_annotations(counted)
+
+    app.logger.info("Received {} annotations in bulk".format(len(results)))
+    num_stored = sum('uri' in result for result in results)
+    data = dict(message=message, num_stored=num_stored,
+                num_failed=len(results) - num_stored, results=results)
+    resp = Response(json.dumps(data), status=status,
+                    mimetype=mimetypes.types_map[".json"])
+    resp.headers['Link'] = SOURCE
+    return resp
+
+
+def get_taxonomy():
+    """Return the instrument tags, from the in-process cache."""
+    return TAXONOMY.instruments
 
 
 @app.route('/api/v0.1/annotation/taxonomy', methods=['GET'])
@@ -326,10 +1047,32 @@ def annotation_taxonomy():
 
     $ curl -X GET localhost:8080/api/v0.1/annotation/taxonomy
     """
-    instruments = get_taxonomy()
-    status = 200 if instruments else 400
+    resp = Response(TAXONOMY.json, mimetype=mimetypes.types_map[".json"])
+    resp.headers['Link'] = SOURCE
+    return resp
+
+
+@app.route('/api/v0.1/metrics', methods=['GET'])
+@authenticate
+def metrics():
+    """
+    To fetch data at this endpoint:
 
-    resp = Response(json.dumps(instruments), status=status)
+    $ curl -X GET localhost:8080/api/v0.1/metrics
+
+    Reports the depth of the background queues: ingest jobs, and, if
+    annotations are buffered, their write-behind journal, as well as the
+    audio and suggestion counts yet to be merged.
+    """
+    annotations = CLIENTS.annotations
+    ingest = CLIENTS.ingest
+    data = dict(
+        ingest=None if ingest is None else dict(depth=len(ingest.queue)),
+        write_behind=(annotations.stats()
+                      if hasattr(annotations, 'stats') else None),
+        counts=AUDIO_COUNTS.stats(),
+        suggest=None if SUGGEST_COUNTS is None else SUGGEST_COUNTS.stats())
+    resp = Response(json.dumps(data), mimetype=mimetypes.types_map[".json"])
     resp.headers['Link'] = SOURCE
     return resp
 
@@ -342,23 +1085,38 @@ def next_task():
 
     $ curl -X GET localhost:8080/api/v0.1/task
     """
-    db = pybackend.database.Database(
-        project=app.config['cloud']['project'],
-        **app.config['cloud']['database'])
+    random_uri = CLIENTS.scheduler.sample()
+    if random_uri is None:
+        resp = Response(
+            json.dumps(dict(message="No tasks available.")), status=404)
+        resp.headers['Link'] = SOURCE
+        return resp
 
-    random_uri = random.choice(list(db.uris(kind='audio')))
     audio_url = "api/v0.1/audio/{gid}".format(
         gid=pybackend.urilib.split(random_uri)[1])
 
+    entity = CLIENTS.database.get(random_uri) or {}
+    # Catch up on annotations counted by other instances.
+    CLIENTS.scheduler.sync(random_uri,
+                           entity.get(pybackend.scheduler.COUNT_FIELD, 0))
     task = dict(feedback="none",
                 visualization=random.choice(['waveform', 'spectrogram']),
-                proximityTag=[],
+                proximityTag=([] if SUGGEST is None
+                              else SUGGEST.suggest(entity.get('tags', []))),
                 annotationTag=get_taxonomy(),
                 url=audio_url,
                 numRecordings='?',
                 recordingIndex=random_uri,
                 tutorialVideoURL="https://www.youtube.com/embed/Bg8-83heFRM",
                 alwaysShowTags=True)
+
+    # Point at precomputed visualizations, so they can be drawn before (or
+    # without) fetching the audio.
+    if entity.get('peaks'):
+        task.update(peaksUrl="{}/peaks".format(audio_url))
+    if entity.get('spectrogram'):
+        task.update(spectrogramUrl="{}/spectrogram".format(audio_url))
+
     data = json.dumps(dict(task=task))
     app.logger.debug("Returning:\n{}".format(data))
     resp = Response(data)
@@ -366,6 +1124,52 @@ def next_task():
     return resp
 
 
+def ingest_backlog(processes=None):
+    """Run ingest stages, in parallel, over stored audio missing any of their
+    results.
+
+    Parameters
+    ----------
+    processes : int, default=None
+        Number of worker processes; defaults to the number of CPUs.
+
+    Returns
+    -------
+    count : int
+        Number of audio items updated.
+    """
+    dbase = CLIENTS.database
+    fields = [stage.field for stage in pybackend.ingest.STAGES]
+    jobs = []
+    for uris in pybackend.utils.chunks(dbase.uris(kind='audio'), 1000):
+        for uri, record in zip(uris, dbase.get_many(uris)):
+            if record and not all(field in record for field in fields):
+                gid = pybackend.urilib.split(uri)[1]
+                jobs.append((gid, record['file_ext']))
+
+    app.logger.info("Ingesting {} audio items".format(len(jobs)))
+    count = 0
+    results = pybackend.ingest.run_many(jobs, CLIENTS.storage_kwargs,
+                                        processes=processes)
+    for gid, result in results:
+        if result == {}:
+            # Decoding is unavailable; leave the record as it was.
+            continue
+
+        def finish(uri, record):
+            if record is not None:
+                record.update(result or {})
+                record[pybackend.ingest.STATUS_FIELD] = (
+                    pybackend.ingest.FAILED if result is None
+                    else pybackend.ingest.READY)
+            return record
+
+        # Annotations may be counted on the record meanwhile.
+        dbase.update_many([pybackend.urilib.join('audio', gid)], finish)
+        count += result is not None
+    return count
+
+
 @app.errorhandler(500)
 def server_error(e):
     logging.exception('An error occurred during a request.')
@@ -391,6 +1195,19 @@ if __name__ == '__main__':
         "--debug",
         action='store_true',
         help="Run the Flask application in debug mode.")
+    parser.add_argument(
+        "--ingest-backlog",
+        action='store_true',
+        help="Run ingest stages over stored audio missing their results, "
+             "then exit.")
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="Number of worker processes for --ingest-backlog.")
+    parser.add_argument(
+        "--rebuild-suggestions",
+        action='store_true',
+        help="Recount tag suggestions over all stored annotations, then "
+             "exit.")
 
     args = parser.parse_args()
     app.config['noauth'] = args.noauth
@@ -400,4 +1217,17 @@ if __name__ == '__main__':
             cfg = yaml.load(fp)
             configure(cfg)
 
-    app.run(debug=args.debug, host=args.host, port=args.port)
+    if args.ingest_backlog:
+        count = ingest_backlog(processes=args.processes)
+        print("Updated {} audio items.".format(count))
+    elif args.rebuild_suggestions:
+        if SUGGEST is None:
+            parser.error("No `suggest` section is configured.")
+        count = rebuild_suggestions(os.path.join(
+            os.path.dirname(__file__), cfg['suggest']['tracks']))
+        print("Counted {} annotations.".format(count))
+    else:
+        # Start the ingest workers, to pick up any jobs left from a restart;
+        # otherwise they start with the first upload.
+        CLIENTS.ingest
+        app.run(debug=args.debug, host=args.host, port=args.port)
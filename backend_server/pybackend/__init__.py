@@ -1,10 +1,20 @@
 
 GCLOUD = 'gcloud'
 LOCAL = 'local'
+SQLITE = 'sqlite'
+TIERED = 'tiered'
 
+from . import audio
+from . import bloom
 from . import database
+from . import ingest
+from . import jobqueue
 from . import models
 from . import oauth
+from . import registry
+from . import scheduler
 from . import storage
+from . import suggest
+from . import taxonomy
 from . import urilib
 from . import utils
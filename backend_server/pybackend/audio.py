@@ -0,0 +1,433 @@
+"""Audio decoding and analysis, for precomputing visualizations at ingest.
+
+Clips are decoded once, as a stream of mono float blocks, and each block is
+handed to a set of stages that accumulate their results incrementally; memory
+use therefore depends on the size of the results, not the length of the clip.
+
+Example
+-------
+>>> import pybackend.audio as A
+>>> with A.AudioStream('my_song.wav') as stream:
+...     peaks = A.Peaks(stream.sample_rate)
+...     for block in stream:
+...         peaks.update(block)
+>>> peaks.finalize()['levels'][0]['samples_per_pixel']
+256
+"""
+import numpy as np
+import tempfile
+import wave
+
+try:
+    import audioread
+except ImportError:
+    audioread = None
+
+# Whether audio can be decoded here; `audioread` is an optional dependency,
+# and needs decoders not available on every runtime.
+AVAILABLE = audioread is not None
+
+
+class _DecodeError(Exception):
+    pass
+
+
+# Errors raised by `AudioStream` for data that can't be decoded.
+DecodeError = audioread.DecodeError if AVAILABLE else _DecodeError
+
+PEAKS_LEVELS = (256, 1024, 4096)
+PEAKS_BITS = 8
+
+SPECTROGRAM_N_FFT = 512
+SPECTROGRAM_LEVELS = (256, 1024, 4096)
+SPECTROGRAM_TILE_WIDTH = 256
+# Log-magnitudes are clipped to this many dB below full scale.
+SPECTROGRAM_DB_RANGE = 80.0
+
+PREVIEW_SAMPLE_RATE = 16000
+PREVIEW_NUM_TAPS = 63
+
+
+class AudioStream(object):
+    """Decode an audio file into blocks of mono samples in [-1, 1].
+
+    Parameters
+    ----------
+    path : str
+        Audio file to decode; supported formats depend on the decoders
+        available to `audioread`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if audioread is None:
+            raise DecodeError("audioread is not installed")
+        self._file = audioread.audio_open(self.path)
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        self._file = None
+
+    @property
+    def sample_rate(self):
+        return self._file.samplerate
+
+    @property
+    def channels(self):
+        return self._file.channels
+
+    def __iter__(self):
+        width = 2 * self.channels
+        remainder = b''
+        for buf in self._file:
+            # Decoders yield 16-bit interleaved frames, but make no promise
+            # that buffers end on a frame boundary.
+            buf = remainder + buf
+            num_bytes = len(buf) - len(buf) % width
+            remainder = buf[num_bytes:]
+            if not num_bytes:
+                continue
+            frames = np.frombuffer(buf[:num_bytes], dtype='<i2')
+            frames = frames.reshape(-1, self.channels)
+            yield frames.mean(axis=1, dtype=np.float32) / 32768.0
+
+
+def _frame_reduce(mins, maxs, factor):
+    """Reduce min / max envelopes by an integer factor, keeping any ragged
+    final frame."""
+    idx = np.arange(0, len(mins), factor)
+    if not len(idx):
+        return mins, maxs
+    return np.minimum.reduceat(mins, idx), np.maximum.reduceat(maxs, idx)
+
+
+def _quantize(values, bits):
+    scale = 2 ** (bits - 1)
+    return np.clip(np.round(values * scale), -scale, scale - 1).astype(int)
+
+
+class Peaks(object):
+    """Min / max peak envelopes of a signal at several zoom levels.
+
+    The envelope is computed at the finest level as blocks arrive, and each
+    coarser level is reduced from it at the end, so every level must be a
+    multiple of the finest.
+
+    Parameters
+    ----------
+    sample_rate : int
+        Sampling rate of the signal.
+
+    levels : iterable of int, default=(256, 1024, 4096)
+        Number of samples summarized by each peak, per zoom level.
+
+    bits : int, default=8
+        Resolution of the stored peaks; values are integers in
+        [-2**(bits - 1), 2**(bits - 1)).
+    """
+
+    def __init__(self, sample_rate, levels=PEAKS_LEVELS, bits=PEAKS_BITS):
+        self.sample_rate = sample_rate
+        self.levels = sorted(levels)
+        self.bits = bits
+        self.frame_length = self.levels[0]
+        if any(level % self.frame_length for level in self.levels):
+            raise ValueError("Peak levels must be multiples of the finest: {}"
+                             .format(self.levels))
+        self.length = 0
+        self._mins = []
+        self._maxs = []
+        self._buffer = np.zeros(0, dtype=np.float32)
+
+    def update(self, y):
+        """Accumulate a block of samples."""
+        self.length += len(y)
+        buf = np.concatenate([self._buffer, y])
+        num_samples = len(buf) - len(buf) % self.frame_length
+        frames = buf[:num_samples].reshape(-1, self.frame_length)
+        self._mins.append(frames.min(axis=1))
+        self._maxs.append(frames.max(axis=1))
+        self._buffer = buf[num_samples:]
+
+    def finalize(self):
+        """Return the peaks at every level.
+
+        Returns
+        -------
+        peaks : dict
+            Object with the `sample_rate`, `length` in samples and `bits` of
+            the peaks, and a list of `levels`, each with its
+            `samples_per_pixel` and `data` as interleaved min / max pairs.
+        """
+        if len(self._buffer):
+            self._mins.append(self._buffer.min(keepdims=True))
+            self._maxs.append(self._buffer.max(keepdims=True))
+            self._buffer = self._buffer[:0]
+        mins = np.concatenate(self._mins or [np.zeros(0, dtype=np.float32)])
+        maxs = np.concatenate(self._maxs or [np.zeros(0, dtype=np.float32)])
+
+        levels = []
+        for level in self.levels:
+            lmins, lmaxs = _frame_reduce(mins, maxs,
+                                         level // self.frame_length)
+            data = np.empty(2 * len(lmins), dtype=int)
+            data[0::2] = _quantize(lmins, self.bits)
+            data[1::2] = _quantize(lmaxs, self.bits)
+            levels.append(dict(samples_per_pixel=level, data=data.tolist()))
+
+        return dict(sample_rate=self.sample_rate, length=self.length,
+                    bits=self.bits, levels=levels)
+
+
+class Spectrogram(object):
+    """Log-magnitude spectrogram of a signal, cut into tiles at several time
+    resolutions.
+
+    Frames are transformed in batches as blocks arrive. The finest level is
+    the STFT itself, and coarser levels are max-pooled from it, so every
+    level must be a multiple of the finest. Completed tiles are returned as
+    soon as they are available, so only the frames of a partial tile, per
+    level, are held in memory.
+
+    Parameters
+    ----------
+    sample_rate : int
+        Sampling rate of the signal.
+
+    n_fft : int, default=512
+        Length of each analysis frame, in samples.
+
+    levels : iterable of int, default=(256, 1024, 4096)
+        Hop between frames, in samples, per time resolution.
+
+    tile_width : int, default=256
+        Number of frames per tile.
+
+    db_range : float, default=80.0
+        Dynamic range of the tiles, in dB below full scale.
+    """
+
+    def __init__(self, sample_rate, n_fft=SPECTROGRAM_N_FFT,
+                 levels=SPECTROGRAM_LEVELS,
+                 tile_width=SPECTROGRAM_TILE_WIDTH,
+                 db_range=SPECTROGRAM_DB_RANGE):
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.levels = sorted(levels)
+        self.hop_length = self.levels[0]
+        if any(level % self.hop_length for level in self.levels):
+            raise ValueError("Spectrogram levels must be multiples of the "
+                             "finest: {}".format(self.levels))
+        self.tile_width = tile_width
+        self.db_range = db_range
+        self.window = np.hanning(n_fft).astype(np.float32)
+        # Scale so that a full-scale sinusoid peaks at 0dB.
+        self._norm = 2.0 / self.window.sum()
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._pending = dict((level, []) for level in self.levels)
+        self._num_pending = dict((level, 0) for level in self.levels)
+        self._num_frames = dict((level, 0) for level in self.levels)
+        self._num_tiles = dict((level, 0) for level in self.levels)
+
+    @property
+    def num_bins(self):
+        return self.n_fft // 2 + 1
+
+    def _stft(self, y):
+        num_frames = 1 + (len(y) - self.n_fft) // self.hop_length
+        idx = (np.arange(self.n_fft)[np.newaxis, :] +
+               self.hop_length * np.arange(num_frames)[:, np.newaxis])
+        spec = np.abs(np.fft.rfft(y[idx] * self.window, axis=1))
+        db = 20 * np.log10(np.maximum(spec * self._norm, 1e-10))
+        scaled = 255 * (1 + db / self.db_range)
+        return np.clip(np.round(scaled), 0, 255).astype(np.uint8)
+
+    def _tile(self, level, frames):
+        index = self._num_tiles[level]
+        self._num_tiles[level] += 1
+        self._num_frames[level] += len(frames)
+        # Low frequencies at the bottom of the image.
+        return level, index, frames.T[::-1]
+
+    def _pool(self, level, frames):
+        factor = level // self.hop_length
+        idx = np.arange(0, len(frames), factor)
+        return np.maximum.reduceat(frames, idx, axis=0)
+
+    def _push(self, frames, final=False):
+        tiles = []
+        for level in self.levels:
+            pending = self._pending[level]
+            pending.append(frames)
+            self._num_pending[level] += len(frames)
+            size = self.tile_width * level // self.hop_length
+            if self._num_pending[level] < size and not final:
+                continue
+            pending = np.concatenate(pending)
+            offset = 0
+            while len(pending) - offset >= size:
+                tiles.append(self._tile(
+                    level, self._pool(level, pending[offset:offset + size])))
+                offset += size
+            if final and offset < len(pending):
+                tiles.append(self._tile(
+                    level, self._pool(level, pending[offset:])))
+                offset = len(pending)
+            self._pending[level] = [pending[offset:]]
+            self._num_pending[level] = len(pending) - offset
+        return tiles
+
+    def update(self, y):
+        """Accumulate a block of samples.
+
+        Returns
+        -------
+        tiles : list of (level, index, image) tuples
+            Any tiles completed by this block; images are uint8 arrays of
+            shape (num_bins, tile_width), with the highest frequency first.
+        """
+        buf = np.concatenate([self._buffer, y])
+        if len(buf) < self.n_fft:
+            self._buffer = buf
+            return []
+        frames = self._stft(buf)
+        self._buffer = buf[len(frames) * self.hop_length:]
+        return self._push(frames)
+
+    def finalize(self):
+        """Flush the remaining frames.
+
+        The signal is zero-padded so that every sample is covered by a frame,
+        and the last tile of each level may be narrower than `tile_width`.
+
+        Returns
+        -------
+        tiles : list of (level, index, image) tuples
+            The remaining tiles; see `update`.
+        """
+        overlap = self.n_fft - self.hop_length
+        analyzed = (self._num_frames[self.hop_length] +
+                    self._num_pending[self.hop_length])
+        if len(self._buffer) > overlap or (len(self._buffer) and
+                                           not analyzed):
+            num_frames = max(1, int(np.ceil(
+                float(len(self._buffer) - overlap) / self.hop_length)))
+            buf = np.zeros(overlap + num_frames * self.hop_length,
+                           dtype=np.float32)
+            buf[:len(self._buffer)] = self._buffer
+            frames = self._stft(buf)
+        else:
+            frames = np.zeros((0, self.num_bins), dtype=np.uint8)
+        self._buffer = self._buffer[:0]
+        return self._push(frames, final=True)
+
+    def describe(self):
+        """Return the parameters and layout of the tiles produced so far.
+
+        Returns
+        -------
+        info : dict
+            Object with the `sample_rate`, `n_fft`, `num_bins`, `tile_width`
+            and `db_range` of the spectrogram, and a list of `levels`, each
+            with its `hop_length`, `num_frames` and `num_tiles`.
+        """
+        levels = [dict(hop_length=level,
+                       num_frames=self._num_frames[level],
+                       num_tiles=self._num_tiles[level])
+                  for level in self.levels]
+        return dict(sample_rate=self.sample_rate, n_fft=self.n_fft,
+                    num_bins=self.num_bins, tile_width=self.tile_width,
+                    db_range=self.db_range, levels=levels)
+
+
+def _lowpass(cutoff, num_taps):
+    """Windowed-sinc lowpass filter; `cutoff` is a fraction of Nyquist."""
+    n = np.arange(num_taps) - (num_taps - 1) / 2.0
+    taps = cutoff * np.sinc(cutoff * n) * np.hamming(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+class Preview(object):
+    """A compact rendition of a signal, as mono 16-bit WAV data at a reduced
+    sampling rate.
+
+    Blocks are lowpass filtered and resampled as they arrive, and written to
+    a temporary file that only rolls over to disk once it grows large.
+
+    Parameters
+    ----------
+    sample_rate : int
+        Sampling rate of the signal.
+
+    target_rate : int, default=16000
+        Sampling rate of the rendition; signals at or below this rate are
+        not resampled.
+
+    num_taps : int, default=63
+        Length of the anti-aliasing filter.
+    """
+
+    def __init__(self, sample_rate, target_rate=PREVIEW_SAMPLE_RATE,
+                 num_taps=PREVIEW_NUM_TAPS):
+        self.sample_rate = sample_rate
+        self.target_rate = min(target_rate, sample_rate)
+        self._step = float(sample_rate) / self.target_rate
+        self._taps = _lowpass(0.9 / self._step, num_taps)
+        self._history = np.zeros(num_taps - 1, dtype=np.float32)
+        # Position of the next output sample, and the last input sample
+        # before the current block, in input samples.
+        self._next = 0.0
+        self._last = None
+        self._offset = 0
+        self._fp = tempfile.SpooledTemporaryFile(max_size=2 ** 22)
+        self._wav = wave.open(self._fp, 'wb')
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(self.target_rate)
+
+    def _resample(self, y):
+        if self._step == 1:
+            return y
+        # Anti-alias, delaying the signal by half the filter length.
+        buf = np.concatenate([self._history, y])
+        y = np.convolve(buf, self._taps, mode='valid')
+        self._history = buf[len(buf) - len(self._history):]
+
+        # Interpolate across the boundary with the previous block.
+        start = self._offset
+        if self._last is not None:
+            y = np.concatenate([[self._last], y])
+            start -= 1
+        stop = self._offset + len(y) - (self._last is not None)
+        self._offset = stop
+        self._last = y[-1]
+        times = np.arange(self._next, stop - 1 + 1e-9, self._step)
+        if len(times):
+            self._next = times[-1] + self._step
+        return np.interp(times - start, np.arange(len(y)), y)
+
+    def update(self, y):
+        """Accumulate a block of samples."""
+        y = self._resample(y)
+        data = np.round(np.clip(y, -1, 1) * 32767).astype('<i2')
+        self._wav.writeframes(data.tobytes())
+
+    def finalize(self):
+        """Return the rendition.
+
+        Returns
+        -------
+        fp : file-like
+            Temporary file holding the WAV data, positioned at the start.
+
+        num_bytes : int
+            Length of the data.
+        """
+        self._wav.close()
+        num_bytes = self._fp.tell()
+        self._fp.seek(0)
+        return self._fp, num_bytes
@@ -0,0 +1,76 @@
+"""Compact, probabilistic set membership.
+
+A Bloom filter never forgets a key it was given, but may claim to hold keys
+it was not, at a rate set by its size; it is useful for ruling out expensive
+lookups of keys that are definitely absent.
+
+Example
+-------
+>>> import pybackend.bloom as B
+>>> known = B.BloomFilter(capacity=1000, error_rate=0.01)
+>>> known.add('audio:abc')
+>>> 'audio:abc' in known
+True
+>>> 'audio:xyz' in known
+False
+"""
+import hashlib
+import math
+import struct
+import threading
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        """Create an empty Bloom filter.
+
+        Parameters
+        ----------
+        capacity : int, default=1000000
+            Number of keys the filter is sized for; more may be added, at the
+            cost of a higher false positive rate.
+
+        error_rate : float, default=0.01
+            False positive rate once `capacity` keys have been added.
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        num_bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.num_bits = max(8, int(math.ceil(num_bits)))
+        self.num_hashes = max(1, int(round(
+            self.num_bits / float(capacity) * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of keys added, counting repeats."""
+        return self._count
+
+    def _indexes(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        # Double hashing: derive every index from two independent hashes.
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(h1 + idx * h2) % self.num_bits
+                for idx in range(self.num_hashes)]
+
+    def add(self, key):
+        """Add a key to the filter.
+
+        Parameters
+        ----------
+        key : str or bytes
+            Key to add.
+        """
+        indexes = self._indexes(key)
+        with self._lock:
+            for idx in indexes:
+                self._bits[idx >> 3] |= 1 << (idx & 7)
+            self._count += 1
+
+    def __contains__(self, key):
+        """Whether the key may have been added; False is always correct."""
+        return all(self._bits[idx >> 3] & (1 << (idx & 7))
+                   for idx in self._indexes(key))
@@ -13,12 +13,32 @@ Example
 {'a': 15, 'b': ['heya', 'hihi']}
 """
 
+import collections
+import contextlib
+import copy
 import json
 from google.cloud import datastore
+from google.cloud import exceptions as gexceptions
+import itertools
+import logging
 import os
+import threading
+import time
+import uuid
 
-from . import GCLOUD, LOCAL
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from . import GCLOUD, LOCAL, SQLITE
 from . import urilib
+from . import utils
 
 # Start clean
 WRITE = 'w'
@@ -27,15 +47,91 @@ APPEND = 'a'
 # Immutable / write-safe
 READ = 'r'
 
+# Datastore limits on the number of keys / entities per RPC
+MAX_GET_BATCH = 1000
+MAX_PUT_BATCH = 500
+
+# Datastore limit on the number of entity groups per transaction
+MAX_TXN_BATCH = 25
+# Attempts at a Datastore transaction before giving up on contention
+MAX_TXN_ATTEMPTS = 5
+
+# SQLite limit on the number of host parameters per statement
+MAX_SQLITE_PARAMS = 999
+
+# Journal operations
+PUT = 'put'
+DELETE = 'delete'
+JOURNAL_EXT = 'journal'
+LOCK_EXT = 'lock'
+
+logger = logging.getLogger(__name__)
+
+
+def _replace(src, dst):
+    """Atomically move `src` over `dst`, where the platform allows."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+class Commit(object):
+    """A handle on pending writes, resolved once they are flushed to disk."""
+
+    def __init__(self):
+        self._event = threading.Event()
 
-class LocalClient():
+    def done(self):
+        """Whether or not the writes have been flushed."""
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the writes have been flushed.
+
+        Parameters
+        ----------
+        timeout : float, default=None
+            Maximum time in seconds to wait; if None, waits indefinitely.
+
+        Returns
+        -------
+        done : bool
+            True if the writes were flushed, False on timeout.
+        """
+        self._event.wait(timeout)
+        return self.done()
+
+    def _resolve(self):
+        self._event.set()
+
+
+class LocalClient(object):
     """A "local" JSON backed database object.
 
+    Writes are log-structured: every `put` / `delete` appends a single record
+    to a journal file that lives next to the JSON snapshot, and opening the
+    database replays the snapshot followed by the journal. Once the journal
+    grows past `compact_threshold` entries, the snapshot is rewritten and the
+    journal truncated.
+
+    With `shared=True`, several processes may use the same files: every
+    operation holds an advisory lock on a `.lock` file -- shared for reads,
+    exclusive for writes -- and first catches up on anything other processes
+    have appended to the journal (or reloads, if they compacted it).
+
+    Setting `flush_interval` and / or `flush_every` enables group commit: a
+    background thread flushes (and fsyncs) the journal periodically, bounding
+    data loss on a crash while keeping writes close to in-memory speed. Use
+    `commit()` to wait on durability, and `close()` to stop the thread.
+
     TODO: Can / could use a slightly smarter backend to easily mimic the
     functionality we'll need (multiple indexing), e.g. pandas, mongo, etc.
     """
 
-    def __init__(self, project, filepath='', mode=APPEND, atomic=True):
+    def __init__(self, project, filepath='', mode=APPEND, atomic=True,
+                 compact_threshold=10000, shared=False, flush_interval=None,
+                 flush_every=None):
         """Create a local database client.
 
         Parameters
@@ -53,36 +149,321 @@ class LocalClient():
              * 'a': append; will attempt to add to the current database.
 
         atomic : bool, default=True
-            If True, will flush the database to disk on every `put` operation.
+            If True, will flush the journal to disk on every `put` operation.
             Trades performance / speed for guarantees that all data is written.
+
+        compact_threshold : int, default=10000
+            Number of journal entries after which the snapshot is rewritten
+            and the journal truncated.
+
+        shared : bool, default=False
+            If True, lock the database files so that multiple processes can
+            safely read and write them concurrently. Requires `filepath`.
+
+        flush_interval : float, default=None
+            If given, flush pending writes in the background at least this
+            often, in seconds; `atomic` is then ignored.
+
+        flush_every : int, default=None
+            If given, flush in the background once this many writes are
+            pending; `atomic` is then ignored.
         """
         self._collection = dict()
+        self._lock = threading.RLock()
+        self._kinds = dict()
         self._filepath = filepath
+        self._journal_path = os.path.extsep.join([filepath, JOURNAL_EXT])
+        self._journal = None
+        self._journal_entries = 0
+        self._offset = 0
+        self._snapshot = None
+        self._loaded = False
+        self._lockfile = None
+        self._lock_depth = 0
         self.mode = mode
         self.atomic = atomic
-        append_conds = [self.mode in [APPEND, READ],
-                        os.path.exists(self._filepath)]
-        if all(append_conds):
-            with open(self._filepath) as fp:
-                loaded_items = json.load(fp)
-            self._collection.update(**loaded_items)
+        self.compact_threshold = compact_threshold
+        self.shared = shared
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self._pending = 0
+        self._waiters = []
+        self._flusher = None
+        self._closing = False
+        self._cond = threading.Condition(self._lock)
+        if self.shared:
+            if fcntl is None:
+                raise NotImplementedError(
+                    "File locking is not supported on this platform.")
+            elif not self._filepath:
+                raise ValueError("`filepath` must be given if shared=True")
+            self._lockfile = open(
+                os.path.extsep.join([filepath, LOCK_EXT]), 'a')
+
+        with self._guard(exclusive=True):
+            if self.mode in [APPEND, READ] and self._filepath:
+                self._load()
+            elif self.writable:
+                # Start clean.
+                self.compact()
+            self._loaded = True
+
+        if self.writable and (flush_interval or flush_every):
+            self._flusher = threading.Thread(target=self._run_flusher,
+                                             name='LocalClient-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
 
     def __del__(self):
         if self._collection is not None:
-            self.flush()
+            self.close()
 
-    def flush(self):
-        """Flush all changes to disk."""
-        write_conds = [self.mode in [WRITE, APPEND],
-                       bool(self._filepath)]
-        if all(write_conds):
-            with open(self._filepath, 'w') as fp:
+    @property
+    def writable(self):
+        """Whether or not changes are persisted to disk."""
+        return self.mode in [WRITE, APPEND] and bool(self._filepath)
+
+    @contextlib.contextmanager
+    def _guard(self, exclusive=False):
+        """Serialize access across threads and, if shared, processes.
+
+        Only the outermost call takes the file lock; `exclusive` should be
+        True for anything that writes.
+        """
+        with self._lock:
+            if not self.shared or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+
+            fcntl.flock(self._lockfile.fileno(),
+                        fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_depth += 1
+            try:
+                if self._loaded:
+                    self._sync(exclusive)
+                yield
+                # Others must see our writes before the lock is released.
+                self.flush()
+            finally:
+                self._lock_depth -= 1
+                fcntl.flock(self._lockfile.fileno(), fcntl.LOCK_UN)
+
+    def _snapshot_id(self):
+        """Identify the snapshot on disk; compaction replaces the file."""
+        try:
+            stat = os.stat(self._filepath)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def _sync(self, exclusive=False):
+        """Catch up on changes made to the files by other processes.
+
+        Parameters
+        ----------
+        exclusive : bool, default=False
+            Whether the exclusive lock is held, in which case a torn entry
+            left by another process is dropped before this one appends.
+        """
+        if self._snapshot_id() != self._snapshot:
+            self._collection.clear()
+            self._kinds.clear()
+            self._load(truncate=exclusive)
+        elif not self._replay() and exclusive:
+            self._truncate_journal()
+
+    def _truncate_journal(self):
+        """Drop a torn entry past the current offset, or it would corrupt
+        the next append."""
+        if self.writable:
+            with open(self._journal_path, 'ab') as fp:
+                fp.truncate(self._offset)
+
+    def _load(self, truncate=True):
+        """Stream the snapshot and journal from disk into the collection.
+
+        Parameters
+        ----------
+        truncate : bool, default=True
+            Whether to drop a torn entry at the end of the journal; only safe
+            while no other process may be appending.
+        """
+        start = time.time()
+        self._snapshot = self._snapshot_id()
+        if self._snapshot is not None:
+            with open(self._filepath) as fp:
+                for uri, record in utils.iter_json_items(fp):
+                    self._apply(PUT, uri, record)
+
+        self._offset = 0
+        self._journal_entries = 0
+        if not self._replay() and truncate:
+            self._truncate_journal()
+
+        logger.info("Loaded {} records from {} in {:.3f}s; peak RSS: {} bytes"
+                    .format(len(self._collection), self._filepath,
+                            time.time() - start, utils.max_rss()))
+
+    def _replay(self):
+        """Apply journaled operations past the current offset.
+
+        Returns
+        -------
+        success : bool
+            False if a torn or malformed entry was found.
+        """
+        if not os.path.exists(self._journal_path):
+            return True
+
+        with open(self._journal_path, 'rb') as fp:
+            fp.seek(self._offset)
+            for line in fp:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("Incomplete entry")
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # A torn write at the tail of the journal, e.g. after a
+                    # crash; everything before it is still valid.
+                    logger.warning("Ignoring malformed journal entry in {}"
+                                   .format(self._journal_path))
+                    return False
+                self._apply(*entry)
+                self._journal_entries += 1
+                self._offset += len(line)
+        return True
+
+    def _apply(self, op, uri, record=None):
+        if op == PUT:
+            self._index(uri)
+            self._collection[uri] = record
+        elif op == DELETE:
+            self._collection.pop(uri, None)
+            self._index(uri, remove=True)
+
+    def _index(self, uri, remove=False):
+        """Maintain the per-kind partition of URIs."""
+        kind = urilib.split(uri)[0]
+        if remove:
+            self._kinds.get(kind, set()).discard(uri)
+        else:
+            self._kinds.setdefault(kind, set()).add(uri)
+
+    def _log(self, *entry):
+        """Append an operation to the journal."""
+        if not self.writable:
+            return
+
+        if self._journal is None:
+            self._journal = open(self._journal_path, 'ab')
+        data = (json.dumps(entry) + '\n').encode('utf-8')
+        self._journal.write(data)
+        self._journal_entries += 1
+        self._offset += len(data)
+
+    def flush(self, sync=False):
+        """Flush all changes to disk.
+
+        Parameters
+        ----------
+        sync : bool, default=False
+            If True, also fsync the journal so it survives an OS crash.
+        """
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                if sync:
+                    os.fsync(self._journal.fileno())
+
+    def commit(self):
+        """Request that all writes made so far are flushed to disk.
+
+        Returns
+        -------
+        commit : Commit
+            Handle to `wait()` on; already resolved unless group commit is
+            enabled, in which case the background thread flushes promptly.
+        """
+        future = Commit()
+        with self._lock:
+            if self._flusher is None:
+                self.flush(sync=True)
+                future._resolve()
+            else:
+                self._waiters.append(future)
+                self._cond.notify()
+        return future
+
+    def _run_flusher(self):
+        """Background loop flushing pending writes in groups."""
+        with self._lock:
+            while True:
+                start = time.time()
+                while not (self._closing or self._waiters or
+                           (self.flush_every and
+                            self._pending >= self.flush_every)):
+                    timeout = None
+                    if self.flush_interval:
+                        timeout = self.flush_interval - (time.time() - start)
+                        if timeout <= 0:
+                            break
+                    self._cond.wait(timeout)
+
+                waiters, self._waiters = self._waiters, []
+                if self._pending:
+                    self.flush(sync=True)
+                    self._pending = 0
+                for future in waiters:
+                    future._resolve()
+                if self._closing:
+                    return
+
+    def compact(self):
+        """Rewrite the snapshot from memory and truncate the journal."""
+        if not self.writable:
+            return
+
+        with self._guard(exclusive=True):
+            self._close_journal()
+            tmp_file = os.path.extsep.join([self._filepath, 'tmp'])
+            with open(tmp_file, 'w') as fp:
                 json.dump(self._collection, fp)
+            _replace(tmp_file, self._filepath)
+
+            # Replaying the old journal over the new snapshot is idempotent,
+            # so a crash between these two steps is safe.
+            open(self._journal_path, 'w').close()
+            self._journal_entries = 0
+            self._offset = 0
+            self._snapshot = self._snapshot_id()
+
+    def close(self):
+        """Flush any pending writes and release the journal file handle."""
+        flusher = self._flusher
+        if flusher is not None:
+            with self._lock:
+                self._closing = True
+                self._cond.notify()
+            if flusher is not threading.current_thread():
+                flusher.join()
+            self._flusher = None
+        self._close_journal()
+
+    def _close_journal(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
 
     def get(self, uri):
         """Get the record for the given URI."""
         urilib.validate(uri)
-        return self._collection.get(uri)
+        with self._guard():
+            return self._collection.get(uri)
 
     def put(self, uri, record, atomic=False):
         """Store a record under the given URI.
@@ -95,11 +476,11 @@ class LocalClient():
         record : dict
             Dictionary object to write.
         """
-        urilib.validate(uri)
         # What happens if `uri` is in self._collection?
-        self._collection[uri] = record
-        if self.atomic or atomic:
-            self.flush()
+        with self._guard(exclusive=True):
+            self._apply(PUT, uri, record)
+            self._log(PUT, uri, record)
+            self._commit(atomic)
 
     def delete(self, uri):
         """Delete the record for a given URI.
@@ -110,8 +491,118 @@ class LocalClient():
             URI to delete. Passes quietly if URI does not exist.
         """
         urilib.validate(uri)
-        if uri in self._collection:
-            self._collection.pop(uri)
+        with self._guard(exclusive=True):
+            if uri in self._collection:
+                self._apply(DELETE, uri)
+                self._log(DELETE, uri)
+                self._commit()
+
+    def _commit(self, atomic=False, count=1):
+        if self._journal_entries >= self.compact_threshold:
+            self.compact()
+        elif atomic or (self.atomic and self._flusher is None):
+            # An explicit request for durability overrides group commit.
+            self.flush()
+        elif self._flusher is not None:
+            self._pending += count
+            if self.flush_every and self._pending >= self.flush_every:
+                self._cond.notify()
+
+    def get_many(self, uris):
+        """Get the records for a collection of URIs.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            URIs to look up.
+
+        Returns
+        -------
+        records : list
+            Records aligned with `uris`; None where a URI does not exist.
+        """
+        with self._guard():
+            return [self.get(uri) for uri in uris]
+
+    def put_many(self, records, atomic=False):
+        """Store a collection of records, flushing at most once.
+
+        Parameters
+        ----------
+        records : dict or iterable of (uri, record) tuples
+            Records to write, keyed by URI.
+
+        Raises
+        ------
+        ValueError
+            If any URI is malformed, in which case nothing is written.
+        """
+        if isinstance(records, dict):
+            records = records.items()
+        records = list(records)
+        for uri, _ in records:
+            urilib.validate(uri)
+        with self._guard(exclusive=True):
+            for uri, record in records:
+                self._apply(PUT, uri, record)
+                self._log(PUT, uri, record)
+            self._commit(atomic, len(records))
+
+    def delete_many(self, uris):
+        """Delete the records for a collection of URIs.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            URIs to delete. Passes quietly over URIs that do not exist.
+
+        Raises
+        ------
+        ValueError
+            If any URI is malformed, in which case nothing is deleted.
+        """
+        uris = list(uris)
+        for uri in uris:
+            urilib.validate(uri)
+        with self._guard(exclusive=True):
+            count = 0
+            for uri in uris:
+                if uri in self._collection:
+                    self._apply(DELETE, uri)
+                    self._log(DELETE, uri)
+                    count += 1
+            self._commit(count=count)
+
+    def update_many(self, uris, func):
+        """Read, modify and write back a collection of records atomically.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            Unique URIs of the records to update.
+
+        func : callable
+            Called as `func(uri, record)`, with None for a missing record,
+            returning the record to write, or None to leave it as is.
+
+        Returns
+        -------
+        records : list
+            Records written, aligned with `uris`; None where none was.
+        """
+        uris = list(uris)
+        for uri in uris:
+            urilib.validate(uri)
+        results = []
+        with self._guard(exclusive=True):
+            for uri in uris:
+                record = func(uri, copy.deepcopy(self._collection.get(uri)))
+                if record is not None:
+                    self._apply(PUT, uri, record)
+                    self._log(PUT, uri, record)
+                results.append(record)
+            self._commit(count=sum(rec is not None for rec in results))
+        return results
 
     def uris(self, kind=None):
         """Returns an iterator over the URIs in the Client.
@@ -126,9 +617,11 @@ class LocalClient():
         uri : str
             A URI in the collection.
         """
-        for uri in self._collection.keys():
-            if kind is None or kind == urilib.split(uri)[0]:
-                yield uri
+        with self._guard():
+            uris = self._collection if kind is None else self._kinds.get(kind)
+            uris = list(uris or [])
+        for uri in uris:
+            yield uri
 
 
 class GClient(object):
@@ -152,29 +645,150 @@ class GClient(object):
             Unique identifier for the owner of this storage object.
         """
         self.project = project
+        self._datastore = None
 
     @property
     def _client(self):
-        return datastore.Client(self.project)
+        if self._datastore is None:
+            self._datastore = datastore.Client(self.project)
+        return self._datastore
 
     def get(self, uri):
-        """Return a record for the given URI."""
-        kind, gid = urilib.split(uri)
-        key = self._client.key(kind, gid)
-        return dict(**self._client.get(key))
+        """Return a record for the given URI, or None if it does not exist."""
+        client = self._client
+        entity = client.get(client.key(*urilib.split(uri)))
+        return None if entity is None else dict(**entity)
 
     def put(self, uri, record, exclude_from_indexes=None):
         """Put a record into the database."""
-        exclude_from_indexes = exclude_from_indexes or []
+        client = self._client
+        client.put(self._entity(client, uri, record, exclude_from_indexes))
 
-        # Create Entity from record + key
-        kind, gid = urilib.split(uri)
-        key = self._client.key(kind, gid)
+    def delete(self, uri):
+        """Delete the record for a given URI."""
+        client = self._client
+        client.delete(client.key(*urilib.split(uri)))
 
+    def _entity(self, client, uri, record, exclude_from_indexes=None):
+        """Create an Entity from a record + key."""
+        key = client.key(*urilib.split(uri))
         entity = datastore.Entity(
-            key, exclude_from_indexes=exclude_from_indexes)
+            key, exclude_from_indexes=exclude_from_indexes or [])
         entity.update(record)
-        self._client.put(entity)
+        return entity
+
+    def get_many(self, uris):
+        """Get the records for a collection of URIs, in batched RPCs.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            URIs to look up.
+
+        Returns
+        -------
+        records : list
+            Records aligned with `uris`; None where a URI does not exist.
+        """
+        client = self._client
+        uris = list(uris)
+        found = dict()
+        for batch in utils.chunks(uris, MAX_GET_BATCH):
+            keys = [client.key(*urilib.split(uri)) for uri in batch]
+            for entity in client.get_multi(keys):
+                uri = urilib.join(entity.key.kind, entity.key.name)
+                found[uri] = dict(**entity)
+        return [found.get(uri) for uri in uris]
+
+    def put_many(self, records, exclude_from_indexes=None):
+        """Store a collection of records, in batched RPCs.
+
+        Parameters
+        ----------
+        records : dict or iterable of (uri, record) tuples
+            Records to write, keyed by URI; where a URI repeats, the last of
+            its records is written.
+        """
+        client = self._client
+        if isinstance(records, dict):
+            records = records.items()
+        # Datastore rejects more than one write to a key per RPC.
+        records = collections.OrderedDict(records).items()
+        for batch in utils.chunks(records, MAX_PUT_BATCH):
+            client.put_multi([
+                self._entity(client, uri, record, exclude_from_indexes)
+                for uri, record in batch])
+
+    def delete_many(self, uris):
+        """Delete the records for a collection of URIs, in batched RPCs.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            URIs to delete.
+        """
+        client = self._client
+        for batch in utils.chunks(uris, MAX_PUT_BATCH):
+            client.delete_multi(
+                [client.key(*urilib.split(uri)) for uri in batch])
+
+    def update_many(self, uris, func):
+        """Read, modify and write back a collection of records, in batched
+        transactions; each is retried if it contends with another writer.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            Unique URIs of the records to update.
+
+        func : callable
+            Called as `func(uri, record)`, with None for a missing record,
+            returning the record to write, or None to leave it as is. It may
+            be called more than once per record, if a transaction is retried.
+
+        Returns
+        -------
+        records : list
+            Records written, aligned with `uris`; None where none was.
+        """
+        client = self._client
+        uris = list(uris)
+        results = dict()
+        for batch in utils.chunks(uris, MAX_TXN_BATCH):
+            keys = [client.key(*urilib.split(uri)) for uri in batch]
+            for attempt in range(MAX_TXN_ATTEMPTS):
+                try:
+                    results.update(self._update_batch(client, batch, keys,
+                                                      func))
+                    break
+                except gexceptions.Conflict:
+                    if attempt + 1 == MAX_TXN_ATTEMPTS:
+                        raise
+                    logger.info("Retrying contended transaction")
+        return [results.get(uri) for uri in uris]
+
+    def _update_batch(self, client, uris, keys, func):
+        updated = dict()
+        with client.transaction():
+            entities = dict()
+            for entity in client.get_multi(keys):
+                entities[urilib.join(entity.key.kind, entity.key.name)] = \
+                    entity
+            changed = []
+            for uri, key in zip(uris, keys):
+                entity = entities.get(uri)
+                record = func(uri, None if entity is None else dict(**entity))
+                if record is None:
+                    continue
+                if entity is None:
+                    entity = datastore.Entity(key)
+                # Updating in place keeps the entity's unindexed properties.
+                entity.clear()
+                entity.update(record)
+                changed.append(entity)
+                updated[uri] = record
+            client.put_multi(changed)
+        return updated
 
     def uris(self, kind=None):
         """Iterator over the URIs in the database.
@@ -200,9 +814,808 @@ class GClient(object):
             yield urilib.join(v.kind, v.key.name)
 
 
+class SQLiteClient(object):
+    """A SQLite backed database object.
+
+    Records are stored as JSON alongside their URI and an indexed `kind`
+    column, so point lookups and per-kind listings never load the database
+    into memory. The database runs in WAL mode, which allows any number of
+    readers -- across threads or worker processes -- to proceed concurrently
+    with a single writer.
+    """
+
+    _SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS records (
+               uri TEXT PRIMARY KEY,
+               kind TEXT NOT NULL,
+               record TEXT NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS records_kind ON records (kind)"
+    ]
+    _GET = "SELECT record FROM records WHERE uri = ?"
+    _GET_MANY = "SELECT uri, record FROM records WHERE uri IN ({})"
+    _PUT = ("INSERT OR REPLACE INTO records (uri, kind, record) "
+            "VALUES (?, ?, ?)")
+    _DELETE = "DELETE FROM records WHERE uri = ?"
+    _URIS = "SELECT uri FROM records"
+    _URIS_BY_KIND = "SELECT uri FROM records WHERE kind = ?"
+
+    def __init__(self, project, filepath, mode=APPEND, timeout=30.0):
+        """Create a SQLite database client.
+
+        Parameters
+        ----------
+        project : str
+            Unique identifier for the owner of this storage object.
+
+        filepath : str
+            Path on disk for the SQLite database file.
+
+        mode : str, default='a'
+            File mode for accessing the database, one of
+             * 'r': read only; writes raise an IOError
+             * 'w': write; drops any existing records
+             * 'a': append; will add to the current database.
+
+        timeout : float, default=30.0
+            Time in seconds to wait on another writer's lock.
+        """
+        self.project = project
+        self._filepath = filepath
+        self.mode = mode
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        if sqlite3 is None:
+            raise ValueError("SQLite is not available on this platform.")
+
+        with self._conn as conn:
+            for stmt in self._SCHEMA:
+                conn.execute(stmt)
+            if self.mode == WRITE:
+                conn.execute("DELETE FROM records")
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def _conn(self):
+        """A connection for the calling thread.
+
+        SQLite connections may not be shared across threads, so one is opened
+        per thread; the `sqlite3` module caches compiled statements on each.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._filepath, timeout=self.timeout,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _transaction(self):
+        """The calling thread's connection, as a transaction context."""
+        if self.mode == READ:
+            raise IOError("Database '{}' was opened read-only"
+                          .format(self._filepath))
+        return self._conn
+
+    def close(self):
+        """Close all connections."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def get(self, uri):
+        """Get the record for the given URI."""
+        urilib.validate(uri)
+        row = self._conn.execute(self._GET, (uri,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, uri, record):
+        """Store a record under the given URI.
+
+        Parameters
+        ----------
+        uri : str
+            URI under which to write the record.
+
+        record : dict
+            Dictionary object to write.
+        """
+        self.put_many([(uri, record)])
+
+    def delete(self, uri):
+        """Delete the record for a given URI.
+
+        Parameters
+        ----------
+        uri : str
+            URI to delete. Passes quietly if URI does not exist.
+        """
+        self.delete_many([uri])
+
+    def get_many(self, uris):
+        """Get the records for a collection of URIs.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            URIs to look up.
+
+        Returns
+        -------
+        records : list
+            Records aligned with `uris`; None where a URI does not exist.
+        """
+        uris = list(uris)
+        found = dict()
+        for batch in utils.chunks(uris, MAX_SQLITE_PARAMS):
+            for uri in batch:
+                urilib.validate(uri)
+            query = self._GET_MANY.format(", ".join("?" * len(batch)))
+            for uri, record in self._conn.execute(query, batch):
+                found[uri] = json.loads(record)
+        return [found.get(uri) for uri in uris]
+
+    def put_many(self, records):
+        """Store a collection of records in a single transaction.
+
+        Parameters
+        ----------
+        records : dict or iterable of (uri, record) tuples
+            Records to write, keyed by URI.
+        """
+        if isinstance(records, dict):
+            records = records.items()
+        rows = [(uri, urilib.split(uri)[0], json.dumps(record))
+                for uri, record in records]
+        with self._transaction() as conn:
+            conn.executemany(self._PUT, rows)
+
+    def delete_many(self, uris):
+        """Delete the records for a collection of URIs in one transaction.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            URIs to delete. Passes quietly over URIs that do not exist.
+        """
+        rows = []
+        for uri in uris:
+            urilib.validate(uri)
+            rows.append((uri,))
+        with self._transaction() as conn:
+            conn.executemany(self._DELETE, rows)
+
+    def update_many(self, uris, func):
+        """Read, modify and write back a collection of records in a single
+        transaction, holding the write lock throughout.
+
+        Parameters
+        ----------
+        uris : iterable of str
+            Unique URIs of the records to update.
+
+        func : callable
+            Called as `func(uri, record)`, with None for a missing record,
+            returning the record to write, or None to leave it as is.
+
+        Returns
+        -------
+        records : list
+            Records written, aligned with `uris`; None where none was.
+        """
+        uris = list(uris)
+        for uri in uris:
+            urilib.validate(uri)
+        results, rows = [], []
+        with self._transaction() as conn:
+            # Take the write lock before reading, so no one else can write
+            # in between.
+            conn.execute("BEGIN IMMEDIATE")
+            for uri in uris:
+                row = conn.execute(self._GET, (uri,)).fetchone()
+                record = func(uri, None if row is None else json.loads(row[0]))
+                if record is not None:
+                    rows.append((uri, urilib.split(uri)[0],
+                                 json.dumps(record)))
+                results.append(record)
+            conn.executemany(self._PUT, rows)
+        return results
+
+    def uris(self, kind=None):
+        """Returns an iterator over the URIs in the database.
+
+        Parameters
+        ----------
+        kind : str, default=None
+            Optionally filter over the URI kind in the database.
+
+        Yields
+        ------
+        uri : str
+            A URI in the collection.
+        """
+        if kind is None:
+            cursor = self._conn.execute(self._URIS)
+        else:
+            cursor = self._conn.execute(self._URIS_BY_KIND, (kind,))
+        for row in cursor:
+            yield row[0]
+
+
+class WriteBehind(object):
+    """A write-behind buffer in front of another database client.
+
+    Each `put` is acknowledged once it is committed to a local SQLite
+    journal, and a background thread flushes the journal to the wrapped
+    client in batches: as soon as `batch_size` writes are pending, or every
+    `flush_interval` seconds otherwise. Failed flushes are retried with
+    exponential backoff, so every acknowledged write eventually lands, at
+    least once. The journal must therefore be on disk that outlives the
+    process, and the instance, that writes it.
+
+    Journaled writes are leased to the buffer that wrote them, and only it
+    flushes them, so several processes may share a journal file. Leases are
+    renewed while the buffer runs; writes left behind by a buffer that
+    closed, or died, are claimed by the next to start or renew.
+
+    Reads see pending writes. Deletes, which are rare, wait for any flush in
+    progress and pass straight through.
+    """
+
+    _SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS writes (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               uri TEXT NOT NULL,
+               record TEXT NOT NULL,
+               created REAL NOT NULL,
+               token TEXT NOT NULL,
+               leased REAL NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS writes_token ON writes (token, id)"
+    ]
+    _PUT = ("INSERT INTO writes (uri, record, created, token, leased) "
+            "VALUES (?, ?, ?, ?, ?)")
+    _CLAIM = "UPDATE writes SET token = ?, leased = ? WHERE leased < ?"
+    _RENEW = "UPDATE writes SET leased = ? WHERE token = ?"
+    _RELEASE = "UPDATE writes SET leased = 0 WHERE token = ?"
+    _PENDING = ("SELECT id, uri, record, created FROM writes "
+                "WHERE token = ? ORDER BY id")
+    _BATCH = ("SELECT id, uri, record FROM writes "
+              "WHERE token = ? AND id > ? ORDER BY id LIMIT ?")
+    _DONE = "DELETE FROM writes WHERE token = ? AND id <= ?"
+    _DISCARD = "DELETE FROM writes WHERE token = ? AND uri = ?"
+
+    def __init__(self, dbase, filepath, batch_size=MAX_PUT_BATCH,
+                 flush_interval=1.0, retry_delay=1.0, max_retry_delay=60.0,
+                 lease=300.0, timeout=30.0):
+        """Create a write-behind buffer, flushing any writes already
+        journaled.
+
+        Parameters
+        ----------
+        dbase : pybackend.database client
+            Client to write through to.
+
+        filepath : str
+            Path on disk for the SQLite journal file.
+
+        batch_size : int, default=500
+            Maximum number of writes per flush; a flush starts early once
+            this many are pending.
+
+        flush_interval : float, default=1.0
+            Maximum time in seconds a write waits before a flush.
+
+        retry_delay : float, default=1.0
+            Time in seconds before retrying a failed flush, doubled on each
+            consecutive failure.
+
+        max_retry_delay : float, default=60.0
+            Longest time in seconds between retries.
+
+        lease : float, default=300.0
+            Time in seconds journaled writes stay reserved for this buffer
+            without being renewed; after that, another buffer sharing the
+            journal may claim them.
+
+        timeout : float, default=30.0
+            Time in seconds to wait on another writer's lock on the journal.
+        """
+        if sqlite3 is None:
+            raise ValueError("SQLite is not available on this platform.")
+        self.dbase = dbase
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self._token = uuid.uuid4().hex
+        self._renew_at = 0
+        self._conn = sqlite3.connect(filepath, timeout=timeout,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Acknowledged writes must survive a power loss, not just a crash.
+        self._conn.execute("PRAGMA synchronous=FULL")
+        with self._conn as conn:
+            for stmt in self._SCHEMA:
+                conn.execute(stmt)
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        # Pending records, by URI: (journal id, record).
+        self._pending = dict()
+        self._created = dict()
+        self._flushed = 0
+        self._failures = 0
+        self._consecutive_failures = 0
+        self._last_flush = None
+        self._closing = False
+        self._renew()
+
+        self._flusher = threading.Thread(target=self._run_flusher,
+                                         name='WriteBehind-flusher')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def __len__(self):
+        """Number of writes not yet flushed."""
+        return len(self._created)
+
+    def _renew(self):
+        """Extend the lease on this buffer's writes, and claim any whose
+        lease has run out."""
+        now = time.time()
+        with self._lock:
+            with self._conn as conn:
+                conn.execute(self._RENEW, (now + self.lease, self._token))
+                claimed = conn.execute(
+                    self._CLAIM, (self._token, now + self.lease, now)).rowcount
+            if claimed:
+                rows = self._conn.execute(self._PENDING, (self._token,))
+                for row_id, uri, record, created in rows:
+                    if row_id in self._created:
+                        continue
+                    if uri not in self._pending or \
+                            self._pending[uri][0] < row_id:
+                        self._pending[uri] = (row_id, json.loads(record))
+                    self._created[row_id] = created
+                logger.info("Recovered {} journaled writes".format(claimed))
+        self._renew_at = now + self.lease / 4.
+
+    def stats(self):
+        """Return metrics on the state of the buffer.
+
+        Returns
+        -------
+        stats : dict
+            Queue `depth`, age in seconds of the `oldest` pending write (or
+            None), writes `flushed` and flush `failures` since start, and
+            time of the `last_flush` (or None).
+        """
+        with self._lock:
+            oldest = None
+            if self._created:
+                oldest = time.time() - min(self._created.values())
+            return dict(depth=len(self._created), oldest=oldest,
+                        flushed=self._flushed, failures=self._failures,
+                        last_flush=self._last_flush)
+
+    def put(self, uri, record):
+        """Journal a record, to be written to the database in the background.
+
+        Parameters
+        ----------
+        uri : str
+            Unique identifier for the record.
+
+        record : dict
+            JSON-serializable record to store.
+        """
+        self.put_many([(uri, record)])
+
+    def put_many(self, records):
+        """Journal a collection of records in a single transaction.
+
+        Parameters
+        ----------
+        records : dict or iterable of (uri, record) tuples
+            Records to write, keyed by URI.
+        """
+        if isinstance(records, dict):
+            records = records.items()
+        now = time.time()
+        rows = []
+        for uri, record in records:
+            urilib.validate(uri)
+            rows.append((uri, json.dumps(record), now, self._token,
+                         now + self.lease))
+        if not rows:
+            return
+        with self._lock:
+            if self._closing:
+                raise IOError("Write-behind buffer is closed")
+            with self._conn as conn:
+                ids = [conn.execute(self._PUT, row).lastrowid for row in rows]
+            for row_id, (uri, record, created, _, _) in zip(ids, rows):
+                self._pending[uri] = (row_id, json.loads(record))
+                self._created[row_id] = created
+            if len(self._created) >= self.batch_size:
+                self._cond.notify()
+
+    def get(self, uri):
+        """Get the record for a URI, pending or stored.
+
+        Returns
+        -------
+        record : dict or None
+            The record, or None if it does not exist.
+        """
+        return self.get_many([uri])[0]
+
+    def get_many(self, uris):
+        """Get the records for a collection of URIs, pending or stored.
+
+        Returns
+        -------
+        records : list
+            Records, in the order of `uris`, with None for missing URIs.
+        """
+        uris = list(uris)
+        with self._lock:
+            found = {uri: copy.deepcopy(self._pending[uri][1])
+                     for uri in uris if uri in self._pending}
+        missing = [uri for uri in uris if uri not in found]
+        found.update(zip(missing, self.dbase.get_many(missing)))
+        return [found[uri] for uri in uris]
+
+    def delete(self, uri):
+        """Delete the record for a URI, pending or stored."""
+        self.delete_many([uri])
+
+    def delete_many(self, uris):
+        """Delete the records for a collection of URIs, pending or stored."""
+        uris = list(uris)
+        with self._flush_lock:
+            with self._lock:
+                with self._conn as conn:
+                    for uri in uris:
+                        conn.execute(self._DISCARD, (self._token, uri))
+                for uri in uris:
+                    row_id, _ = self._pending.pop(uri, (None, None))
+                    self._created.pop(row_id, None)
+            self.dbase.delete_many(uris)
+
+    def uris(self, kind=None):
+        """Iterator over the URIs in the database, pending or stored.
+
+        Parameters
+        ----------
+        kind : str, default=None
+            If given, only yield URIs of this kind.
+        """
+        with self._lock:
+            pending = set(uri for uri in self._pending
+                          if kind is None or urilib.split(uri)[0] == kind)
+        for uri in pending:
+            yield uri
+        for uri in self.dbase.uris(kind=kind):
+            if uri not in pending:
+                yield uri
+
+    def _flush_batch(self):
+        """Write the oldest pending batch through; return the number of
+        writes flushed."""
+        with self._lock:
+            if not self._created:
+                return 0
+            first_id = min(self._created) - 1
+            # Without a row in the journal, a write was claimed by another
+            # buffer after this one's lease ran out; it's theirs to flush.
+            last_id = max(self._created)
+            rows = self._conn.execute(
+                self._BATCH,
+                (self._token, first_id, self.batch_size)).fetchall()
+        records = dict()
+        for row_id, uri, record in rows:
+            records[uri] = json.loads(record)
+        if len(rows) == self.batch_size:
+            last_id = rows[-1][0]
+        self.dbase.put_many(records)
+
+        with self._lock:
+            with self._conn as conn:
+                conn.execute(self._DONE, (self._token, last_id))
+            done = [row_id for row_id in self._created if row_id <= last_id]
+            for row_id in done:
+                del self._created[row_id]
+            for uri, (row_id, _) in list(self._pending.items()):
+                if row_id <= last_id:
+                    del self._pending[uri]
+            self._flushed += len(rows)
+            self._last_flush = time.time()
+        return len(rows)
+
+    def flush(self):
+        """Write all pending records through, in batches.
+
+        Raises
+        ------
+        Exception
+            Any error from the wrapped database; unflushed writes remain
+            journaled.
+        """
+        with self._flush_lock:
+            while self._flush_batch():
+                pass
+
+    def _run_flusher(self):
+        """Background loop flushing pending writes in batches."""
+        delay = None
+        while True:
+            with self._lock:
+                start = time.time()
+                timeout = self.flush_interval if delay is None else delay
+                while not self._closing and (
+                        delay is not None or
+                        len(self._created) < self.batch_size):
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closing:
+                    return
+            try:
+                if time.time() >= self._renew_at:
+                    self._renew()
+                self.flush()
+                delay = None
+                self._consecutive_failures = 0
+            except Exception as derp:
+                self._failures += 1
+                self._consecutive_failures += 1
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** (
+                    self._consecutive_failures - 1))
+                logger.warning("Failed flushing {} writes, retrying in {}s: "
+                               "{}".format(len(self), delay, derp))
+
+    def close(self):
+        """Stop the background thread and flush all pending writes; the
+        wrapped client is left open.
+
+        Writes that fail to flush remain journaled, and are released for
+        the next buffer over the same journal to claim.
+        """
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._flusher.join()
+        try:
+            self.flush()
+        except Exception as derp:
+            logger.error("Failed flushing {} writes on close; they remain "
+                         "journaled: {}".format(len(self), derp))
+        with self._conn as conn:
+            conn.execute(self._RELEASE, (self._token,))
+        self._conn.close()
+
+
+class Accumulator(object):
+    """Updates to records, accumulated in memory and merged into a database
+    in the background.
+
+    Updates are deltas, e.g. counts, combined per record as they are added,
+    so that however often a record is updated, it is read, merged and
+    written back once per flush. A background thread flushes every
+    `flush_interval` seconds, in transactions of at most `batch_size`
+    records, apart from those of any request; deltas that fail to merge are
+    kept, and retried with exponential backoff.
+
+    Deltas are held in memory only, so those not yet merged are lost if the
+    process dies; this suits tallies that may run slightly short, not writes
+    that must land.
+    """
+
+    def __init__(self, dbase, combine, merge, on_merge=None,
+                 batch_size=MAX_TXN_BATCH, flush_interval=5.0,
+                 retry_delay=1.0, max_retry_delay=60.0):
+        """Create an accumulator.
+
+        Parameters
+        ----------
+        dbase : pybackend.database client
+            Client to merge into, with `update_many`.
+
+        combine : callable
+            Called as `combine(delta, later)`, returning a single delta with
+            the effect of both.
+
+        merge : callable
+            Called as `merge(uri, record, delta)`, with None for a missing
+            record, returning the record to write, or None to leave it as
+            is; see `update_many`.
+
+        on_merge : callable, default=None
+            Called as `on_merge(uri, record)` with each record written.
+
+        batch_size : int, default=25
+            Maximum number of records per transaction.
+
+        flush_interval : float, default=5.0
+            Time in seconds between flushes.
+
+        retry_delay : float, default=1.0
+            Time in seconds before retrying a failed flush, doubled on each
+            consecutive failure.
+
+        max_retry_delay : float, default=60.0
+            Longest time in seconds between retries.
+        """
+        self.dbase = dbase
+        self.combine = combine
+        self.merge = merge
+        self.on_merge = on_merge
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        # Combined deltas, by URI, oldest first.
+        self._pending = collections.OrderedDict()
+        self._merged = 0
+        self._failures = 0
+        self._last_flush = None
+        self._closing = False
+
+        self._flusher = threading.Thread(target=self._run_flusher,
+                                         name='Accumulator-flusher')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def __len__(self):
+        """Number of records with deltas not yet merged."""
+        return len(self._pending)
+
+    def stats(self):
+        """Return metrics on the state of the accumulator.
+
+        Returns
+        -------
+        stats : dict
+            Number of records with pending deltas (`depth`), records
+            `merged` and flush `failures` since start, and time of the
+            `last_flush` (or None).
+        """
+        with self._lock:
+            return dict(depth=len(self._pending), merged=self._merged,
+                        failures=self._failures, last_flush=self._last_flush)
+
+    def _add(self, uri, delta, later=True):
+        if uri in self._pending:
+            delta = (self.combine(self._pending[uri], delta) if later
+                     else self.combine(delta, self._pending[uri]))
+        self._pending[uri] = delta
+
+    def add(self, uri, delta):
+        """Add a delta, to be merged into a record in the background.
+
+        Parameters
+        ----------
+        uri : str
+            URI of the record.
+
+        delta : object
+            Update to merge into the record.
+        """
+        urilib.validate(uri)
+        with self._lock:
+            if self._closing:
+                raise IOError("Accumulator is closed")
+            self._add(uri, delta)
+
+    def _flush_batch(self):
+        """Merge the oldest pending batch; return the number of records
+        merged."""
+        with self._lock:
+            uris = list(itertools.islice(self._pending, self.batch_size))
+            deltas = dict((uri, self._pending.pop(uri)) for uri in uris)
+        if not uris:
+            return 0
+
+        try:
+            records = self.dbase.update_many(
+                uris, lambda uri, record: self.merge(uri, record,
+                                                     deltas[uri]))
+        except BaseException:
+            with self._lock:
+                for uri in uris:
+                    self._add(uri, deltas[uri], later=False)
+            raise
+
+        with self._lock:
+            self._merged += len(uris)
+            self._last_flush = time.time()
+        if self.on_merge is not None:
+            for uri, record in zip(uris, records):
+                if record is not None:
+                    try:
+                        self.on_merge(uri, record)
+                    except Exception:
+                        logger.exception("Failed handling merge of {}"
+                                         .format(uri))
+        return len(uris)
+
+    def flush(self):
+        """Merge all pending deltas, in batches.
+
+        Raises
+        ------
+        Exception
+            Any error from the database; deltas that were not merged remain
+            pending.
+        """
+        with self._flush_lock:
+            remaining = len(self)
+            while remaining > 0:
+                flushed = self._flush_batch()
+                if not flushed:
+                    break
+                remaining -= flushed
+
+    def _run_flusher(self):
+        """Background loop merging pending deltas."""
+        delay = self.flush_interval
+        consecutive_failures = 0
+        while True:
+            with self._lock:
+                if not self._closing:
+                    self._cond.wait(delay)
+                if self._closing:
+                    return
+            try:
+                self.flush()
+                delay = self.flush_interval
+                consecutive_failures = 0
+            except Exception as derp:
+                self._failures += 1
+                consecutive_failures += 1
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** (
+                    consecutive_failures - 1))
+                logger.warning("Failed merging {} records, retrying in {}s: "
+                               "{}".format(len(self), delay, derp))
+
+    def close(self):
+        """Stop the background thread and merge all pending deltas; the
+        database client is left open."""
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._flusher.join()
+        try:
+            self.flush()
+        except Exception as derp:
+            logger.error("Failed merging {} records on close; they are lost: "
+                         "{}".format(len(self), derp))
+
+
 BACKENDS = {
     GCLOUD: GClient,
-    LOCAL: LocalClient
+    LOCAL: LocalClient,
+    SQLITE: SQLiteClient
 }
 
 
@@ -215,7 +1628,7 @@ def Database(project, backend, **kwargs):
         Unique identifier for the owner of this storage object.
 
     backend : str, default='gcloud'
-        Backend storage platform to use, one of ['local', 'gcloud'].
+        Backend storage platform to use, one of ['local', 'gcloud', 'sqlite'].
 
     **kwargs : Additional arguments to pass through to the different backends.
     """
@@ -0,0 +1,390 @@
+"""Processing stages run over audio as it is ingested.
+
+Each clip is fetched from storage and decoded once; every stage sees the same
+stream of decoded blocks, writes its results to storage under a key derived
+from the clip's gid, and reports the fields to record on the clip's entity.
+
+Uploads are processed in the background by `Workers`, which consume jobs
+from a durable queue and record each clip's `status` on its entity as they
+go.
+
+Example
+-------
+>>> import pybackend.ingest as ingest
+>>> fields = ingest.run('abc123', 'wav', store)
+>>> fields['peaks']
+'abc123.peaks.json'
+>>> store.get(fields['peaks'])
+b'{"sample_rate": 44100, ...}'
+"""
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from . import audio
+from . import storage
+from . import urilib
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Field on `audio` records tracking ingest, and its values.
+STATUS_FIELD = 'status'
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+
+def derived_key(gid, name):
+    """Return the storage key for data derived from the clip at `gid`."""
+    return os.path.extsep.join([gid, name])
+
+
+class PeaksStage(object):
+    """Waveform peaks, stored as JSON; see `pybackend.audio.Peaks`."""
+    field = 'peaks'
+
+    def __init__(self, gid, sample_rate, store):
+        self.key = derived_key(gid, 'peaks.json')
+        self.store = store
+        self._peaks = audio.Peaks(sample_rate)
+
+    def update(self, y):
+        self._peaks.update(y)
+
+    def finalize(self):
+        data = json.dumps(self._peaks.finalize(), separators=(',', ':'))
+        self.store.put(self.key, data.encode('utf-8'))
+        return {self.field: self.key}
+
+
+def tile_key(gid, hop_length, index):
+    """Return the storage key for a spectrogram tile."""
+    return derived_key(gid, 'spectrogram.{}.{}.png'.format(hop_length, index))
+
+
+class SpectrogramStage(object):
+    """Spectrogram tiles, stored as PNG images as soon as they are complete;
+    see `pybackend.audio.Spectrogram`."""
+    field = 'spectrogram'
+
+    def __init__(self, gid, sample_rate, store):
+        self.gid = gid
+        self.store = store
+        self._spec = audio.Spectrogram(sample_rate)
+
+    def _put(self, tiles):
+        for hop_length, index, image in tiles:
+            self.store.put(tile_key(self.gid, hop_length, index),
+                           utils.encode_png(image))
+
+    def update(self, y):
+        self._put(self._spec.update(y))
+
+    def finalize(self):
+        self._put(self._spec.finalize())
+        return {self.field: self._spec.describe()}
+
+
+class PreviewStage(object):
+    """A compact rendition for streaming, stored as WAV data; see
+    `pybackend.audio.Preview`.
+
+    The rendition is only kept if it is smaller than the original, which may
+    already be compressed; otherwise, the field is recorded as None.
+    """
+    field = 'preview'
+
+    def __init__(self, gid, sample_rate, store):
+        self.gid = gid
+        self.key = derived_key(gid, 'preview.wav')
+        self.store = store
+        self._preview = audio.Preview(sample_rate)
+
+    def update(self, y):
+        self._preview.update(y)
+
+    def finalize(self):
+        fp, num_bytes = self._preview.finalize()
+        with fp:
+            if num_bytes >= self.store.size(self.gid):
+                return {self.field: None}
+            self.store.put_file(self.key, fp)
+        return {self.field: dict(key=self.key, file_ext='wav',
+                                 num_bytes=num_bytes,
+                                 sample_rate=self._preview.target_rate)}
+
+
+STAGES = [PeaksStage, SpectrogramStage, PreviewStage]
+
+
+def run(gid, file_ext, store, stages=None):
+    """Run ingest stages over a stored audio clip.
+
+    Parameters
+    ----------
+    gid : str
+        Key of the audio data in storage.
+
+    file_ext : str
+        File extension of the audio, as a hint to decoders.
+
+    store : pybackend.storage.Storage
+        Storage holding the audio, to which results are also written.
+
+    stages : list of classes, default=None
+        Stages to run; defaults to `STAGES`.
+
+    Returns
+    -------
+    fields : dict
+        Fields to record on the clip's entity; empty if the clip can't be
+        decoded, or if no decoders are available.
+    """
+    stages = STAGES if stages is None else stages
+    fields = dict()
+    if not audio.AVAILABLE:
+        logger.warning("No audio decoders available; skipping {}".format(gid))
+        return fields
+
+    # Decoders want a real file, so spill the clip to local disk.
+    with tempfile.NamedTemporaryFile(suffix=os.path.extsep + file_ext) as tmp:
+        for chunk in store.iter_range(gid):
+            tmp.write(chunk)
+        tmp.flush()
+        try:
+            with audio.AudioStream(tmp.name) as stream:
+                running = [stage(gid, stream.sample_rate, store)
+                           for stage in stages]
+                for block in stream:
+                    for stage in running:
+                        stage.update(block)
+        except audio.DecodeError as derp:
+            logger.warning("Unable to decode {}: {}".format(gid, derp))
+            return fields
+
+    for stage in running:
+        fields.update(stage.finalize())
+    return fields
+
+
+# Storage client for pool workers, created once per process.
+_STORE = None
+
+
+def _init_worker(storage_kwargs):
+    global _STORE
+    _STORE = storage.Storage(**storage_kwargs)
+
+
+def _run_job(job):
+    gid, file_ext = job
+    try:
+        return gid, run(gid, file_ext, _STORE)
+    except Exception:
+        logger.exception("Ingest failed for {}".format(gid))
+        return gid, None
+
+
+def run_many(jobs, storage_kwargs, processes=None):
+    """Run ingest stages over many stored clips in a process pool.
+
+    Parameters
+    ----------
+    jobs : iterable of (gid, file_ext) tuples
+        Clips to process.
+
+    storage_kwargs : dict
+        Keyword arguments for `pybackend.storage.Storage`, used to create a
+        client in each worker process.
+
+    processes : int, default=None
+        Number of worker processes; defaults to the number of CPUs.
+
+    Yields
+    ------
+    gid : str
+        Key of a processed clip, in order of completion.
+
+    fields : dict or None
+        Fields to record on the clip's entity, as returned by `run`, or None
+        if processing failed.
+    """
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(storage_kwargs,))
+    try:
+        for result in pool.imap_unordered(_run_job, jobs):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class Workers(object):
+    """A pool of background threads running ingest jobs from a queue.
+
+    Each job runs every stage over one clip and then updates the clip's
+    entity with the results, and a `status` of 'ready'. Failed jobs are
+    retried up to `max_attempts` times before the clip is marked 'failed'.
+    Jobs left in the queue, e.g. by a restart, are picked up again once
+    their lease runs out.
+    """
+
+    def __init__(self, queue, dbase, store, num_workers=2, processes=None,
+                 storage_kwargs=None, max_attempts=3, retry_delay=10.0,
+                 poll_interval=1.0):
+        """Create and start the workers.
+
+        Parameters
+        ----------
+        queue : pybackend.jobqueue queue
+            Queue of ingest jobs.
+
+        dbase : pybackend.database client
+            Database holding the `audio` entities to update.
+
+        store : pybackend.storage.Storage
+            Storage holding the audio.
+
+        num_workers : int, default=2
+            Number of worker threads.
+
+        processes : int, default=None
+            If given, run stages in a pool of this many processes, rather
+            than in the worker threads themselves.
+
+        storage_kwargs : dict, default=None
+            Keyword arguments to rebuild `store` in each process; required
+            if `processes` is given.
+
+        max_attempts : int, default=3
+            Number of times to try a job before giving up.
+
+        retry_delay : float, default=10.0
+            Time in seconds before a failed job is retried.
+
+        poll_interval : float, default=1.0
+            Time in seconds idle workers wait between checks of the queue,
+            for jobs put by other processes.
+        """
+        self.queue = queue
+        self.dbase = dbase
+        self.store = store
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._pool = None
+        if processes:
+            self._pool = multiprocessing.Pool(
+                processes, initializer=_init_worker,
+                initargs=(storage_kwargs,))
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+        for idx in range(num_workers):
+            thread = threading.Thread(target=self._work,
+                                      name='ingest-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, gid, file_ext):
+        """Queue a stored clip for ingest.
+
+        Parameters
+        ----------
+        gid : str
+            Key of the audio data in storage.
+
+        file_ext : str
+            File extension of the audio.
+        """
+        self.queue.put(dict(gid=gid, file_ext=file_ext))
+        with self._cond:
+            self._cond.notify()
+
+    def _process(self, gid, file_ext):
+        if self._pool is not None:
+            return self._pool.apply(_run_job, [(gid, file_ext)])[1]
+        try:
+            return run(gid, file_ext, self.store)
+        except Exception:
+            logger.exception("Ingest failed for {}".format(gid))
+            return None
+
+    def _handle(self, job):
+        gid, file_ext = job.payload['gid'], job.payload['file_ext']
+        fields = self._process(gid, file_ext)
+        if fields is None and job.attempts < self.max_attempts:
+            logger.info("Retrying ingest for {} in {}s"
+                        .format(gid, self.retry_delay))
+            self.queue.release(job, delay=self.retry_delay)
+            return
+
+        def finish(uri, record):
+            if record is not None:
+                record.update(fields or {})
+                record[STATUS_FIELD] = FAILED if fields is None else READY
+            return record
+
+        # Annotations may be counted on the record meanwhile.
+        self.dbase.update_many([urilib.join('audio', gid)], finish)
+        self.queue.ack(job)
+        with self._cond:
+            self._cond.notify_all()
+
+    def _work(self):
+        while not self._stopped:
+            try:
+                job = self.queue.get()
+                if job is not None:
+                    self._handle(job)
+                    continue
+            except Exception:
+                logger.exception("Ingest worker error")
+            with self._cond:
+                if not self._stopped:
+                    self._cond.wait(self.poll_interval)
+
+    def drain(self, timeout=None):
+        """Wait until the queue is empty.
+
+        Parameters
+        ----------
+        timeout : float, default=None
+            Maximum time in seconds to wait.
+
+        Returns
+        -------
+        success : bool
+            False if jobs remain after `timeout`.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while len(self.queue):
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                self._cond.wait(self.poll_interval)
+        return True
+
+    def close(self):
+        """Stop the workers, letting any running jobs finish first.
+
+        Unfinished jobs remain in the queue.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        self.queue.close()
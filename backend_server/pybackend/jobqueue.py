@@ -0,0 +1,193 @@
+"""Durable job queues, for handing work off to background workers.
+
+Jobs are leased rather than popped: a claimed job stays in the queue until it
+is acknowledged, and is redelivered if its lease runs out first, e.g. because
+the worker that claimed it died.
+
+Example
+-------
+>>> import pybackend.jobqueue as Q
+>>> queue = Q.JobQueue(backend='sqlite', filepath='tmp/jobs.db')
+>>> queue.put(dict(gid='abc', file_ext='wav'))
+>>> job = queue.get()
+>>> job.payload
+{'gid': 'abc', 'file_ext': 'wav'}
+>>> queue.ack(job)
+"""
+import collections
+import json
+import threading
+import time
+import uuid
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from . import SQLITE
+
+Job = collections.namedtuple('Job', ['id', 'token', 'payload', 'attempts'])
+
+
+class SQLiteQueue(object):
+    """A SQLite backed job queue.
+
+    Claiming a job is a single UPDATE, stamping the job with a unique token,
+    so any number of threads or processes may share the queue file. Jobs
+    are delivered in the order they were put, as their leases allow.
+    """
+
+    _SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS jobs (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               payload TEXT NOT NULL,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               available REAL NOT NULL,
+               token TEXT)""",
+        "CREATE INDEX IF NOT EXISTS jobs_available ON jobs (available)"
+    ]
+    _PUT = "INSERT INTO jobs (payload, available) VALUES (?, ?)"
+    _CLAIM = ("UPDATE jobs SET token = ?, available = ?, "
+              "attempts = attempts + 1 WHERE id = ("
+              "SELECT id FROM jobs WHERE available <= ? "
+              "ORDER BY available, id LIMIT 1)")
+    _CLAIMED = "SELECT id, payload, attempts FROM jobs WHERE token = ?"
+    _ACK = "DELETE FROM jobs WHERE id = ? AND token = ?"
+    _RELEASE = ("UPDATE jobs SET token = NULL, available = ? "
+                "WHERE id = ? AND token = ?")
+    _COUNT = "SELECT COUNT(*) FROM jobs"
+
+    def __init__(self, filepath, lease=300.0, timeout=30.0):
+        """Create a SQLite job queue.
+
+        Parameters
+        ----------
+        filepath : str
+            Path on disk for the SQLite database file.
+
+        lease : float, default=300.0
+            Time in seconds a claimed job is reserved for its worker before
+            it is redelivered.
+
+        timeout : float, default=30.0
+            Time in seconds to wait on another writer's lock.
+        """
+        if sqlite3 is None:
+            raise ValueError("SQLite is not available on this platform.")
+        self._filepath = filepath
+        self.lease = lease
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        with self._conn as conn:
+            for stmt in self._SCHEMA:
+                conn.execute(stmt)
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        """Number of jobs in the queue, including those claimed."""
+        return self._conn.execute(self._COUNT).fetchone()[0]
+
+    @property
+    def _conn(self):
+        """A connection for the calling thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._filepath, timeout=self.timeout,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close all connections."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def put(self, payload):
+        """Add a job to the queue.
+
+        Parameters
+        ----------
+        payload : dict
+            JSON-serializable description of the job.
+        """
+        with self._conn as conn:
+            conn.execute(self._PUT, (json.dumps(payload), time.time()))
+
+    def get(self):
+        """Claim the next available job.
+
+        Returns
+        -------
+        job : Job or None
+            The claimed job, with its `attempts` counting this one, or None
+            if no job is available.
+        """
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self._conn as conn:
+            conn.execute(self._CLAIM, (token, now + self.lease, now))
+            row = conn.execute(self._CLAIMED, (token,)).fetchone()
+        if row is None:
+            return None
+        return Job(row[0], token, json.loads(row[1]), row[2])
+
+    def ack(self, job):
+        """Remove a finished job from the queue.
+
+        Returns
+        -------
+        success : bool
+            False if the job's lease had run out, and it was claimed again.
+        """
+        with self._conn as conn:
+            return conn.execute(self._ACK, (job.id, job.token)).rowcount > 0
+
+    def release(self, job, delay=0.0):
+        """Return a claimed job to the queue, e.g. to retry it.
+
+        Parameters
+        ----------
+        job : Job
+            Job to release.
+
+        delay : float, default=0.0
+            Time in seconds before the job is available again.
+
+        Returns
+        -------
+        success : bool
+            False if the job's lease had run out, and it was claimed again.
+        """
+        params = (time.time() + delay, job.id, job.token)
+        with self._conn as conn:
+            return conn.execute(self._RELEASE, params).rowcount > 0
+
+
+BACKENDS = {
+    SQLITE: SQLiteQueue
+}
+
+
+def JobQueue(backend=SQLITE, **kwargs):
+    """Factory constructor for different job queues.
+
+    Parameters
+    ----------
+    backend : str, default='sqlite'
+        Queue implementation to use, one of ['sqlite'].
+
+    **kwargs : Additional arguments to pass through to the different backends.
+    """
+    return BACKENDS[backend](**kwargs)
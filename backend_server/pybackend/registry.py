@@ -0,0 +1,221 @@
+"""Application-scoped pool of database and storage clients.
+
+Building a `Database` or `Storage` object is not free: cloud clients
+authenticate on construction, and local databases reload from disk. A
+`Registry` is created once per process and hands the same clients out to
+every request, along with the task scheduler and index of known audio built
+over the database, the background ingest workers, and the optional
+write-behind buffer for annotations.
+
+Example
+-------
+>>> import pybackend.registry as R
+>>> clients = R.Registry(project='my-project',
+                         database=dict(backend='local', filepath='db.json'),
+                         storage=dict(name='audio', backend='local',
+                                      local_dir='tmp'))
+>>> clients.database.put('audio:abc', dict(file_ext='wav'))
+>>> clients.close()
+"""
+import logging
+import threading
+import time
+
+from . import bloom
+from . import database
+from . import ingest
+from . import jobqueue
+from . import scheduler
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+
+class Registry(object):
+
+    def __init__(self, project, database, storage, scheduler=None,
+                 ingest=None, write_behind=None):
+        """Create a client registry.
+
+        Parameters
+        ----------
+        project : str
+            Unique identifier for the owner of the clients.
+
+        database : dict
+            Keyword arguments for `pybackend.database.Database`.
+
+        storage : dict
+            Keyword arguments for `pybackend.storage.Storage`.
+
+        scheduler : dict, default=None
+            Keyword arguments for `pybackend.scheduler.Scheduler`, with
+            `refresh_interval`, the time in seconds after which the scheduler
+            is reseeded in the background to pick up audio added by other
+            processes; if that is None, it is seeded only once.
+
+        ingest : dict, default=None
+            Keyword arguments for `pybackend.ingest.Workers`, with those for
+            `pybackend.jobqueue.JobQueue` under `queue`; if None, there are
+            no ingest workers.
+
+        write_behind : dict, default=None
+            Keyword arguments for `pybackend.database.WriteBehind`; if None,
+            annotations are written straight to the database.
+        """
+        self.project = project
+        self._database_kwargs = dict(database)
+        self._storage_kwargs = dict(storage)
+        self._scheduler_kwargs = dict(scheduler or {})
+        self._refresh_interval = self._scheduler_kwargs.pop(
+            'refresh_interval', None)
+        self._refresh_at = None
+        self._ingest_kwargs = None if ingest is None else dict(ingest)
+        self._write_behind_kwargs = (None if write_behind is None
+                                     else dict(write_behind))
+        self._database = None
+        self._storage = None
+        self._scheduler = None
+        self._known_audio = None
+        self._ingest = None
+        self._annotations = None
+        self._lock = threading.Lock()
+
+    @property
+    def storage_kwargs(self):
+        """Keyword arguments for `Storage`, e.g. to rebuild it elsewhere."""
+        return dict(self._storage_kwargs, project=self.project)
+
+    @property
+    def database(self):
+        """The shared database client, created on first access."""
+        if self._database is None:
+            with self._lock:
+                if self._database is None:
+                    logger.debug("Creating database client: {}"
+                                 .format(self._database_kwargs))
+                    self._database = database.Database(
+                        project=self.project, **self._database_kwargs)
+        return self._database
+
+    @property
+    def storage(self):
+        """The shared storage client, created on first access."""
+        if self._storage is None:
+            with self._lock:
+                if self._storage is None:
+                    logger.debug("Creating storage client: {}"
+                                 .format(self._storage_kwargs))
+                    self._storage = storage.Storage(
+                        project=self.project, **self._storage_kwargs)
+        return self._storage
+
+    @property
+    def scheduler(self):
+        """The task scheduler, seeded from the database on first access, and
+        reseeded in the background once `refresh_interval` has passed."""
+        if self._scheduler is None:
+            dbase = self.database
+            with self._lock:
+                if self._scheduler is None:
+                    sched = scheduler.Scheduler(**self._scheduler_kwargs)
+                    sched.seed(dbase, kind='audio')
+                    self._scheduler = sched
+                    self._schedule_refresh()
+                    logger.info("Seeded scheduler with {} items"
+                                .format(len(self._scheduler)))
+        elif self._refresh_at is not None and time.time() >= self._refresh_at:
+            with self._lock:
+                if (self._refresh_at is not None and
+                        time.time() >= self._refresh_at):
+                    self._refresh_at = None
+                    refresher = threading.Thread(
+                        target=self._refresh_scheduler,
+                        args=(self._scheduler, self._database),
+                        name='Registry-scheduler-refresh')
+                    refresher.daemon = True
+                    refresher.start()
+        return self._scheduler
+
+    def _schedule_refresh(self):
+        if self._refresh_interval is not None:
+            self._refresh_at = time.time() + self._refresh_interval
+
+    def _refresh_scheduler(self, sched, dbase):
+        """Reseed a scheduler with audio added since it was last seeded."""
+        size = len(sched)
+        try:
+            sched.seed(dbase, kind='audio')
+            logger.info("Refreshed scheduler with {} new items"
+                        .format(len(sched) - size))
+        except Exception as derp:
+            logger.warning("Failed refreshing scheduler: {}".format(derp))
+        with self._lock:
+            if self._scheduler is sched:
+                self._schedule_refresh()
+
+    @property
+    def known_audio(self):
+        """A Bloom filter of audio URIs in the database, seeded on first
+        access; callers add to it as they index new audio."""
+        if self._known_audio is None:
+            dbase = self.database
+            with self._lock:
+                if self._known_audio is None:
+                    known = bloom.BloomFilter()
+                    for uri in dbase.uris(kind='audio'):
+                        known.add(uri)
+                    self._known_audio = known
+                    logger.info("Seeded audio index with {} items"
+                                .format(len(known)))
+        return self._known_audio
+
+    @property
+    def ingest(self):
+        """The ingest workers, started on first access; None if not
+        configured."""
+        if self._ingest is None and self._ingest_kwargs is not None:
+            dbase, store = self.database, self.storage
+            with self._lock:
+                if self._ingest is None:
+                    kwargs = dict(self._ingest_kwargs)
+                    queue = jobqueue.JobQueue(**kwargs.pop('queue'))
+                    self._ingest = ingest.Workers(
+                        queue, dbase, store,
+                        storage_kwargs=self.storage_kwargs, **kwargs)
+        return self._ingest
+
+    @property
+    def annotations(self):
+        """The client for annotation writes: a write-behind buffer over the
+        database if configured, otherwise the database itself."""
+        if self._write_behind_kwargs is None:
+            return self.database
+        if self._annotations is None:
+            dbase = self.database
+            with self._lock:
+                if self._annotations is None:
+                    self._annotations = database.WriteBehind(
+                        dbase, **self._write_behind_kwargs)
+        return self._annotations
+
+    def close(self):
+        """Release all clients; they will be rebuilt on next access.
+
+        Ingest workers are stopped first, leaving unfinished jobs queued, and
+        buffered annotations are flushed before the database is closed.
+        """
+        with self._lock:
+            if self._ingest is not None:
+                self._ingest.close()
+            self._ingest = None
+            if self._annotations is not None:
+                self._annotations.close()
+            self._annotations = None
+            if hasattr(self._database, 'close'):
+                self._database.close()
+            self._database = None
+            self._storage = None
+            self._scheduler = None
+            self._refresh_at = None
+            self._known_audio = None
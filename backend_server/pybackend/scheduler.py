@@ -0,0 +1,275 @@
+"""Task schedulers, for choosing which audio item to annotate next.
+
+Schedulers are maintained incrementally -- items are added as they are
+ingested, and counted as they are annotated -- so that choosing a task never
+requires listing the database or scanning annotations.
+
+Each process holds its own scheduler, seeded from the database at startup,
+so annotations counted by other processes are not seen until an item's
+stored count is passed to `sync`, as happens whenever it is served. Items
+ingested by other processes are not seen until the scheduler is seeded
+again; seeding only fetches items the scheduler has not seen, so it can be
+repeated periodically. The database holds the authoritative counts;
+schedulers only approximate them.
+
+Example
+-------
+>>> import pybackend.scheduler as S
+>>> sched = S.Scheduler(backend=S.PRIORITY, target=3)
+>>> sched.add('audio:abc', count=1)
+>>> sched.add('audio:xyz')
+>>> sched.sample()
+'audio:xyz'
+>>> sched.record('audio:xyz')
+"""
+import random
+import threading
+
+from . import utils
+
+RANDOM = 'random'
+PRIORITY = 'priority'
+
+# Field on `audio` records tracking the number of annotations received.
+COUNT_FIELD = 'num_annotations'
+
+
+class RandomScheduler(object):
+    """Uniform random sampling over a set of URIs in constant time.
+
+    URIs are held in a flat array for O(1) random access, alongside a map of
+    each URI's position in that array so that removals can swap the last
+    element into the vacated slot.
+    """
+
+    def __init__(self, uris=None):
+        """Create a random scheduler.
+
+        Parameters
+        ----------
+        uris : iterable of str, default=None
+            URIs to seed the scheduler with.
+        """
+        self._uris = []
+        self._positions = dict()
+        self._lock = threading.Lock()
+        for uri in uris or []:
+            self.add(uri)
+
+    def __len__(self):
+        return len(self._uris)
+
+    def __contains__(self, uri):
+        return uri in self._positions
+
+    def add(self, uri, count=0):
+        """Add a URI; passes quietly if it is already present.
+
+        Parameters
+        ----------
+        uri : str
+            URI to add.
+
+        count : int, default=0
+            Not used; preserved for consistency with other schedulers.
+        """
+        with self._lock:
+            if uri not in self._positions:
+                self._positions[uri] = len(self._uris)
+                self._uris.append(uri)
+
+    def discard(self, uri):
+        """Remove a URI; passes quietly if it is not present."""
+        with self._lock:
+            idx = self._positions.pop(uri, None)
+            if idx is None:
+                return
+            last = self._uris.pop()
+            if idx < len(self._uris):
+                self._uris[idx] = last
+                self._positions[last] = idx
+
+    def sample(self):
+        """Return a uniformly random URI, or None if there are none."""
+        with self._lock:
+            if not self._uris:
+                return None
+            return random.choice(self._uris)
+
+    def record(self, uri):
+        """Not used; preserved for consistency with other schedulers."""
+        pass
+
+    def sync(self, uri, count):
+        """Not used; preserved for consistency with other schedulers."""
+        pass
+
+    def seed(self, dbase, kind='audio'):
+        """Add all URIs of a given kind from a database; those already
+        present are left as they are.
+
+        Parameters
+        ----------
+        dbase : pybackend.database client
+            Database to seed from.
+
+        kind : str, default='audio'
+            URI kind to schedule.
+        """
+        for uri in dbase.uris(kind=kind):
+            self.add(uri)
+
+
+class PriorityScheduler(object):
+    """Serve the least-annotated URIs first.
+
+    URIs are held in buckets keyed by annotation count, alongside the lowest
+    non-empty count; sampling draws uniformly from that bucket, and recording
+    an annotation moves a URI up one bucket, both in constant time. Once a
+    URI reaches `target` annotations, it is retired from the scheduler.
+    """
+
+    def __init__(self, target=None):
+        """Create a priority scheduler.
+
+        Parameters
+        ----------
+        target : int, default=None
+            Optional number of annotations after which a URI is no longer
+            served; if None, URIs are served indefinitely.
+        """
+        self.target = target
+        self._counts = dict()
+        self._buckets = dict()
+        self._min = None
+        # URIs that reached the target, so that seeding does not revive them.
+        self._retired = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, uri):
+        return uri in self._counts
+
+    def _insert(self, uri, count):
+        if self.target is not None and count >= self.target:
+            self._retired.add(uri)
+            return
+        self._counts[uri] = count
+        self._buckets.setdefault(count, RandomScheduler()).add(uri)
+        if self._min is None or count < self._min:
+            self._min = count
+
+    def _remove(self, uri):
+        count = self._counts.pop(uri)
+        bucket = self._buckets[count]
+        bucket.discard(uri)
+        if not len(bucket):
+            del self._buckets[count]
+        if count == self._min and count not in self._buckets:
+            # There are only as many buckets as distinct annotation counts,
+            # which is small (and at most `target`).
+            self._min = min(self._buckets) if self._buckets else None
+        return count
+
+    def add(self, uri, count=0):
+        """Add a URI; passes quietly if it is already present.
+
+        Parameters
+        ----------
+        uri : str
+            URI to add.
+
+        count : int, default=0
+            Number of annotations the URI already has.
+        """
+        with self._lock:
+            if uri not in self._counts and uri not in self._retired:
+                self._insert(uri, count)
+
+    def discard(self, uri):
+        """Remove a URI; passes quietly if it is not present."""
+        with self._lock:
+            if uri in self._counts:
+                self._remove(uri)
+
+    def sample(self):
+        """Return one of the least-annotated URIs, or None if there are none.
+        """
+        with self._lock:
+            if self._min is None:
+                return None
+            return self._buckets[self._min].sample()
+
+    def record(self, uri):
+        """Count an annotation against a URI.
+
+        Parameters
+        ----------
+        uri : str
+            URI that was annotated. Passes quietly if it is not scheduled.
+        """
+        with self._lock:
+            if uri in self._counts:
+                self._insert(uri, self._remove(uri) + 1)
+
+    def sync(self, uri, count):
+        """Set a URI's count to the number of annotations stored for it, e.g.
+        including those counted by other processes.
+
+        Parameters
+        ----------
+        uri : str
+            URI to update. Passes quietly if it is not scheduled.
+
+        count : int
+            Number of annotations the URI has.
+        """
+        with self._lock:
+            if uri in self._counts and self._counts[uri] != count:
+                self._remove(uri)
+                self._insert(uri, count)
+
+    def seed(self, dbase, kind='audio', batch_size=1000):
+        """Add all URIs of a given kind from a database, with their counts.
+
+        Records are only fetched for URIs the scheduler has not seen, so
+        reseeding picks up new URIs without rereading known ones.
+
+        Parameters
+        ----------
+        dbase : pybackend.database client
+            Database to seed from.
+
+        kind : str, default='audio'
+            URI kind to schedule.
+
+        batch_size : int, default=1000
+            Number of records to fetch per batch.
+        """
+        with self._lock:
+            seen = set(self._counts) | self._retired
+        new_uris = (uri for uri in dbase.uris(kind=kind) if uri not in seen)
+        for uris in utils.chunks(new_uris, batch_size):
+            for uri, record in zip(uris, dbase.get_many(uris)):
+                self.add(uri, count=(record or {}).get(COUNT_FIELD, 0))
+
+
+BACKENDS = {
+    RANDOM: RandomScheduler,
+    PRIORITY: PriorityScheduler
+}
+
+
+def Scheduler(backend=RANDOM, **kwargs):
+    """Factory constructor for different task schedulers.
+
+    Parameters
+    ----------
+    backend : str, default='random'
+        Scheduling strategy to use, one of ['random', 'priority'].
+
+    **kwargs : Additional arguments to pass through to the different backends.
+    """
+    return BACKENDS[backend](**kwargs)
@@ -10,16 +10,24 @@ Example
 >>> print(store.download(key))
 b"hello darkness my old friend"
 """
+import collections
+import errno
 from google.cloud import storage
 import io
 import logging
 import os
+import shutil
+import threading
 import warnings
 
-from . import GCLOUD, LOCAL
+from . import GCLOUD, LOCAL, TIERED
+from . import utils
 
 logger = logging.getLogger(__name__)
 
+# Extension of files still being written; these are never blobs.
+PART_EXT = 'part'
+
 
 def _makedirs(dpath):
     if not os.path.exists(dpath):
@@ -27,6 +35,14 @@ def _makedirs(dpath):
     return dpath
 
 
+def _replace(src, dst):
+    """Atomically move `src` over `dst`, where the platform allows."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        os.rename(src, dst)
+
+
 class LocalData(object):
 
     def __init__(self, name, root):
@@ -38,6 +54,15 @@ class LocalData(object):
         return os.path.join(self.root, self.name)
 
 
+def _read_range(fp, start=None, end=None):
+    """Read bytes `start` through `end`, inclusive, from an open file."""
+    if start:
+        fp.seek(start)
+    if end is None:
+        return fp.read()
+    return fp.read(end + 1 - (start or 0))
+
+
 class LocalBlob(LocalData):
 
     def upload_from_string(self, bstream, content_type):
@@ -55,17 +80,62 @@ class LocalBlob(LocalData):
         with open(self.path, 'wb') as fp:
             fp.write(bstream)
 
-    def download_as_string(self):
+    def upload_from_file(self, fp, content_type):
+        """Upload data from a file-like object, in chunks.
+
+        The data is only moved into place once completely written, so a
+        failed upload never leaves a partial blob behind.
+
+        Parameters
+        ----------
+        fp : file-like
+            Binary stream to upload, read from its current position.
+
+        content_type : str
+            Not used; preserved for consistency with gcloud.storage.
+        """
+        tmp_path = os.path.extsep.join([self.path, PART_EXT])
+        with open(tmp_path, 'wb') as fout:
+            shutil.copyfileobj(fp, fout)
+        _replace(tmp_path, self.path)
+
+    def download_to_filename(self, filename):
+        """Download the data to a file on disk.
+
+        Parameters
+        ----------
+        filename : str
+            Path to write the data to.
+        """
+        shutil.copyfile(self.path, filename)
+
+    @property
+    def size(self):
+        """Size of the blob, in bytes."""
+        return os.path.getsize(self.path)
+
+    def exists(self):
+        """Whether the blob's data exists."""
+        return os.path.exists(self.path)
+
+    def download_as_string(self, start=None, end=None):
         """Upload data as a bytestring.
 
+        Parameters
+        ----------
+        start : int, default=None
+            Optional first byte to read.
+
+        end : int, default=None
+            Optional last byte to read, inclusive (as with gcloud.storage).
+
         Returns
         -------
         bstream : bytes
             Bytestring format of the data.
         """
         with open(self.path, 'rb') as fp:
-            fdata = fp.read()
-        return fdata
+            return _read_range(fp, start, end)
 
 
 class LocalBucket(LocalData):
@@ -101,16 +171,325 @@ class LocalClient(object):
         return LocalBucket(name=name, root=self.root_dir)
 
 
+class DiskTier(object):
+    """Least-recently-used bookkeeping for files under a directory.
+
+    Access times are recorded in each file's mtime, so the recency order --
+    and the files themselves -- survive process restarts.
+    """
+
+    def __init__(self, root, max_bytes):
+        """Create a disk tier, indexing any files already under `root`.
+
+        Parameters
+        ----------
+        root : str
+            Directory holding the files.
+
+        max_bytes : int
+            Disk budget; least recently used files are deleted beyond this.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._files = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        existing = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for fname in filenames:
+                if fname.endswith(os.path.extsep + PART_EXT):
+                    # Partial downloads, whether abandoned or in progress
+                    # elsewhere, are not blobs.
+                    continue
+                path = os.path.join(dirpath, fname)
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, path, stat.st_size))
+        for mtime, path, size in sorted(existing):
+            self._files[path] = size
+            self.num_bytes += size
+        self._evict()
+
+    def __contains__(self, path):
+        return path in self._files
+
+    def add(self, path):
+        """Start tracking a newly written file, evicting others as needed."""
+        size = os.path.getsize(path)
+        with self._lock:
+            self.num_bytes += size - self._files.pop(path, 0)
+            self._files[path] = size
+            self._evict()
+
+    def touch(self, path):
+        """Mark a file as just used."""
+        with self._lock:
+            if path in self._files:
+                self._files[path] = self._files.pop(path)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Never evict the most recent file, which is about to be read.
+        while self.num_bytes > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self.num_bytes -= size
+            logger.debug("Evicting {} ({} bytes)".format(path, size))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class TieredBlob(LocalBlob):
+    """A blob cached on local disk in front of a remote blob."""
+
+    def __init__(self, name, root, remote_bucket, tier, remote_blob=None):
+        super(TieredBlob, self).__init__(name, root)
+        self.remote_bucket = remote_bucket
+        self.tier = tier
+        self._remote_blob = remote_blob
+
+    @property
+    def remote(self):
+        if self._remote_blob is None:
+            self._remote_blob = self.remote_bucket.blob(self.name)
+        return self._remote_blob
+
+    def upload_from_string(self, bstream, content_type):
+        """Upload data as a bytestring, to both tiers.
+
+        Parameters
+        ----------
+        bstream : bytes
+            Bytestring to upload.
+
+        content_type : str
+            MIME type of the data.
+        """
+        self.remote.upload_from_string(bstream, content_type=content_type)
+        super(TieredBlob, self).upload_from_string(bstream, content_type)
+        self.tier.add(self.path)
+
+    def upload_from_file(self, fp, content_type):
+        """Upload data from a file-like object, to both tiers.
+
+        Parameters
+        ----------
+        fp : file-like
+            Binary stream to upload, read from its current position.
+
+        content_type : str
+            MIME type of the data.
+        """
+        super(TieredBlob, self).upload_from_file(fp, content_type)
+        try:
+            with open(self.path, 'rb') as fin:
+                self.remote.upload_from_file(fin, content_type=content_type)
+        except BaseException:
+            os.remove(self.path)
+            raise
+        self.tier.add(self.path)
+
+    def _open(self):
+        """Open the data on local disk, fetching it first on a miss.
+
+        Other threads may evict the file at any moment, so it is opened
+        rather than checked for; an open file stays readable once deleted.
+        """
+        try:
+            fp = open(self.path, 'rb')
+        except (IOError, OSError) as derp:
+            if derp.errno != errno.ENOENT:
+                raise
+        else:
+            self.tier.touch(self.path)
+            return fp
+
+        tmp_path = os.path.extsep.join(
+            [self.path, str(threading.current_thread().ident), PART_EXT])
+        self.remote.download_to_filename(tmp_path)
+        fp = open(tmp_path, 'rb')
+        _replace(tmp_path, self.path)
+        self.tier.add(self.path)
+        return fp
+
+    @property
+    def size(self):
+        """Size of the blob, in bytes."""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            pass
+        if self.remote.size is None:
+            # Evicted since it was checked, and the remote blob was made
+            # without fetching its metadata.
+            remote = self.remote_bucket.get_blob(self.name)
+            if remote is None:
+                return None
+            self._remote_blob = remote
+        return self.remote.size
+
+    def exists(self):
+        """Whether the blob's data exists, locally or remotely."""
+        return os.path.exists(self.path) or self.remote.exists()
+
+    def download_as_string(self, start=None, end=None):
+        """Download data as a bytestring, via local disk.
+
+        Parameters
+        ----------
+        start : int, default=None
+            Optional first byte to read.
+
+        end : int, default=None
+            Optional last byte to read, inclusive.
+
+        Returns
+        -------
+        bstream : bytes
+            Bytestring format of the data.
+        """
+        with self._open() as fp:
+            return _read_range(fp, start, end)
+
+
+class TieredBucket(LocalData):
+
+    def __init__(self, name, root, remote, tier):
+        super(TieredBucket, self).__init__(name, root)
+        self.remote = remote
+        self.tier = tier
+
+    def blob(self, name):
+        return TieredBlob(name, _makedirs(self.path), self.remote, self.tier)
+
+    def get_blob(self, name):
+        blob = TieredBlob(name, _makedirs(self.path), self.remote, self.tier)
+        if not os.path.exists(blob.path):
+            # Fetch metadata, and check that the blob exists.
+            blob._remote_blob = self.remote.get_blob(name)
+            if blob._remote_blob is None:
+                return None
+        return blob
+
+
+class TieredClient(object):
+
+    def __init__(self, project, root_dir, max_bytes, remote=None):
+        """Create a storage client with a local disk tier.
+
+        Parameters
+        ----------
+        project : str
+            Unique identifier for the owner of the client.
+
+        root_dir : str
+            A directory on disk for caching binary data.
+
+        max_bytes : int
+            Disk budget for `root_dir`, in bytes.
+
+        remote : storage client, default=None
+            Client for the backing store; defaults to a gcloud client.
+        """
+        self.project = project
+        self.root_dir = _makedirs(root_dir)
+        self.tier = DiskTier(self.root_dir, max_bytes)
+        self.remote = remote or storage.Client(project=project)
+
+    def get_bucket(self, name):
+        """Returns a bucket for the given name."""
+        return TieredBucket(name, self.root_dir,
+                            self.remote.get_bucket(name), self.tier)
+
+
 BACKENDS = {
     GCLOUD: storage.Client,
-    LOCAL: LocalClient
+    LOCAL: LocalClient,
+    TIERED: TieredClient
 }
 
 
+class BlobCache(object):
+    """An in-memory LRU cache of binary data, bounded by total bytes."""
+
+    def __init__(self, capacity):
+        """Create a blob cache.
+
+        Parameters
+        ----------
+        capacity : int
+            Maximum number of bytes to hold; items larger than this are never
+            cached.
+        """
+        self.capacity = capacity
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """Return the data for a key, or None if it is not cached."""
+        with self._lock:
+            data = self._items.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            # Re-insert as the most recently used.
+            self._items[key] = data
+            self.hits += 1
+            return data
+
+    def peek(self, key):
+        """Return the data for a key without counting it as a use."""
+        with self._lock:
+            return self._items.get(key)
+
+    def put(self, key, data):
+        """Cache the data for a key, evicting the least recently used."""
+        with self._lock:
+            self._pop(key)
+            if len(data) > self.capacity:
+                return
+            while self.num_bytes + len(data) > self.capacity:
+                self._pop(next(iter(self._items)))
+                self.evictions += 1
+            self._items[key] = data
+            self.num_bytes += len(data)
+
+    def discard(self, key):
+        """Drop a key from the cache; passes quietly if not present."""
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        data = self._items.pop(key, None)
+        if data is not None:
+            self.num_bytes -= len(data)
+
+    def stats(self):
+        """Return the cache's counters, as a dict."""
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, num_bytes=self.num_bytes,
+                    num_items=len(self._items))
+
+
 class Storage(object):
 
     def __init__(self, name, project, backend=GCLOUD,
-                 local_dir=None):
+                 local_dir=None, cache_size=0, cache_item_size=None,
+                 local_size=None):
         """Create a storage object.
 
         Parameters
@@ -122,26 +501,59 @@ class Storage(object):
             Unique identifier for the owner of this storage object.
 
         backend : str, default='gcloud'
-            Backend storage platform to use, one of ['local', 'gcloud'].
+            Backend storage platform to use, one of ['local', 'gcloud',
+            'tiered']; 'tiered' is gcloud behind a local disk cache.
 
         local_dir : str, default=None
             A local directory on disk to use for local clients; only used if
-            backend='local'.
+            backend is 'local' or 'tiered'.
+
+        cache_size : int, default=0
+            If non-zero, keep up to this many bytes of recently read data in
+            memory, evicting the least recently used.
+
+        cache_item_size : int, default=None
+            Largest object, in bytes, that streamed reads will pull fully into
+            the cache; defaults to 1/8 of `cache_size`.
+
+        local_size : int, default=None
+            Disk budget for `local_dir`, in bytes; required if
+            backend='tiered'.
         """
-        if backend == LOCAL and local_dir is None:
+        if backend in [LOCAL, TIERED] and local_dir is None:
+            raise ValueError(
+                "`local_dir` must be given if backend is '{}'"
+                .format(backend))
+        if backend == TIERED and local_size is None:
             raise ValueError(
-                "`local_dir` must be given if backend is '{}'".format(LOCAL))
+                "`local_size` must be given if backend is '{}'"
+                .format(TIERED))
         self.name = name
         self.project = project
         self._backend = backend
         self._client_kwargs = dict(project=project)
-        if self._backend == LOCAL:
+        if self._backend in [LOCAL, TIERED]:
             self._client_kwargs.update(
                 root_dir=os.path.abspath(os.path.expanduser(local_dir)))
+        if self._backend == TIERED:
+            self._client_kwargs.update(max_bytes=local_size)
+        self._client = None
+        self._bucket = None
+        self.cache = BlobCache(cache_size) if cache_size else None
+        self.cache_item_size = (cache_size // 8 if cache_item_size is None
+                                else cache_item_size)
 
     @property
     def client(self):
-        return BACKENDS[self._backend](**self._client_kwargs)
+        if self._client is None:
+            self._client = BACKENDS[self._backend](**self._client_kwargs)
+        return self._client
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = self.client.get_bucket(self.name)
+        return self._bucket
 
     def put(self, key, fdata):
         """Put filedata into GCS.
@@ -155,9 +567,27 @@ class Storage(object):
             File's bytestream.
         """
         logger.debug("Uploading {} bytes to {}.".format(len(fdata), key))
-        bucket = self.client.get_bucket(self.name)
-        blob = bucket.blob(key)
+        blob = self.bucket.blob(key)
         blob.upload_from_string(fdata, content_type="application/octet-stream")
+        if self.cache is not None:
+            self.cache.put(key, fdata)
+
+    def put_file(self, key, fp):
+        """Put the contents of a file-like object into storage, in chunks.
+
+        Parameters
+        ----------
+        key : str
+            Key for writing the file data.
+
+        fp : file-like
+            Binary stream to upload, read from its current position.
+        """
+        logger.debug("Uploading stream to {}.".format(key))
+        blob = self.bucket.blob(key)
+        blob.upload_from_file(fp, content_type="application/octet-stream")
+        if self.cache is not None:
+            self.cache.discard(key)
 
     def get(self, key):
         """Retrieve binary data for the given key.
@@ -172,6 +602,95 @@ class Storage(object):
         data : bytes
             Binary data.
         """
-        bucket = self.client.get_bucket(self.name)
-        blob = bucket.get_blob(key)
-        return blob.download_as_string()
+        data = self.cache.get(key) if self.cache is not None else None
+        if data is None:
+            blob = self.bucket.get_blob(key)
+            data = blob.download_as_string()
+            if self.cache is not None:
+                self.cache.put(key, data)
+        return data
+
+    def size(self, key):
+        """Return the size of the data for the given key, in bytes."""
+        data = self.cache.peek(key) if self.cache is not None else None
+        if data is not None:
+            return len(data)
+        return self.bucket.get_blob(key).size
+
+    def exists(self, key):
+        """Return whether data exists for the given key.
+
+        For cloud backends, this only requests the object's metadata.
+        """
+        if self.cache is not None and key in self.cache:
+            return True
+        return self.bucket.blob(key).exists()
+
+    def head(self, key):
+        """Return metadata for the given key, without reading its data.
+
+        Parameters
+        ----------
+        key : str
+            Name of the object to describe.
+
+        Returns
+        -------
+        meta : dict or None
+            Object with the `size` of the data in bytes, or None if there is
+            no data for the key.
+        """
+        data = self.cache.peek(key) if self.cache is not None else None
+        if data is not None:
+            return dict(size=len(data))
+        blob = self.bucket.get_blob(key)
+        try:
+            # Local buckets return blobs whether or not they exist.
+            return None if blob is None else dict(size=blob.size)
+        except (IOError, OSError):
+            return None
+
+    def iter_range(self, key, start=0, stop=None,
+                   chunk_size=utils.CHUNK_SIZE):
+        """Stream a byte range of the data for the given key, in chunks.
+
+        Only one chunk is held in memory at a time; for cloud backends, each
+        chunk is a ranged download. If caching is enabled, objects up to
+        `cache_item_size` are instead read in full and served from the cache.
+
+        Parameters
+        ----------
+        key : str
+            Name of the object to retrieve.
+
+        start : int, default=0
+            First byte to read.
+
+        stop : int, default=None
+            Byte at which to stop, exclusive; if None, reads to the end.
+
+        chunk_size : int, default=1MB
+            Maximum number of bytes per chunk.
+
+        Yields
+        ------
+        data : bytes
+            Consecutive chunks of binary data.
+        """
+        data = self.cache.get(key) if self.cache is not None else None
+        if data is None:
+            blob = self.bucket.get_blob(key)
+            if self.cache is not None and blob.size <= self.cache_item_size:
+                data = blob.download_as_string()
+                self.cache.put(key, data)
+
+        if data is not None:
+            stop = len(data) if stop is None else stop
+            for offset in range(start, stop, chunk_size):
+                yield data[offset:min(offset + chunk_size, stop)]
+            return
+
+        stop = blob.size if stop is None else stop
+        for offset in range(start, stop, chunk_size):
+            end = min(offset + chunk_size, stop) - 1
+            yield blob.download_as_string(start=offset, end=end)
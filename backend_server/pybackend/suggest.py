@@ -0,0 +1,360 @@
+"""Instrument tag suggestions, from co-occurrence statistics.
+
+Counts of how often each pair of tags is heard together are kept in a dense
+matrix over the annotation vocabulary, seeded from the Jamendo per-track
+instrument sets and updated as annotations are submitted. The matrix is
+stored as a single database record (see `CoOccurrence.to_record`), so it can
+be shared between processes and loaded without recounting. Suggestions for a
+clip are the tags most likely to accompany those it already has, or the most
+common tags if it has none.
+
+Instrument names outside the vocabulary, e.g. those used by Jamendo, are
+resolved through the instrument hierarchy (see `pybackend.taxonomy`): to the
+tag for the same instrument, else to the tag for the kind of instrument its
+name ends with, e.g. 'electric guitar' to 'guitar'.
+
+Example
+-------
+>>> import pybackend.suggest as S
+>>> import pybackend.taxonomy as T
+>>> hier = T.Hierarchy('data/jamendo/instruments_taxonomy_per_category.json')
+>>> engine = S.CoOccurrence(['drums', 'guitar', 'piano', 'vocals'], hier)
+>>> engine.update(S.load_tracks('data/jamendo-instruments-per-track.json'))
+>>> engine.add(['guitar', 'vocals'])
+>>> engine.suggest(['guitar'], 2)
+['drums', 'vocals']
+"""
+import logging
+import numpy as np
+import six
+import threading
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Annotation tags for instruments, as named by Jamendo, that can't be
+# resolved from their names alone.
+INSTRUMENT_TAGS = {
+    'acoustic bass guitar': 'bass',
+    'drum': 'drums',
+    'fiddle': 'violin',
+    'glockenspiel': 'mallet percusion',
+    'hammond': 'organ',
+    'marimba': 'mallet percusion',
+    'metallophone': 'mallet percusion',
+    'rhodes': 'piano',
+    'vibraphone': 'mallet percusion',
+    'voice': 'vocals',
+    'xylophone': 'mallet percusion'
+}
+
+# Number of tag sets counted per matrix product in `update`.
+BATCH_SIZE = 4096
+
+
+def load_tracks(path):
+    """Iterate over the instrument tags of each track in a Jamendo file.
+
+    Parameters
+    ----------
+    path : str
+        JSON object mapping track ids to lists of instrument tags.
+
+    Yields
+    ------
+    tags : list of str
+        Instrument tags of one track.
+    """
+    with open(path) as fp:
+        for _, tags in utils.iter_json_items(fp):
+            yield tags
+
+
+def annotation_tags(response):
+    """Return the instrument tags in a submitted annotation.
+
+    Parameters
+    ----------
+    response : dict
+        Annotation, as submitted by the annotator; tags are expected under
+        `annotations`, either as strings or as objects with an `annotation`
+        field.
+
+    Returns
+    -------
+    tags : list of str
+        Instrument tags, in order; empty if there are none.
+    """
+    annotations = (response or {}).get('annotations')
+    if not isinstance(annotations, list):
+        return []
+    tags = []
+    for item in annotations:
+        if isinstance(item, dict):
+            item = item.get('annotation')
+        if isinstance(item, six.string_types) and item:
+            tags.append(item)
+    return tags
+
+
+class CoOccurrence(object):
+    """Tag suggestions ranked by co-occurrence.
+
+    The count of tag `j` given tag `i` is kept at `counts[i, j]`, with the
+    number of times `i` was heard at all on the diagonal. A candidate's score
+    is the sum over the clip's tags of its conditional frequency; ties, and
+    clips with no known tags, fall back to overall popularity.
+
+    Rankings for single tags are cached, and only the rows touched by new
+    data are re-ranked, so the common case is a list lookup.
+    """
+
+    def __init__(self, tags, hierarchy=None, instrument_tags=None,
+                 num_suggestions=5):
+        """Create an empty co-occurrence model.
+
+        Parameters
+        ----------
+        tags : list of str
+            Vocabulary of tags to suggest.
+
+        hierarchy : pybackend.taxonomy.Hierarchy, default=None
+            Instrument hierarchy through which other names are resolved to
+            tags; if None, only names in `tags` or `instrument_tags` are
+            known.
+
+        instrument_tags : dict, default=None
+            Map of instrument names to tags in `tags`, for those that can't
+            be resolved otherwise; defaults to `INSTRUMENT_TAGS`.
+
+        num_suggestions : int, default=5
+            Default number of tags to suggest.
+        """
+        self.tags = tuple(tags)
+        self.hierarchy = hierarchy
+        self.num_suggestions = num_suggestions
+        self._index = dict()
+        for idx, tag in enumerate(self.tags):
+            self._index[tag] = idx
+        for idx, tag in enumerate(self.tags):
+            self._index.setdefault(self._canonical(tag), idx)
+        if instrument_tags is None:
+            instrument_tags = INSTRUMENT_TAGS
+        for name, tag in instrument_tags.items():
+            if tag in self._index:
+                self._index.setdefault(self._canonical(name),
+                                       self._index[tag])
+        if hierarchy is not None:
+            # Kinds of an instrument, e.g. 'double bass', take its tag.
+            for inst in hierarchy.all_instruments:
+                kind = self._index.get(self._canonical(inst.split()[-1]))
+                if kind is not None:
+                    self._index.setdefault(inst, kind)
+
+        num_tags = len(self.tags)
+        self.counts = np.zeros((num_tags, num_tags), dtype=np.int64)
+        self._ranked = [None] * num_tags
+        self._popular = None
+        self._lock = threading.Lock()
+
+    def _canonical(self, name):
+        if self.hierarchy is None:
+            return name
+        return self.hierarchy.normalize(name) or name
+
+    def tag_id(self, name):
+        """Return the vocabulary index of a tag name, or None if unknown."""
+        idx = self._index.get(name)
+        if idx is None:
+            idx = self._index.get(self._canonical(name))
+        return idx
+
+    def encode(self, tags):
+        """Return the sorted, unique vocabulary indexes of some tag names."""
+        ids = set(self.tag_id(tag) for tag in tags
+                  if isinstance(tag, six.string_types))
+        ids.discard(None)
+        return np.array(sorted(ids), dtype=np.intp)
+
+    def _invalidate(self, ids):
+        for idx in ids:
+            self._ranked[idx] = None
+        self._popular = None
+
+    def add(self, tags):
+        """Count the tags heard together in one clip.
+
+        Parameters
+        ----------
+        tags : iterable of str
+            Tags of the clip; unknown tags are ignored.
+        """
+        ids = self.encode(tags)
+        if not len(ids):
+            return
+        with self._lock:
+            self.counts[np.ix_(ids, ids)] += 1
+            self._invalidate(ids)
+
+    def update(self, tag_sets):
+        """Count the tags heard together in many clips.
+
+        Parameters
+        ----------
+        tag_sets : iterable of iterables of str
+            Tags of each clip; unknown tags are ignored.
+
+        Returns
+        -------
+        count : int
+            Number of clips with at least one known tag.
+        """
+        counts, count = self.tally(tag_sets)
+        if count:
+            with self._lock:
+                self.counts += counts
+                self._invalidate(np.flatnonzero(np.diag(counts)))
+        return count
+
+    def tally(self, tag_sets):
+        """Count the tags heard together in many clips, without adding them
+        to the model.
+
+        Parameters
+        ----------
+        tag_sets : iterable of iterables of str
+            Tags of each clip; unknown tags are ignored.
+
+        Returns
+        -------
+        counts : np.ndarray, shape=(len(tags), len(tags))
+            Co-occurrence counts of the clips, as for `counts`.
+
+        count : int
+            Number of clips with at least one known tag.
+        """
+        count = 0
+        num_tags = len(self.tags)
+        total = np.zeros((num_tags, num_tags), dtype=np.int64)
+        for batch in utils.chunks(tag_sets, BATCH_SIZE):
+            rows, cols = [], []
+            for tags in batch:
+                ids = self.encode(tags)
+                if len(ids):
+                    rows.extend([count] * len(ids))
+                    cols.extend(ids)
+                    count += 1
+            if not rows:
+                continue
+            # One-hot rows, one per clip; their Gram matrix is the batch's
+            # co-occurrence counts.
+            onehot = np.zeros((rows[-1] - rows[0] + 1, num_tags),
+                              dtype=np.float64)
+            onehot[np.array(rows) - rows[0], cols] = 1
+            total += np.dot(onehot.T, onehot).round().astype(np.int64)
+        return total, count
+
+    def to_record(self, counts=None):
+        """Return co-occurrence counts as a database record.
+
+        Parameters
+        ----------
+        counts : np.ndarray, default=None
+            Counts to store, aligned with `tags`; defaults to `counts`.
+
+        Returns
+        -------
+        record : dict
+            The vocabulary, under `tags`, and the counts, flattened in row
+            major order, under `counts`.
+        """
+        counts = self.counts if counts is None else counts
+        return dict(tags=list(self.tags),
+                    counts=[int(val) for val in counts.ravel()])
+
+    def from_record(self, record):
+        """Return the co-occurrence counts stored in a database record.
+
+        Parameters
+        ----------
+        record : dict
+            Record, as returned by `to_record`, possibly over a different
+            vocabulary; counts for tags not in `tags` are dropped.
+
+        Returns
+        -------
+        counts : np.ndarray, shape=(len(tags), len(tags))
+            Counts, aligned with `tags`.
+        """
+        stored = record['tags']
+        num_stored = len(stored)
+        values = np.array(record['counts'], dtype=np.int64)
+        if values.shape != (num_stored * num_stored,):
+            raise ValueError("Expected {} counts for {} tags, not {}"
+                             .format(num_stored ** 2, num_stored, len(values)))
+        values = values.reshape(num_stored, num_stored)
+        src = np.array([idx for idx, tag in enumerate(stored)
+                        if tag in self.tags], dtype=np.intp)
+        dst = np.array([self.tags.index(stored[idx]) for idx in src],
+                       dtype=np.intp)
+        counts = np.zeros((len(self.tags), len(self.tags)), dtype=np.int64)
+        counts[np.ix_(dst, dst)] = values[np.ix_(src, src)]
+        return counts
+
+    def load(self, record):
+        """Replace the co-occurrence counts with those in a database record;
+        see `from_record`."""
+        counts = self.from_record(record)
+        with self._lock:
+            self.counts = counts
+            self._invalidate(range(len(self.tags)))
+
+    def _popularity(self):
+        if self._popular is None:
+            # Most heard first; ties in vocabulary order.
+            self._popular = np.argsort(-np.diag(self.counts), kind='mergesort')
+        return self._popular
+
+    def _rank(self, scores, exclude):
+        scores = np.array(scores, dtype=np.float64)
+        scores[exclude] = -np.inf
+        # Sort by score, then by popularity.
+        popular = self._popularity()
+        order = np.argsort(-scores[popular], kind='mergesort')
+        return [self.tags[idx] for idx in popular[order]
+                if idx not in exclude]
+
+    def _conditional(self, ids):
+        counts = self.counts[ids].astype(np.float64)
+        return counts / np.maximum(np.diag(self.counts)[ids], 1)[:, np.newaxis]
+
+    def suggest(self, tags=(), num=None):
+        """Suggest the tags most likely to accompany some others.
+
+        Parameters
+        ----------
+        tags : iterable of str, default=()
+            Tags already known for the clip; unknown tags are ignored.
+
+        num : int, default=None
+            Number of suggestions; defaults to `num_suggestions`.
+
+        Returns
+        -------
+        suggestions : list of str
+            Suggested tags, most likely first, excluding those given.
+        """
+        num = self.num_suggestions if num is None else num
+        ids = self.encode(tags)
+        with self._lock:
+            if not len(ids):
+                return [self.tags[idx] for idx in self._popularity()[:num]]
+            if len(ids) == 1:
+                idx = ids[0]
+                if self._ranked[idx] is None:
+                    self._ranked[idx] = self._rank(
+                        self._conditional(ids)[0], [idx])
+                return self._ranked[idx][:num]
+            scores = self._conditional(ids).sum(axis=0)
+            return self._rank(scores, list(ids))[:num]
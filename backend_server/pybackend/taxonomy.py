@@ -0,0 +1,357 @@
+"""Instrument taxonomy, cached in-process.
+
+The taxonomy is loaded once, from a bundled JSON schema, and its serialized
+form precomputed, so that serving it costs nothing. Once its time-to-live
+runs out, it is refreshed in a background thread -- from a URL if given,
+otherwise from the file -- while the current copy keeps being served.
+
+The instrument hierarchy, mapping instruments to their categories and back,
+is likewise loaded once into lookup tables, and shared by everything that
+needs to group or normalize instrument names.
+
+Example
+-------
+>>> import pybackend.taxonomy as T
+>>> tax = T.Taxonomy('data/instrument_taxonomy_v0.json', ttl=3600)
+>>> tax.instruments[:3]
+['accordion', 'banjo', 'bass']
+>>> tax.json[:24]
+b'["accordion", "banjo", '
+>>> hier = T.Hierarchy('data/jamendo/instruments_taxonomy_per_category.json',
+...                    'data/jamendo/instruments_taxonomy_per_instrument.json')
+>>> hier.categories('Electric Guitar')
+('electric', 'popular')
+>>> hier.normalize('bongos')
+'bongo'
+"""
+import json
+import logging
+import requests
+import six
+from six.moves import intern
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Field of the JSON schema holding the instrument tags.
+INSTRUMENT_FIELD = 'tag_open_mic_instruments'
+
+
+def parse(schema):
+    """Return the instrument tags from a taxonomy schema.
+
+    Parameters
+    ----------
+    schema : dict
+        Taxonomy, as a JSON schema.
+
+    Returns
+    -------
+    instruments : list of str
+        Instrument tags, in order.
+
+    Raises
+    ------
+    ValueError
+        If the schema has no instrument tags.
+    """
+    try:
+        instruments = schema[INSTRUMENT_FIELD]['value']['enum']
+    except (KeyError, TypeError):
+        instruments = None
+    if not instruments or not all(isinstance(inst, six.string_types)
+                                  for inst in instruments):
+        raise ValueError("Taxonomy has no instrument tags under `{}`"
+                         .format(INSTRUMENT_FIELD))
+    return list(instruments)
+
+
+class Taxonomy(object):
+
+    def __init__(self, path, url=None, ttl=3600.0, timeout=5.0):
+        """Load a taxonomy.
+
+        Parameters
+        ----------
+        path : str or None
+            Bundled taxonomy schema, as JSON, to load immediately; if None,
+            the taxonomy is fetched from `url` instead.
+
+        url : str, default=None
+            Optional source of updates to the taxonomy; if None, refreshes
+            re-read `path`.
+
+        ttl : float, default=3600.0
+            Time in seconds after which the taxonomy is refreshed.
+
+        timeout : float, default=5.0
+            Time in seconds to wait on `url`.
+        """
+        self.path = path
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._refreshing = False
+        if path is None and url is None:
+            raise ValueError("A taxonomy needs a `path` or a `url`.")
+        if path is None:
+            self._update(self._fetch())
+        else:
+            with open(path) as fp:
+                self._update(json.load(fp))
+
+    def _update(self, schema):
+        instruments = parse(schema)
+        # Swap in all at once, so readers never see a mix.
+        self._state = (instruments,
+                       json.dumps(instruments).encode('utf-8'),
+                       time.time() + self.ttl)
+
+    def _fetch(self):
+        if self.url is None:
+            with open(self.path) as fp:
+                return json.load(fp)
+        resp = requests.get(self.url, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def refresh(self):
+        """Reload the taxonomy now; on failure, keep the current copy."""
+        try:
+            self._update(self._fetch())
+            logger.info("Refreshed taxonomy")
+        except Exception as derp:
+            logger.warning("Failed refreshing taxonomy: {}".format(derp))
+            instruments, data, _ = self._state
+            self._state = (instruments, data, time.time() + self.ttl)
+        finally:
+            self._refreshing = False
+
+    def _current(self):
+        state = self._state
+        if time.time() >= state[2] and not self._refreshing:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    thread = threading.Thread(target=self.refresh,
+                                              name='taxonomy-refresh')
+                    thread.daemon = True
+                    thread.start()
+        return state
+
+    @property
+    def instruments(self):
+        """Instrument tags, as a new list."""
+        return list(self._current()[0])
+
+    @property
+    def json(self):
+        """Instrument tags, serialized as a JSON array."""
+        return self._current()[1]
+
+
+# Common names for instruments, beyond differences in case, punctuation and
+# plurals, which are always ignored.
+ALIASES = {
+    'classical guitar': 'acoustic guitar',
+    'contrabass': 'double bass',
+    'hang': 'hang drum',
+    'jaw harp': "jew's-harp",
+    'keys': 'keyboard',
+    'sax': 'saxophone',
+    'steel drum': 'steelpan',
+    'synth': 'synthesizer',
+    'upright bass': 'double bass'
+}
+
+
+def _alias_key(name):
+    """Return the lookup key for an instrument name: lowercase, and only
+    letters and digits."""
+    return ''.join(c for c in name.lower() if c.isalnum())
+
+
+def _edges(mapping, what):
+    if not isinstance(mapping, dict) or not all(
+            isinstance(key, six.string_types) and isinstance(values, list) and
+            all(isinstance(val, six.string_types) for val in values)
+            for key, values in mapping.items()):
+        raise ValueError("Hierarchy {} must map names to lists of names"
+                         .format(what))
+    return set((key, val) for key, values in mapping.items()
+               for val in values)
+
+
+class Hierarchy(object):
+    """Bidirectional index of instrument categories.
+
+    Instruments and categories are numbered in sorted order, and each is
+    mapped to the ids of the other as a tuple; names are interned, so the
+    tables share a single copy of each. An instrument may belong to several
+    categories.
+    """
+
+    def __init__(self, per_category, per_instrument=None, aliases=None):
+        """Load an instrument hierarchy.
+
+        Parameters
+        ----------
+        per_category : str
+            Path to a JSON object mapping categories to their instruments.
+
+        per_instrument : str, default=None
+            Path to a JSON object mapping instruments to their categories;
+            if given, it must agree with `per_category`.
+
+        aliases : dict, default=None
+            Map of alternative names to instruments; defaults to `ALIASES`.
+
+        Raises
+        ------
+        ValueError
+            If the files are malformed or disagree, or an alias names an
+            unknown instrument.
+        """
+        with open(per_category) as fp:
+            edges = set((inst, cat) for cat, inst in
+                        _edges(json.load(fp), 'categories'))
+        if per_instrument is not None:
+            with open(per_instrument) as fp:
+                if _edges(json.load(fp), 'instruments') != edges:
+                    raise ValueError("Hierarchy files {} and {} disagree"
+                                     .format(per_category, per_instrument))
+
+        self._instruments = tuple(sorted(
+            set(intern(str(inst)) for inst, _ in edges)))
+        self._categories = tuple(sorted(
+            set(intern(str(cat)) for _, cat in edges)))
+        self._instrument_ids = {name: idx for idx, name
+                                in enumerate(self._instruments)}
+        self._category_ids = {name: idx for idx, name
+                              in enumerate(self._categories)}
+
+        by_instrument = [[] for _ in self._instruments]
+        by_category = [[] for _ in self._categories]
+        for inst, cat in sorted(edges):
+            inst_id = self._instrument_ids[inst]
+            cat_id = self._category_ids[cat]
+            by_instrument[inst_id].append(cat_id)
+            by_category[cat_id].append(inst_id)
+        self._by_instrument = tuple(tuple(ids) for ids in by_instrument)
+        self._by_category = tuple(tuple(sorted(ids)) for ids in by_category)
+        # Answers are handed out as-is, so build each tuple of names once.
+        self._instrument_categories = tuple(
+            tuple(self._categories[idx] for idx in ids)
+            for ids in self._by_instrument)
+        self._category_instruments = tuple(
+            tuple(self._instruments[idx] for idx in ids)
+            for ids in self._by_category)
+
+        self._aliases = dict()
+        for name, inst_id in self._instrument_ids.items():
+            self._aliases[_alias_key(name)] = inst_id
+        for alias, name in (ALIASES if aliases is None else aliases).items():
+            if name not in self._instrument_ids:
+                raise ValueError("Alias `{}` names unknown instrument `{}`"
+                                 .format(alias, name))
+            self._aliases.setdefault(_alias_key(alias),
+                                     self._instrument_ids[name])
+
+    def __contains__(self, name):
+        """Whether `name` is an instrument, or an alias of one."""
+        return self.instrument_id(name) is not None
+
+    @property
+    def all_instruments(self):
+        """All instruments, in order of id."""
+        return self._instruments
+
+    @property
+    def all_categories(self):
+        """All categories, in order of id."""
+        return self._categories
+
+    def instrument_id(self, name):
+        """Return the id of an instrument, given any of its names.
+
+        Parameters
+        ----------
+        name : str
+            Instrument name or alias; case, punctuation and a trailing plural
+            's' are ignored.
+
+        Returns
+        -------
+        inst_id : int or None
+            Id of the instrument, or None if it's unknown.
+        """
+        inst_id = self._instrument_ids.get(name)
+        if inst_id is not None:
+            return inst_id
+        key = _alias_key(name)
+        inst_id = self._aliases.get(key)
+        if inst_id is None and key.endswith('s'):
+            inst_id = self._aliases.get(key[:-1])
+        return inst_id
+
+    def category_id(self, name):
+        """Return the id of a category, or None if it's unknown."""
+        return self._category_ids.get(name)
+
+    def normalize(self, name):
+        """Return the canonical name of an instrument, given any of its names.
+
+        Parameters
+        ----------
+        name : str
+            Instrument name or alias.
+
+        Returns
+        -------
+        instrument : str or None
+            Canonical name, or None if the instrument is unknown.
+        """
+        inst_id = self.instrument_id(name)
+        return None if inst_id is None else self._instruments[inst_id]
+
+    def categories(self, instrument):
+        """Return the categories of an instrument.
+
+        Parameters
+        ----------
+        instrument : str
+            Instrument name or alias.
+
+        Returns
+        -------
+        categories : tuple of str
+            Categories, in order; empty if the instrument is unknown.
+        """
+        inst_id = self.instrument_id(instrument)
+        return () if inst_id is None else self._instrument_categories[inst_id]
+
+    def instruments(self, category):
+        """Return the instruments in a category.
+
+        Parameters
+        ----------
+        category : str
+            Category name.
+
+        Returns
+        -------
+        instruments : tuple of str
+            Instruments, in order; empty if the category is unknown.
+        """
+        cat_id = self._category_ids.get(category)
+        return () if cat_id is None else self._category_instruments[cat_id]
+
+    def category_ids(self, inst_id):
+        """Return the category ids of the instrument with id `inst_id`."""
+        return self._by_instrument[inst_id]
+
+    def instrument_ids(self, cat_id):
+        """Return the instrument ids in the category with id `cat_id`."""
+        return self._by_category[cat_id]
@@ -1,14 +1,37 @@
 import hashlib
+import json
 import logging
 import mimetypes
+import re
 import six
+import struct
+import sys
+import tempfile
 import six.moves.urllib.error as urlerror
 import six.moves.urllib.parse as urlparse
 import six.moves.urllib.request as urlrequest
 from uuid import UUID
+import zlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 logger = logging.getLogger()
 
+# Bytes read at a time when streaming data
+CHUNK_SIZE = 2 ** 20
+
+# Tokens for `iter_json_items`
+_JSON_OPEN = re.compile(r'\s*\{\s*(?=\S)(\})?')
+_JSON_KEY = re.compile(r'\s*"([^"\\]*(?:\\.[^"\\]*)*)"\s*:\s*', re.DOTALL)
+_JSON_SEP = re.compile(r'\s*([,}])')
+# Tokens for `iter_json_array`
+_JSON_ARRAY_OPEN = re.compile(r'\s*\[\s*(?=\S)(\])?')
+_JSON_VALUE = re.compile(r'\s*(?=\S)')
+_JSON_ARRAY_SEP = re.compile(r'\s*([,\]])')
+
 
 def uuid(data):
     """Create a unique (deterministic) identifier.
@@ -28,8 +51,244 @@ def uuid(data):
     elif isinstance(data, six.string_types) and six.PY3:
         data = bytearray(data, 'utf-8')
 
-    hex_data = hashlib.md5(data).hexdigest()
-    return UUID(hex=hex_data, version=4)
+    return digest_uuid(hashlib.md5(data))
+
+
+def digest_uuid(md5):
+    """Create the identifier for data hashed incrementally with MD5.
+
+    Parameters
+    ----------
+    md5 : hashlib.md5
+        Hash object, updated with all of the data.
+
+    Returns
+    -------
+    uuid : uuid
+        Generated unique identifier; matches `uuid(data)`.
+    """
+    return UUID(hex=md5.hexdigest(), version=4)
+
+
+def spool(stream, chunk_size=CHUNK_SIZE, max_size=CHUNK_SIZE):
+    """Copy a stream to a temporary file, hashing it along the way.
+
+    Data is read in fixed-size chunks, and only kept in memory up to
+    `max_size` bytes before rolling over to disk, so memory use does not
+    depend on the size of the stream.
+
+    Parameters
+    ----------
+    stream : file-like
+        Binary stream to consume.
+
+    chunk_size : int, default=1MB
+        Number of bytes to read at a time.
+
+    max_size : int, default=1MB
+        Number of bytes to hold in memory before spooling to disk.
+
+    Returns
+    -------
+    fp : file-like
+        Temporary file holding the data, positioned at the start.
+
+    uuid : uuid
+        Identifier for the data; matches `uuid(data)`.
+
+    num_bytes : int
+        Length of the data.
+    """
+    fp = tempfile.SpooledTemporaryFile(max_size=max_size)
+    md5 = hashlib.md5()
+    num_bytes = 0
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        md5.update(chunk)
+        fp.write(chunk)
+        num_bytes += len(chunk)
+    fp.seek(0)
+    return fp, digest_uuid(md5), num_bytes
+
+
+def chunks(iterable, size):
+    """Split an iterable into lists of at most `size` items.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items to group.
+
+    size : int
+        Maximum number of items per chunk.
+
+    Yields
+    ------
+    chunk : list
+        Consecutive items from `iterable`.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_json_items(fp, chunk_size=2 ** 16):
+    """Incrementally parse a JSON object from a file.
+
+    Only a chunk of the file, plus the item currently being decoded, is held
+    in memory at any time.
+
+    Parameters
+    ----------
+    fp : file-like
+        Text stream containing a single top-level JSON object.
+
+    chunk_size : int, default=65536
+        Number of characters to read at a time.
+
+    Yields
+    ------
+    key, value : str, object
+        Key-value pairs of the object, in file order.
+    """
+    scan_once = json.JSONDecoder().scan_once
+    buf, pos, eof = '', 0, False
+    started = False
+    while True:
+        # Each pass attempts to parse one complete `"key": value,` item from
+        # `pos`; if the buffer runs out part way, read more and try again.
+        match = None
+        if not started:
+            match = _JSON_OPEN.match(buf, pos)
+            if match:
+                started, pos = True, match.end()
+                if match.group(1):
+                    return
+                continue
+        else:
+            match = _JSON_KEY.match(buf, pos)
+            try:
+                obj, end = scan_once(buf, match.end()) if match else (None, 0)
+            except (StopIteration, ValueError):
+                match = None
+            # The value is only known to be complete once followed by a
+            # delimiter, e.g. a number may be split across chunks.
+            sep = _JSON_SEP.match(buf, end) if match else None
+            if sep:
+                key = match.group(1)
+                if '\\' in key:
+                    key = json.loads('"{}"'.format(key))
+                yield key, obj
+                pos = sep.end()
+                if sep.group(1) == '}':
+                    return
+                continue
+
+        if eof:
+            raise ValueError("Malformed JSON object at '{}'"
+                             .format(buf[pos:pos + 20]))
+        chunk = fp.read(chunk_size)
+        buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+
+
+def iter_json_array(fp, chunk_size=2 ** 16):
+    """Incrementally parse a JSON array from a file.
+
+    Only a chunk of the file, plus the item currently being decoded, is held
+    in memory at any time.
+
+    Parameters
+    ----------
+    fp : file-like
+        Text stream containing a single top-level JSON array.
+
+    chunk_size : int, default=65536
+        Number of characters to read at a time.
+
+    Yields
+    ------
+    value : object
+        Items of the array, in file order.
+    """
+    scan_once = json.JSONDecoder().scan_once
+    buf, pos, eof = '', 0, False
+    started = False
+    while True:
+        # As in `iter_json_items`, each pass attempts to parse one complete
+        # `value,` item from `pos`, reading more on running out.
+        if not started:
+            match = _JSON_ARRAY_OPEN.match(buf, pos)
+            if match:
+                started, pos = True, match.end()
+                if match.group(1):
+                    return
+                continue
+        else:
+            match = _JSON_VALUE.match(buf, pos)
+            try:
+                obj, end = scan_once(buf, match.end()) if match else (None, 0)
+            except (StopIteration, ValueError):
+                match = None
+            sep = _JSON_ARRAY_SEP.match(buf, end) if match else None
+            if sep:
+                yield obj
+                pos = sep.end()
+                if sep.group(1) == ']':
+                    return
+                continue
+
+        if eof:
+            raise ValueError("Malformed JSON array at '{}'"
+                             .format(buf[pos:pos + 20]))
+        chunk = fp.read(chunk_size)
+        buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+
+
+def _png_chunk(tag, data):
+    crc = zlib.crc32(tag + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+
+def encode_png(image):
+    """Encode a greyscale image as PNG data.
+
+    Parameters
+    ----------
+    image : np.ndarray, shape=(height, width), dtype=uint8
+        Pixel intensities, from the top row down.
+
+    Returns
+    -------
+    data : bytes
+        Losslessly compressed PNG file data.
+    """
+    height, width = image.shape
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    # Each scanline is prefixed by its filter type, here none.
+    rows = b''.join(b'\x00' + row.tobytes() for row in image)
+    return b''.join([b'\x89PNG\r\n\x1a\n',
+                     _png_chunk(b'IHDR', header),
+                     _png_chunk(b'IDAT', zlib.compress(rows)),
+                     _png_chunk(b'IEND', b'')])
+
+
+def max_rss():
+    """Return the peak resident set size of this process, in bytes.
+
+    Returns
+    -------
+    rss : int or None
+        Peak memory usage, or None where the platform can't report it.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere.
+    return rss if sys.platform == 'darwin' else rss * 1024
 
 
 def check_connection(default='http://google.com', timeout=1):
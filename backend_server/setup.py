@@ -29,7 +29,6 @@ setup(
     keywords='audio music sound',
     license='MIT',
     install_requires=[
-        'audioread >= 2.0.0',
         'Flask >= 0.11.1',
         'Flask-OAuthlib >= 0.9',
         'requests',
@@ -37,7 +36,12 @@ setup(
         'PyYAML',
         'google-cloud >= 0.22.0'
     ],
+    # numpy is a compiled extension, and so is provided by the runtime on
+    # App Engine (see `app.yaml`) rather than installed with the app. Ingest
+    # needs `ndarray.tobytes`, added in numpy 1.9.
     extras_require={
-        'tests': ['pytest', 'pytest-cov']
+        'numpy': ['numpy >= 1.6.1'],
+        'ingest': ['audioread >= 2.0.0', 'numpy >= 1.9'],
+        'tests': ['pytest', 'pytest-cov', 'audioread >= 2.0.0', 'numpy >= 1.9']
     }
 )
@@ -1,6 +1,9 @@
 import pytest
 
+import io
+import numpy as np
 import os
+import wave
 import yaml
 
 
@@ -13,7 +16,8 @@ def sample_app():
     with open(cfg_file) as fp:
         cfg = yaml.load(fp)
 
-    main.app.config.update(cloud=cfg['cloud'], oauth=cfg['oauth'], noauth=True)
+    main.configure(cfg)
+    main.app.config.update(noauth=True)
     main.app.testing = True
     with main.app.test_client() as client:
         # This forces the app to pass authentication; however, it doesn't (yet)
@@ -21,3 +25,21 @@ def sample_app():
         with client.session_transaction() as sess:
             sess['access_token'] = ('fluflu', None)
         return client
+
+
+@pytest.fixture()
+def sine_wav():
+    """Two seconds of a stereo 440Hz sine at half scale, as WAV bytes."""
+    sample_rate = 8000
+    t = np.arange(2 * sample_rate) / float(sample_rate)
+    y = 0.5 * np.sin(2 * np.pi * 440 * t)
+    frames = (np.stack([y, y], axis=1) * 32767).astype('<i2')
+
+    buf = io.BytesIO()
+    fp = wave.open(buf, 'wb')
+    fp.setnchannels(2)
+    fp.setsampwidth(2)
+    fp.setframerate(sample_rate)
+    fp.writeframes(frames.tobytes())
+    fp.close()
+    return buf.getvalue()
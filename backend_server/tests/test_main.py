@@ -2,22 +2,160 @@ import pytest
 
 from io import BytesIO
 import json
+import os
+import requests
 import requests.status_codes
+import uuid
+import yaml
 
+import main
+import pybackend.bloom
+import pybackend.ingest
+import pybackend.models
+import pybackend.suggest
 import pybackend.urilib as urilib
 import pybackend.utils as utils
 
 
+def post_audio(client, content, filename):
+    """Upload audio, and wait for it to be ingested."""
+    data = dict(audio=(BytesIO(content), filename))
+    r = client.post('/api/v0.1/audio', data=data)
+    # The local database persists across tests, so the audio may be known.
+    assert r.status_code in (requests.status_codes.codes.OK,
+                             requests.status_codes.codes.ACCEPTED)
+    assert main.CLIENTS.ingest.drain(timeout=10)
+    return json.loads(r.data.decode('utf-8'))['uri']
+
+
 def test_audio_upload(sample_app):
-    data = dict(audio=(BytesIO(b'my file contents'), 'blah.wav'))
+    content = 'my file contents {}'.format(uuid.uuid4()).encode('utf-8')
+    data = dict(audio=(BytesIO(content), 'blah.wav'))
     r = sample_app.post('/api/v0.1/audio', data=data)
-    assert r.status_code == requests.status_codes.codes.OK
+    assert r.status_code == requests.status_codes.codes.ACCEPTED
     data = json.loads(r.data.decode('utf-8'))
     assert data['uri']
     kind, gid = urilib.split(data['uri'])
     assert kind == 'audio'
 
 
+def test_audio_upload_existing(sample_app):
+    content = 'my file contents {}'.format(uuid.uuid4()).encode('utf-8')
+    data = dict(audio=(BytesIO(content), 'blah.wav'))
+    r = sample_app.post('/api/v0.1/audio', data=data)
+    assert r.status_code == requests.status_codes.codes.ACCEPTED
+    uri = json.loads(r.data.decode('utf-8'))['uri']
+    created = main.CLIENTS.database.get(uri)['created']
+
+    data = dict(audio=(BytesIO(content), 'again.wav'))
+    r = sample_app.post('/api/v0.1/audio', data=data)
+    assert r.status_code == requests.status_codes.codes.OK
+    assert json.loads(r.data.decode('utf-8'))['uri'] == uri
+    assert main.CLIENTS.database.get(uri)['created'] == created
+
+    # Stored data that has gone missing is uploaded again, keeping the record.
+    assert main.CLIENTS.ingest.drain(timeout=10)
+    record = main.CLIENTS.database.get(uri)
+    os.remove(main.CLIENTS.storage.bucket.blob(urilib.split(uri)[1]).path)
+    data = dict(audio=(BytesIO(content), 'again.wav'))
+    r = sample_app.post('/api/v0.1/audio', data=data)
+    assert r.status_code == requests.status_codes.codes.OK
+    assert main.CLIENTS.storage.exists(urilib.split(uri)[1])
+    assert main.CLIENTS.database.get(uri) == record
+
+
+def test_audio_upload_indexed_elsewhere(sample_app, monkeypatch):
+    content = 'my file contents {}'.format(uuid.uuid4()).encode('utf-8')
+    uri = post_audio(sample_app, content, 'blah.wav')
+    record = main.CLIENTS.database.get(uri)
+    record['num_annotations'] = 3
+    main.CLIENTS.database.put(uri, record)
+
+    # Another process indexed the audio, so this one's index misses it.
+    monkeypatch.setattr(main.CLIENTS, '_known_audio',
+                        pybackend.bloom.BloomFilter())
+    data = dict(audio=(BytesIO(content), 'again.wav'))
+    r = sample_app.post('/api/v0.1/audio', data=data)
+    assert r.status_code == requests.status_codes.codes.OK
+    assert main.CLIENTS.database.get(uri) == record
+    assert uri in main.CLIENTS.known_audio
+
+
+def test_audio_upload_without_workers(tmpdir, sine_wav):
+    cfg_file = os.path.join(os.path.dirname(__file__), os.pardir,
+                            'configs', 'local.DEFAULT.yaml')
+    with open(cfg_file) as fp:
+        cfg = yaml.load(fp)
+    cfg['cloud']['storage']['local_dir'] = str(tmpdir)
+    cfg['cloud']['database']['filepath'] = str(tmpdir.join('db.json'))
+    for section in ['ingest', 'hierarchy', 'suggest', 'taxonomy']:
+        del cfg[section]
+
+    main.configure(cfg)
+    assert main.CLIENTS.ingest is None
+    assert main.HIERARCHY is None and main.SUGGEST is None
+    assert 'guitar' in main.TAXONOMY.instruments
+    main.app.config.update(noauth=True)
+    main.app.testing = True
+    with main.app.test_client() as client:
+        data = dict(audio=(BytesIO(sine_wav), 'sine.wav'))
+        r = client.post('/api/v0.1/audio', data=data)
+        assert r.status_code == requests.status_codes.codes.OK
+        uri = json.loads(r.data.decode('utf-8'))['uri']
+        entity = main.CLIENTS.database.get(uri)
+        assert entity['status'] == 'ready' and entity['peaks']
+
+        r = client.get('/api/v0.1/task')
+        task = json.loads(r.data.decode('utf-8'))['task']
+        assert task['proximityTag'] == []
+
+
+def test_audio_upload_status(sample_app, sine_wav):
+    uri = post_audio(sample_app, sine_wav, 'sine.wav')
+    entity = main.CLIENTS.database.get(uri)
+    assert entity['status'] == 'ready'
+    assert entity['peaks'] and entity['spectrogram'] and entity['preview']
+
+
+def test_audio_exists(sample_app):
+    content = 'my file contents {}'.format(uuid.uuid4()).encode('utf-8')
+    gid = str(utils.uuid(content))
+    missing = str(utils.uuid(b'definitely not uploaded'))
+    url = '/api/v0.1/audio/exists'
+
+    r = sample_app.post(url, data=json.dumps(dict(gids=[gid])),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.OK
+    assert json.loads(r.data.decode('utf-8')) == dict(exists={gid: False})
+
+    post_audio(sample_app, content, 'blah.wav')
+    r = sample_app.post(url, data=json.dumps(dict(gids=[gid, missing])),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.OK
+    exists = json.loads(r.data.decode('utf-8'))['exists']
+    assert exists == {gid: True, missing: False}
+
+
+def test_audio_exists_many_batched(sample_app, monkeypatch):
+    content = 'my file contents {}'.format(uuid.uuid4()).encode('utf-8')
+    uri = post_audio(sample_app, content, 'blah.wav')
+
+    def exists(gid):
+        raise AssertionError("Checked storage for {}".format(gid))
+
+    monkeypatch.setattr(main.CLIENTS.storage, 'exists', exists)
+    assert main.audio_exists_many([uri, 'audio:nope']) == [True, False]
+
+
+@pytest.mark.parametrize('body', [[], dict(), dict(gids='abc'),
+                                  dict(gids=['a:b']),
+                                  dict(gids=['x'] * 1001)])
+def test_audio_exists_bad_request(sample_app, body):
+    r = sample_app.post('/api/v0.1/audio/exists', data=json.dumps(body),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.BAD_REQUEST
+
+
 def test_audio_upload_method_not_allowed(sample_app):
     r = sample_app.get('/api/v0.1/audio')
     assert r.status_code == requests.status_codes.codes.METHOD_NOT_ALLOWED
@@ -32,10 +170,7 @@ def test_audio_upload_bad_filetype(sample_app):
 def test_audio_get(sample_app):
     # First we'll generate data...
     content = b'my new file contents'
-    data = dict(audio=(BytesIO(content), 'blah.wav'))
-    r = sample_app.post('/api/v0.1/audio', data=data)
-    assert r.status_code == requests.status_codes.codes.OK
-    uri = json.loads(r.data.decode('utf-8'))['uri']
+    uri = post_audio(sample_app, content, 'blah.wav')
     kind, gid = urilib.split(uri)
     # Now let's go looking for it
     r = sample_app.get('/api/v0.1/audio/{}'.format(gid))
@@ -43,6 +178,88 @@ def test_audio_get(sample_app):
     assert r.data == content
 
 
+def test_audio_get_preview(sample_app, sine_wav):
+    kind, gid = urilib.split(post_audio(sample_app, sine_wav, 'sine.wav'))
+    url = '/api/v0.1/audio/{}'.format(gid)
+
+    r = sample_app.get(url)
+    assert r.status_code == requests.status_codes.codes.OK
+    assert r.data.startswith(b'RIFF')
+    assert len(r.data) < len(sine_wav)
+
+    r = sample_app.get(url, headers={'Range': 'bytes=0-3'})
+    assert r.status_code == requests.status_codes.codes.PARTIAL_CONTENT
+    assert r.data == b'RIFF'
+
+    r = sample_app.get(url, query_string=dict(rendition='original'))
+    assert r.status_code == requests.status_codes.codes.OK
+    assert r.data == sine_wav
+
+
+def test_audio_get_range(sample_app):
+    content = b'0123456789 ranged file contents'
+    data = dict(audio=(BytesIO(content), 'blah.wav'))
+    r = sample_app.post('/api/v0.1/audio', data=data)
+    kind, gid = urilib.split(json.loads(r.data.decode('utf-8'))['uri'])
+    url = '/api/v0.1/audio/{}'.format(gid)
+
+    r = sample_app.get(url, headers={'Range': 'bytes=2-5'})
+    assert r.status_code == requests.status_codes.codes.PARTIAL_CONTENT
+    assert r.data == content[2:6]
+    assert r.headers['Content-Range'] == 'bytes 2-5/{}'.format(len(content))
+    assert r.headers['Accept-Ranges'] == 'bytes'
+
+    r = sample_app.get(url, headers={'Range': 'bytes=-4'})
+    assert r.status_code == requests.status_codes.codes.PARTIAL_CONTENT
+    assert r.data == content[-4:]
+
+    r = sample_app.get(url, headers={'Range': 'bytes=1000-'})
+    assert r.status_code == \
+        requests.status_codes.codes.REQUESTED_RANGE_NOT_SATISFIABLE
+
+
+def test_audio_peaks(sample_app, sine_wav):
+    kind, gid = urilib.split(post_audio(sample_app, sine_wav, 'sine.wav'))
+
+    r = sample_app.get('/api/v0.1/audio/{}/peaks'.format(gid))
+    assert r.status_code == requests.status_codes.codes.OK
+    assert 'immutable' in r.headers['Cache-Control']
+    peaks = json.loads(r.data.decode('utf-8'))
+    assert peaks['length'] == 16000
+
+
+def test_audio_spectrogram(sample_app, sine_wav):
+    kind, gid = urilib.split(post_audio(sample_app, sine_wav, 'sine.wav'))
+    url = '/api/v0.1/audio/{}/spectrogram'.format(gid)
+
+    r = sample_app.get(url)
+    assert r.status_code == requests.status_codes.codes.OK
+    info = json.loads(r.data.decode('utf-8'))
+    level = info['levels'][0]
+
+    r = sample_app.get('{}/{}/0'.format(url, level['hop_length']))
+    assert r.status_code == requests.status_codes.codes.OK
+    assert r.headers['Content-Type'] == 'image/png'
+    assert 'immutable' in r.headers['Cache-Control']
+
+    r = sample_app.get('{}/{}/{}'.format(url, level['hop_length'],
+                                         level['num_tiles']))
+    assert r.status_code == requests.status_codes.codes.NOT_FOUND
+    r = sample_app.get('{}/3/0'.format(url))
+    assert r.status_code == requests.status_codes.codes.NOT_FOUND
+
+
+def test_audio_peaks_no_resource(sample_app):
+    data = dict(audio=(BytesIO(b'undecodable contents'), 'blah.wav'))
+    r = sample_app.post('/api/v0.1/audio', data=data)
+    kind, gid = urilib.split(json.loads(r.data.decode('utf-8'))['uri'])
+
+    r = sample_app.get('/api/v0.1/audio/{}/peaks'.format(gid))
+    assert r.status_code == requests.status_codes.codes.NOT_FOUND
+    r = sample_app.get('/api/v0.1/audio/{}/spectrogram'.format(gid))
+    assert r.status_code == requests.status_codes.codes.NOT_FOUND
+
+
 def test_audio_get_no_resource(sample_app):
     r = sample_app.get('/api/v0.1/audio/{}'.format("definitelydoesntexist"))
     assert r.status_code == requests.status_codes.codes.NOT_FOUND
@@ -61,12 +278,286 @@ def test_annotation_submit(sample_app):
     assert r.status_code == requests.status_codes.codes.OK
 
 
-@pytest.mark.skipif(not utils.check_connection(), reason='No internet')
+@pytest.mark.parametrize('response', [
+    [dict(recordingIndex='audio:abc')],
+    dict(recordingIndex=5),
+    dict(recordingIndex='annotation:abc'),
+    dict(annotations='guitar'),
+    dict(annotations=[dict(start=0, end=1, annotation='kazoo-ish')])])
+def test_annotation_submit_invalid(sample_app, response):
+    r = sample_app.post('/api/v0.1/annotation/submit',
+                        data=json.dumps(response),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.BAD_REQUEST
+    assert json.loads(r.data.decode('utf-8'))['message']
+
+
+def test_annotation_submit_counts(sample_app, monkeypatch):
+    import main
+    data = dict(audio=(BytesIO(b'counted file contents'), 'blah.wav'))
+    r = sample_app.post('/api/v0.1/audio', data=data)
+    uri = json.loads(r.data.decode('utf-8'))['uri']
+    main.AUDIO_COUNTS.flush()
+    count = main.CLIENTS.database.get(uri).get('num_annotations', 0)
+
+    # Counting doesn't wait on the database.
+    def unavailable(uris, func):
+        raise IOError("Backend unavailable")
+
+    monkeypatch.setattr(main.CLIENTS.database, 'update_many', unavailable)
+    r = sample_app.post('/api/v0.1/annotation/submit',
+                        data=json.dumps(dict(recordingIndex=uri)),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.OK
+    monkeypatch.undo()
+
+    main.AUDIO_COUNTS.flush()
+    assert main.CLIENTS.database.get(uri)['num_annotations'] == count + 1
+
+
+def test_annotation_submit_tags(sample_app):
+    content = 'tagged file contents {}'.format(uuid.uuid4()).encode('utf-8')
+    uri = post_audio(sample_app, content, 'blah.wav')
+    annotations = [dict(start=0, end=1, annotation='guitar'),
+                   dict(start=1, end=2, annotation='vocals')]
+    r = sample_app.post('/api/v0.1/annotation/submit',
+                        data=json.dumps(dict(recordingIndex=uri,
+                                             annotations=annotations)),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.OK
+    main.AUDIO_COUNTS.flush()
+    assert main.CLIENTS.database.get(uri)['tags'] == ['guitar', 'vocals']
+    suggestions = main.SUGGEST.suggest(['guitar', 'vocals'])
+    assert suggestions and not set(suggestions) & set(['guitar', 'vocals'])
+
+
+def test_annotation_submit_suggestions(sample_app):
+    guitar = main.SUGGEST.tag_id('guitar')
+    vocals = main.SUGGEST.tag_id('vocals')
+    stored = main.SUGGEST.from_record(
+        main.CLIENTS.database.get(main.SUGGEST_URI))
+    assert (stored == main.SUGGEST.counts).all()
+
+    # Counts stored by other instances are picked up on the next merge.
+    other = main.SUGGEST.to_record(stored + 1)
+    main.CLIENTS.database.put(main.SUGGEST_URI, other)
+    annotations = [dict(start=0, end=1, annotation='guitar'),
+                   dict(start=1, end=2, annotation='vocals')]
+    r = sample_app.post('/api/v0.1/annotation/submit',
+                        data=json.dumps(dict(annotations=annotations)),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.OK
+
+    # Counts are merged in the background, not in the request.
+    assert main.CLIENTS.database.get(main.SUGGEST_URI) == other
+    assert len(main.SUGGEST_COUNTS) == 1
+    main.SUGGEST_COUNTS.flush()
+    counts = main.SUGGEST.from_record(
+        main.CLIENTS.database.get(main.SUGGEST_URI))
+    assert counts[guitar, vocals] == stored[guitar, vocals] + 2
+    assert counts[guitar, guitar] == stored[guitar, guitar] + 2
+    assert counts.sum() == stored.sum() + stored.size + 4
+    assert (main.SUGGEST.counts == counts).all()
+
+
+def test_configure_loads_suggestions(sample_app):
+    record = main.CLIENTS.database.get(main.SUGGEST_URI)
+    counts = main.SUGGEST.from_record(record)
+    counts[:] = 0
+    counts[0, 0] = 7
+    main.CLIENTS.database.put(main.SUGGEST_URI,
+                              main.SUGGEST.to_record(counts))
+    try:
+        with open(main.CONFIG) as fp:
+            main.configure(yaml.load(fp))
+        assert main.SUGGEST.counts.sum() == 7
+        assert main.SUGGEST.suggest(num=1) == [main.SUGGEST.tags[0]]
+    finally:
+        main.CLIENTS.database.put(main.SUGGEST_URI, record)
+
+
+def test_rebuild_suggestions(sample_app):
+    tracks = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                          'data', 'jamendo',
+                          'jamendo-instruments-per-track.json')
+    count = main.rebuild_suggestions(tracks)
+    assert count == sum(
+        any(main.SUGGEST.tag_id(tag) is not None
+            for tag in pybackend.suggest.annotation_tags(
+                pybackend.models.AnnotationResponse.from_flat(
+                    **record).get('response')))
+        for record in main.CLIENTS.database.get_many(
+            main.CLIENTS.database.uris(kind='annotation')) if record)
+    stored = main.CLIENTS.database.get(main.SUGGEST_URI)
+    assert (main.SUGGEST.from_record(stored) == main.SUGGEST.counts).all()
+
+
+def test_annotation_submit_bulk(sample_app):
+    content = 'bulk file contents {}'.format(uuid.uuid4()).encode('utf-8')
+    uri = post_audio(sample_app, content, 'blah.wav')
+    tag = dict(start=0, end=1, annotation='guitar')
+    responses = [dict(recordingIndex=uri, annotations=[tag], n=n)
+                 for n in range(3)]
+    responses += [dict(recordingIndex='annotation:abc'), 'nope',
+                  dict(annotations='guitar'),
+                  dict(annotations=[dict(annotation='Electric Guitars')]),
+                  dict(annotations=[dict(annotation='kazooka')])]
+
+    r = sample_app.post('/api/v0.1/annotation/submit/bulk',
+                        data=json.dumps(responses),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.OK
+    data = json.loads(r.data.decode('utf-8'))
+    assert (data['num_stored'], data['num_failed']) == (4, 4)
+    results = data['results']
+    assert [('uri' in res) for res in results] == \
+        [True] * 3 + [False] * 3 + [True, False]
+    assert 'kazooka' in results[-1]['error']
+    record = main.CLIENTS.database.get(results[0]['uri'])
+    assert 'guitar' in record['response']
+    main.AUDIO_COUNTS.flush()
+    audio = main.CLIENTS.database.get(uri)
+    assert audio['num_annotations'] == 3
+    assert audio['tags'] == ['guitar']
+
+
+def test_annotation_submit_bulk_ndjson(sample_app):
+    lines = [json.dumps(dict(n=n, uid=str(uuid.uuid4()))) for n in range(5)]
+    lines.insert(2, '{"truncated": ')
+    r = sample_app.post('/api/v0.1/annotation/submit/bulk',
+                        data='\n'.join(lines) + '\n',
+                        content_type='application/x-ndjson')
+    assert r.status_code == requests.status_codes.codes.OK
+    results = json.loads(r.data.decode('utf-8'))['results']
+    assert len(results) == 6
+    assert 'error' in results[2]
+    uris = [res['uri'] for res in results if 'uri' in res]
+    assert all(main.CLIENTS.database.get_many(uris))
+
+
+def test_annotation_submit_bulk_duplicates(sample_app, monkeypatch):
+    put_many = main.CLIENTS.annotations.put_many
+    batches = []
+
+    def recording_put_many(records):
+        if isinstance(records, dict):
+            records = records.items()
+        batches.append([uri for uri, _ in records])
+        put_many(list(records))
+
+    monkeypatch.setattr(main.CLIENTS.annotations, 'put_many',
+                        recording_put_many)
+    response = dict(uid=str(uuid.uuid4()))
+    r = sample_app.post('/api/v0.1/annotation/submit/bulk',
+                        data=json.dumps([response, dict(n=1), response]),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.OK
+    results = json.loads(r.data.decode('utf-8'))['results']
+    assert results[0] == results[2]
+    # Datastore rejects a batch writing the same key twice.
+    assert len(batches) == 1
+    assert sorted(batches[0]) == sorted(set(res['uri'] for res in results))
+
+
+def test_annotation_submit_bulk_malformed(sample_app):
+    r = sample_app.post('/api/v0.1/annotation/submit/bulk',
+                        data='[{"uid": "%s"}, {"bad"' % uuid.uuid4(),
+                        content_type='application/json')
+    assert r.status_code == requests.status_codes.codes.BAD_REQUEST
+    results = json.loads(r.data.decode('utf-8'))['results']
+    assert len(results) == 1
+    assert main.CLIENTS.database.get(results[0]['uri'])
+
+    r = sample_app.post('/api/v0.1/annotation/submit/bulk',
+                        data='[]', content_type='text/plain')
+    assert r.status_code == requests.status_codes.codes.BAD_REQUEST
+
+
+def test_annotation_submit_bulk_limit(sample_app, monkeypatch):
+    monkeypatch.setattr(main, 'MAX_ANNOTATION_BATCH', 3)
+    monkeypatch.setattr(main, 'ANNOTATION_PUT_BATCH', 2)
+    responses = [dict(uid=str(uuid.uuid4())) for n in range(5)]
+    r = sample_app.post('/api/v0.1/annotation/submit/bulk',
+                        data=json.dumps(responses),
+                        content_type='application/json')
+    codes = requests.status_codes.codes
+    assert r.status_code == codes.REQUEST_ENTITY_TOO_LARGE
+    data = json.loads(r.data.decode('utf-8'))
+    assert data['num_stored'] == 3
+
+
+def test_metrics(sample_app):
+    r = sample_app.get('/api/v0.1/metrics')
+    assert r.status_code == requests.status_codes.codes.OK
+    data = json.loads(r.data.decode('utf-8'))
+    assert data['ingest']['depth'] >= 0
+    assert data['counts']['depth'] >= 0
+    assert data['write_behind'] is None
+
+
+@pytest.mark.parametrize('filepath', [None, '/tmp/annotation-journal.db'])
+def test_configure_write_behind_temporary(sample_app, filepath):
+    with open(main.CONFIG) as fp:
+        cfg = yaml.load(fp)
+    cfg['write_behind'] = dict(filepath=filepath)
+    clients = main.CLIENTS
+    with pytest.raises(ValueError):
+        main.configure(cfg)
+    assert main.CLIENTS is clients
+
+
+def test_configure_bundled_taxonomy(sample_app, monkeypatch):
+    with open(main.CONFIG) as fp:
+        cfg = yaml.load(fp)
+    del cfg['taxonomy']
+
+    def offline(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("Offline")
+
+    monkeypatch.setattr(requests, 'get', offline)
+    try:
+        main.configure(cfg)
+        assert 'guitar' in main.TAXONOMY.instruments
+    finally:
+        with open(main.CONFIG) as fp:
+            main.configure(yaml.load(fp))
+
+
+def test_is_temporary(tmpdir):
+    assert main.is_temporary(str(tmpdir.join('journal.db')))
+    assert not main.is_temporary(os.path.join(os.path.dirname(__file__),
+                                              'journal.db'))
+
+
 def test_annotation_taxonomy(sample_app):
     r = sample_app.get('/api/v0.1/annotation/taxonomy')
     assert r.status_code == requests.status_codes.codes.OK
+    instruments = json.loads(r.data.decode('utf-8'))
+    assert 'guitar' in instruments
 
 
 def test_task_get(sample_app):
     r = sample_app.get('/api/v0.1/task')
     assert r.status_code == requests.status_codes.codes.OK
+    task = json.loads(r.data.decode('utf-8'))['task']
+    assert task['proximityTag']
+    assert set(task['proximityTag']) <= set(task['annotationTag'])
+
+
+def test_ingest_backlog(sample_app, monkeypatch):
+    gids = [str(uuid.uuid4()) for _ in range(3)]
+    for gid in gids:
+        main.CLIENTS.database.put(urilib.join('audio', gid),
+                                  dict(file_ext='wav', num_annotations=2))
+    results = [(gids[0], dict(peaks=[0.5])), (gids[1], None), (gids[2], {})]
+    monkeypatch.setattr(pybackend.ingest, 'run_many',
+                        lambda jobs, kwargs, processes=None: iter(results))
+
+    assert main.ingest_backlog() == 1
+    records = main.CLIENTS.database.get_many(
+        [urilib.join('audio', gid) for gid in gids])
+    assert records[0] == dict(file_ext='wav', num_annotations=2,
+                              peaks=[0.5], status=pybackend.ingest.READY)
+    assert records[1] == dict(file_ext='wav', num_annotations=2,
+                              status=pybackend.ingest.FAILED)
+    assert records[2] == dict(file_ext='wav', num_annotations=2)
@@ -0,0 +1,160 @@
+import pytest
+
+import numpy as np
+import wave
+
+import pybackend.audio as A
+
+
+def test_AudioStream(tmpdir, sine_wav):
+    path = str(tmpdir.join('sine.wav'))
+    with open(path, 'wb') as fp:
+        fp.write(sine_wav)
+
+    with A.AudioStream(path) as stream:
+        assert stream.sample_rate == 8000
+        assert stream.channels == 2
+        y = np.concatenate(list(stream))
+
+    assert len(y) == 16000
+    assert np.abs(y).max() == pytest.approx(0.5, abs=1e-3)
+
+
+def test_AudioStream_bad_data(tmpdir):
+    path = str(tmpdir.join('bad.wav'))
+    with open(path, 'wb') as fp:
+        fp.write(b'my file contents')
+
+    with pytest.raises(A.DecodeError):
+        with A.AudioStream(path):
+            pass
+
+
+def test_AudioStream_unavailable(sine_wav, tmpdir, monkeypatch):
+    path = str(tmpdir.join('sine.wav'))
+    with open(path, 'wb') as fp:
+        fp.write(sine_wav)
+
+    monkeypatch.setattr(A, 'audioread', None)
+    with pytest.raises(A.DecodeError):
+        with A.AudioStream(path):
+            pass
+
+
+@pytest.mark.parametrize('block_size', [1, 100, 256, 4096, 5000])
+def test_Peaks(block_size):
+    y = np.linspace(-1, 1, 5000).astype(np.float32)
+    peaks = A.Peaks(8000, levels=[1024, 256])
+    for idx in range(0, len(y), block_size):
+        peaks.update(y[idx:idx + block_size])
+    result = peaks.finalize()
+
+    assert result['sample_rate'] == 8000
+    assert result['length'] == 5000
+    levels = [lvl['samples_per_pixel'] for lvl in result['levels']]
+    assert levels == [256, 1024]
+    for level in result['levels']:
+        spp = level['samples_per_pixel']
+        data = np.asarray(level['data'])
+        # Interleaved min / max, including a ragged final frame.
+        assert len(data) == 2 * int(np.ceil(5000. / spp))
+        assert data[0] == -128 and data[-1] == 127
+        assert np.all(data[0::2] <= data[1::2])
+        assert np.all(np.diff(data[0::2]) > 0)
+
+    fine, coarse = result['levels']
+    assert coarse['data'][:2] == [fine['data'][0], fine['data'][7]]
+
+
+def test_Peaks_empty():
+    result = A.Peaks(8000).finalize()
+    assert result['length'] == 0
+    assert all(not lvl['data'] for lvl in result['levels'])
+
+
+def test_Peaks_bad_levels():
+    with pytest.raises(ValueError):
+        A.Peaks(8000, levels=[256, 1000])
+
+
+@pytest.mark.parametrize('block_size', [100, 4096, 40000])
+def test_Spectrogram(block_size):
+    sample_rate = 8000
+    t = np.arange(5 * sample_rate) / float(sample_rate)
+    y = (0.5 * np.sin(2 * np.pi * 1000 * t)).astype(np.float32)
+    spec = A.Spectrogram(sample_rate, n_fft=512, levels=[1024, 256],
+                         tile_width=16)
+    tiles = []
+    for idx in range(0, len(y), block_size):
+        tiles += spec.update(y[idx:idx + block_size])
+    tiles += spec.finalize()
+
+    info = spec.describe()
+    assert info['num_bins'] == 257
+    for level in info['levels']:
+        level_tiles = sorted((index, image) for hop, index, image in tiles
+                             if hop == level['hop_length'])
+        assert [index for index, _ in level_tiles] == \
+            list(range(level['num_tiles']))
+        widths = [image.shape[1] for _, image in level_tiles]
+        assert sum(widths) == level['num_frames']
+        assert all(width == 16 for width in widths[:-1])
+
+    fine = [image for hop, _, image in tiles if hop == 256]
+    assert fine[0].shape == (257, 16)
+    assert fine[0].dtype == np.uint8
+    # 1kHz is bin 64, counting down from the top; -6dB of 80dB range.
+    assert np.all(fine[0].argmax(axis=0) == 256 - 64)
+    assert fine[0].max() == 236
+
+
+def test_Spectrogram_short():
+    spec = A.Spectrogram(8000)
+    assert spec.update(np.zeros(10, dtype=np.float32)) == []
+    tiles = spec.finalize()
+    assert [image.shape for _, _, image in tiles] == [(257, 1)] * 3
+
+
+def test_Spectrogram_bad_levels():
+    with pytest.raises(ValueError):
+        A.Spectrogram(8000, levels=[256, 1000])
+
+
+@pytest.mark.parametrize('block_size', [1000, 65536, 88200])
+def test_Preview(block_size):
+    sample_rate = 44100
+    t = np.arange(2 * sample_rate) / float(sample_rate)
+    y = 0.5 * np.sin(2 * np.pi * 440 * t) + 0.3 * np.sin(2 * np.pi * 12000 * t)
+    preview = A.Preview(sample_rate, target_rate=16000)
+    for idx in range(0, len(y), block_size):
+        preview.update(y[idx:idx + block_size].astype(np.float32))
+    fp, num_bytes = preview.finalize()
+
+    with fp:
+        assert len(fp.read()) == num_bytes
+        fp.seek(0)
+        wav = wave.open(fp, 'rb')
+        assert wav.getframerate() == 16000
+        assert wav.getnchannels() == 1
+        assert wav.getsampwidth() == 2
+        assert wav.getnframes() == 32000
+        z = np.frombuffer(wav.readframes(32000), dtype='<i2')
+
+    z = z / 32767.
+    spec = np.abs(np.fft.rfft(z[1000:17000]))
+    freqs = np.fft.rfftfreq(16000, 1. / 16000)
+    assert freqs[spec.argmax()] == 440
+    # 12kHz would alias to 4kHz, were it not filtered out.
+    assert spec[(freqs > 3000) & (freqs < 5000)].max() < 1e-2 * spec.max()
+
+
+def test_Preview_low_rate():
+    preview = A.Preview(8000, target_rate=16000)
+    assert preview.target_rate == 8000
+    preview.update(np.linspace(-1, 1, 1000).astype(np.float32))
+    fp, num_bytes = preview.finalize()
+    with fp:
+        wav = wave.open(fp, 'rb')
+        z = np.frombuffer(wav.readframes(1000), dtype='<i2')
+    assert z[0] == -32767 and z[-1] == 32767
+    assert np.all(np.diff(z.astype(int)) >= 0)
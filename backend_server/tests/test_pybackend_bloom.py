@@ -0,0 +1,26 @@
+import pytest
+
+import pybackend.bloom as B
+
+
+def test_BloomFilter():
+    known = B.BloomFilter(capacity=100, error_rate=0.01)
+    assert 'audio:abc' not in known
+    known.add('audio:abc')
+    known.add(b'audio:xyz')
+    assert 'audio:abc' in known
+    assert 'audio:xyz' in known
+    assert len(known) == 2
+
+
+@pytest.mark.parametrize('error_rate', [0.1, 0.01])
+def test_BloomFilter_error_rate(error_rate):
+    capacity = 2000
+    known = B.BloomFilter(capacity=capacity, error_rate=error_rate)
+    for idx in range(capacity):
+        known.add('audio:{}'.format(idx))
+    assert all('audio:{}'.format(idx) in known for idx in range(capacity))
+
+    num_false = sum('other:{}'.format(idx) in known
+                    for idx in range(10 * capacity))
+    assert num_false / (10. * capacity) < 2 * error_rate
@@ -2,6 +2,7 @@ import flask
 import pytest
 import json
 import os
+import time
 
 import pybackend.database as D
 
@@ -96,6 +97,63 @@ def test_LocalClient_delete(json_file):
     assert db.get(uri) is None
 
 
+def test_LocalClient_journal(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE)
+    db.put('a:1', dict(x=1))
+    db.put('a:2', dict(x=2))
+    db.delete('a:1')
+
+    # Writes land in the journal, not the snapshot.
+    with open(json_file) as fp:
+        assert json.load(fp) == {}
+    with open(db._journal_path) as fp:
+        assert len(fp.readlines()) == 3
+
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert db.get('a:1') is None
+    assert db.get('a:2') == dict(x=2)
+
+
+def test_LocalClient_journal_torn_write(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE)
+    db.put('a:1', dict(x=1))
+    db.close()
+    with open(db._journal_path, 'a') as fp:
+        fp.write('["put", "a:2", {"x":')
+
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert db.get('a:1') == dict(x=1)
+    assert db.get('a:2') is None
+
+
+def test_LocalClient_journal_torn_write_append(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE)
+    db.put('a:1', dict(x=1))
+    db.close()
+    with open(db._journal_path, 'a') as fp:
+        fp.write('["put", "a:2", {"x":')
+
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.APPEND)
+    db.put('a:3', dict(x=3))
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert sorted(db.uris()) == ['a:1', 'a:3']
+
+
+def test_LocalClient_compact(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE,
+                       compact_threshold=3)
+    for n in range(4):
+        db.put('a:{}'.format(n), dict(x=n))
+
+    with open(json_file) as fp:
+        assert len(json.load(fp)) == 3
+    with open(db._journal_path) as fp:
+        assert len(fp.readlines()) == 1
+
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert len(list(db.uris())) == 4
+
+
 @pytest.fixture()
 def sample_client(json_file):
     uri = 'animal:1h2j34'
@@ -112,6 +170,169 @@ def test_LocalClient_uris(sample_client):
     assert sample_client.get(uris[0]) == dict(x=1, y='13')
 
 
+def test_LocalClient_uris_kind(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE)
+    for n in range(3):
+        db.put('audio:{}'.format(n), dict(x=n))
+        db.put('annotation:{}'.format(n), dict(x=n))
+    db.delete('audio:1')
+
+    assert sorted(db.uris(kind='audio')) == ['audio:0', 'audio:2']
+    assert len(list(db.uris(kind='annotation'))) == 3
+    assert len(list(db.uris())) == 5
+    assert list(db.uris(kind='nope')) == []
+
+    with pytest.raises(ValueError):
+        db.put('audio', dict(x=0))
+    assert len(list(db.uris())) == 5
+
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert sorted(db.uris(kind='audio')) == ['audio:0', 'audio:2']
+
+
+def test_LocalClient_shared(json_file):
+    db1 = D.LocalClient('my-project', filepath=json_file, shared=True,
+                        compact_threshold=3)
+    db2 = D.LocalClient('my-project', filepath=json_file, shared=True,
+                        compact_threshold=3)
+    db1.put('a:1', dict(x=1))
+    assert db2.get('a:1') == dict(x=1)
+
+    db2.put_many([('a:2', dict(x=2)), ('a:3', dict(x=3))])
+    db2.delete('a:1')
+    assert sorted(db1.uris()) == ['a:2', 'a:3']
+
+    # Both clients have compacted by now; make sure they still agree.
+    db1.put('b:1', dict(x=4))
+    assert db2.get_many(['a:1', 'b:1']) == [None, dict(x=4)]
+
+
+def test_LocalClient_shared_torn_write(json_file):
+    db1 = D.LocalClient('my-project', filepath=json_file, shared=True)
+    db2 = D.LocalClient('my-project', filepath=json_file, shared=True)
+    db1.put('a:1', dict(x=1))
+    # Another process crashes part way through an append.
+    with open(db1._journal_path, 'a') as fp:
+        fp.write('["put", "a:2", {"x":')
+
+    assert db2.get('a:1') == dict(x=1)
+    db2.put('a:3', dict(x=3))
+    assert db1.get('a:3') == dict(x=3)
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert sorted(db.uris()) == ['a:1', 'a:3']
+
+
+def _shared_writer(json_file, worker, num_records):
+    db = D.LocalClient('my-project', filepath=json_file, shared=True,
+                       compact_threshold=7)
+    for n in range(num_records):
+        db.put('w{}:{}'.format(worker, n), dict(n=n))
+    db.close()
+
+
+def test_LocalClient_shared_processes(json_file):
+    import multiprocessing
+    D.LocalClient('my-project', filepath=json_file, mode=D.WRITE).close()
+    procs = [multiprocessing.Process(target=_shared_writer,
+                                     args=(json_file, worker, 20))
+             for worker in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert len(list(db.uris())) == 80
+    assert db.get('w3:19') == dict(n=19)
+
+
+def _journal_lines(db):
+    with open(db._journal_path) as fp:
+        return len(fp.readlines())
+
+
+def test_LocalClient_group_commit(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE,
+                       flush_every=100)
+    db.put('a:1', dict(x=1))
+    assert _journal_lines(db) == 0
+
+    commit = db.commit()
+    assert commit.wait(timeout=5)
+    assert _journal_lines(db) == 1
+
+    db.put_many([('a:{}'.format(n), dict(x=n)) for n in range(2, 102)])
+    for _ in range(50):
+        if _journal_lines(db) == 101:
+            break
+        time.sleep(0.1)
+    assert _journal_lines(db) == 101
+    db.close()
+
+
+def test_LocalClient_group_commit_interval(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE,
+                       flush_interval=0.05)
+    db.put('a:1', dict(x=1))
+    time.sleep(0.5)
+    assert _journal_lines(db) == 1
+
+    db.put('a:2', dict(x=2))
+    db.close()
+    assert _journal_lines(db) == 2
+    assert D.LocalClient('my-project', filepath=json_file,
+                         mode=D.READ).get('a:2') == dict(x=2)
+
+
+def test_LocalClient_group_commit_atomic(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE,
+                       flush_interval=60)
+    db.put('a:1', dict(x=1))
+    db.put('a:2', dict(x=2), atomic=True)
+    assert _journal_lines(db) == 2
+    db.put_many([('a:3', dict(x=3))], atomic=True)
+    assert _journal_lines(db) == 3
+    db.close()
+
+
+def test_LocalClient_commit(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE,
+                       atomic=False)
+    db.put('a:1', dict(x=1))
+    assert db.commit().done()
+    assert _journal_lines(db) == 1
+
+
+def test_LocalClient_batch(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE)
+    records = {'a:{}'.format(n): dict(x=n) for n in range(5)}
+    db.put_many(records)
+    with open(db._journal_path) as fp:
+        assert len(fp.readlines()) == 5
+
+    uris = ['a:3', 'a:1', 'b:0']
+    assert db.get_many(uris) == [dict(x=3), dict(x=1), None]
+
+    db.delete_many(['a:0', 'a:1', 'b:0'])
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.READ)
+    assert sorted(db.uris()) == ['a:2', 'a:3', 'a:4']
+
+
+def test_LocalClient_batch_invalid(json_file):
+    db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE)
+    with pytest.raises(ValueError):
+        db.put_many([('a:1', dict(x=1)), ('bad-uri', dict(x=2)),
+                     ('a:3', dict(x=3))])
+    assert list(db.uris()) == []
+    assert not os.path.exists(db._journal_path) or \
+        os.path.getsize(db._journal_path) == 0
+
+    db.put('a:1', dict(x=1))
+    with pytest.raises(ValueError):
+        db.delete_many(['a:1', 'bad-uri'])
+    assert db.get('a:1') == dict(x=1)
+
+
 def test_GClient___init__():
     assert D.GClient('my-proj') is not None
 
@@ -157,6 +378,146 @@ def test_GClient_uris():
     assert "book:" in uri
 
 
+@pytest.mark.skipif(
+    TEST_GCP_PROJECT is None,
+    reason="Environment variable `TEST_GCP_PROJECT` is unset; "
+           "unable to test DataStore")
+def test_GClient_update_many():
+    db = D.GClient(TEST_GCP_PROJECT)
+    db.put('c:0', dict(n=0))
+    assert db.update_many(['c:0', 'c:nope'], bump) == [dict(n=1), None]
+    expected = concurrent_bumps(db, num_threads=4, num_bumps=3)
+    assert db.get('c:0') == dict(n=expected + 1)
+    db.delete('c:0')
+
+
+@pytest.mark.skipif(
+    TEST_GCP_PROJECT is None,
+    reason="Environment variable `TEST_GCP_PROJECT` is unset; "
+           "unable to test DataStore")
+def test_GClient_batch():
+    records = [('book:batch{}'.format(n), dict(title='volume {}'.format(n)))
+               for n in range(3)]
+    uris = [uri for uri, _ in records]
+    db = D.GClient(TEST_GCP_PROJECT)
+    db.put_many(records)
+    assert db.get_many(uris) == [rec for _, rec in records]
+
+    db.delete_many(uris)
+    assert db.get_many(uris) == [None] * len(uris)
+
+    # The last of a URI's records wins.
+    db.put_many(records + [(uris[0], dict(title='revised'))])
+    assert db.get(uris[0]) == dict(title='revised')
+    db.delete_many(uris)
+
+
+@pytest.fixture()
+def sqlite_file(tmpdir):
+    return os.path.join(str(tmpdir), 'records.db')
+
+
+def test_SQLiteClient_put_get(sqlite_file):
+    db = D.SQLiteClient('my-project', sqlite_file)
+    assert db.get('a:1234') is None
+    exp_rec = dict(x=1, y=['13'])
+    db.put('a:1234', exp_rec)
+    assert db.get('a:1234') == exp_rec
+
+    db.put('a:1234', dict(x=2))
+    assert db.get('a:1234') == dict(x=2)
+
+    with pytest.raises(ValueError):
+        db.put('a', exp_rec)
+
+
+def test_SQLiteClient_modes(sqlite_file):
+    db = D.SQLiteClient('my-project', sqlite_file)
+    db.put('a:1', dict(x=1))
+    db.close()
+
+    db = D.SQLiteClient('my-project', sqlite_file, mode=D.READ)
+    assert db.get('a:1') == dict(x=1)
+    with pytest.raises(IOError):
+        db.put('a:2', dict(x=2))
+
+    db = D.SQLiteClient('my-project', sqlite_file, mode=D.WRITE)
+    assert db.get('a:1') is None
+
+
+def test_SQLiteClient_wal(sqlite_file):
+    db = D.SQLiteClient('my-project', sqlite_file)
+    mode = db._conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode.lower() == 'wal'
+
+
+def test_SQLiteClient_delete_uris(sqlite_file):
+    db = D.SQLiteClient('my-project', sqlite_file)
+    db.put_many([('audio:{}'.format(n), dict(x=n)) for n in range(3)])
+    db.put('annotation:0', dict(x=0))
+    db.delete('audio:1')
+    db.delete('audio:nope')
+
+    assert sorted(db.uris(kind='audio')) == ['audio:0', 'audio:2']
+    assert len(list(db.uris())) == 3
+    assert db.get_many(['audio:2', 'audio:1']) == [dict(x=2), None]
+
+    db.delete_many(['audio:0', 'annotation:0'])
+    assert list(db.uris()) == ['audio:2']
+
+
+def test_SQLiteClient_threads(sqlite_file):
+    import threading
+    db = D.SQLiteClient('my-project', sqlite_file)
+
+    def work(n):
+        db.put('t:{}'.format(n), dict(n=n))
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(list(db.uris(kind='t'))) == 8
+
+
+def bump(uri, record):
+    if record is None:
+        return None
+    record['n'] += 1
+    return record
+
+
+def concurrent_bumps(db, num_threads=8, num_bumps=20):
+    import threading
+
+    def work():
+        for _ in range(num_bumps):
+            db.update_many(['c:0'], bump)
+
+    threads = [threading.Thread(target=work) for _ in range(num_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return num_threads * num_bumps
+
+
+@pytest.mark.parametrize('backend', ['local', 'sqlite'])
+def test_update_many(backend, json_file, sqlite_file):
+    if backend == 'local':
+        db = D.LocalClient('my-project', filepath=json_file, mode=D.WRITE)
+    else:
+        db = D.SQLiteClient('my-project', sqlite_file, mode=D.WRITE)
+    db.put_many([('c:0', dict(n=0)), ('c:1', dict(n=10))])
+    assert db.update_many(['c:1', 'c:2'], bump) == [dict(n=11), None]
+    assert db.get_many(['c:1', 'c:2']) == [dict(n=11), None]
+
+    # Concurrent updates don't lose increments.
+    expected = concurrent_bumps(db)
+    assert db.get('c:0') == dict(n=expected)
+
+
 def test_Database_local(json_file):
     db = D.Database('my-project', backend='local',
                     filepath=json_file, mode=D.APPEND)
@@ -164,3 +525,220 @@ def test_Database_local(json_file):
     uri = 'a:1582934'
     db.put(uri, dict(name='ringo'))
     assert db.get(uri)
+
+
+def test_Database_sqlite(sqlite_file):
+    db = D.Database('my-project', backend='sqlite', filepath=sqlite_file)
+    assert isinstance(db, D.SQLiteClient)
+
+
+class FlakyClient(D.LocalClient):
+    """A local client whose batch writes fail while `failing` is set."""
+    failing = False
+
+    def put_many(self, records, atomic=False):
+        if self.failing:
+            raise IOError("Backend unavailable")
+        super(FlakyClient, self).put_many(records, atomic=atomic)
+
+    def update_many(self, uris, func):
+        if self.failing:
+            raise IOError("Backend unavailable")
+        return super(FlakyClient, self).update_many(uris, func)
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_WriteBehind_put_get(sqlite_file):
+    dbase = D.LocalClient('my-project')
+    wb = D.WriteBehind(dbase, sqlite_file, flush_interval=60)
+    wb.put('a:1', dict(x=1))
+    wb.put_many([('a:2', dict(x=2)), ('b:3', dict(x=3))])
+    wb.put('a:1', dict(x=11))
+
+    # Pending until flushed, but visible through the buffer.
+    assert dbase.get('a:1') is None
+    assert len(wb) == 4
+    assert wb.get('a:1') == dict(x=11)
+    assert wb.get_many(['b:3', 'c:4']) == [dict(x=3), None]
+    assert sorted(wb.uris(kind='a')) == ['a:1', 'a:2']
+
+    wb.flush()
+    assert len(wb) == 0
+    assert dbase.get_many(['a:1', 'a:2', 'b:3']) == [
+        dict(x=11), dict(x=2), dict(x=3)]
+    assert sorted(wb.uris()) == ['a:1', 'a:2', 'b:3']
+    stats = wb.stats()
+    assert (stats['depth'], stats['flushed'], stats['oldest']) == (0, 4, None)
+    wb.close()
+
+
+def test_WriteBehind_background(sqlite_file):
+    dbase = D.LocalClient('my-project')
+    wb = D.WriteBehind(dbase, sqlite_file, batch_size=3, flush_interval=60)
+    wb.put_many([('a:{}'.format(n), dict(n=n)) for n in range(2)])
+    time.sleep(0.05)
+    assert len(wb) == 2
+    # Filling a batch triggers a flush.
+    wb.put('a:2', dict(n=2))
+    assert wait_until(lambda: len(wb) == 0)
+    assert dbase.get('a:2') == dict(n=2)
+    wb.close()
+
+    wb = D.WriteBehind(dbase, sqlite_file, flush_interval=0.05)
+    wb.put('a:3', dict(n=3))
+    assert wait_until(lambda: dbase.get('a:3') is not None)
+    wb.close()
+
+
+def test_WriteBehind_retry(sqlite_file):
+    dbase = FlakyClient('my-project')
+    dbase.failing = True
+    wb = D.WriteBehind(dbase, sqlite_file, flush_interval=0.01,
+                       retry_delay=0.01)
+    wb.put('a:1', dict(x=1))
+    assert wait_until(lambda: wb.stats()['failures'] >= 2)
+    assert len(wb) == 1
+    assert wb.stats()['oldest'] > 0
+
+    dbase.failing = False
+    assert wait_until(lambda: len(wb) == 0)
+    assert dbase.get('a:1') == dict(x=1)
+    wb.close()
+
+
+def test_WriteBehind_recover(sqlite_file):
+    dbase = FlakyClient('my-project')
+    dbase.failing = True
+    wb = D.WriteBehind(dbase, sqlite_file, flush_interval=60)
+    wb.put_many([('a:1', dict(x=1)), ('a:2', dict(x=2))])
+    # Flushing on close fails, leaving the writes journaled.
+    wb.close()
+    assert dbase.get('a:1') is None
+
+    dbase.failing = False
+    wb = D.WriteBehind(dbase, sqlite_file, flush_interval=60)
+    assert len(wb) == 2
+    assert wb.get('a:2') == dict(x=2)
+    wb.close()
+    assert dbase.get_many(['a:1', 'a:2']) == [dict(x=1), dict(x=2)]
+
+    with pytest.raises(IOError):
+        wb.put('a:3', dict(x=3))
+
+
+def test_WriteBehind_shared(sqlite_file):
+    dbase = D.LocalClient('my-project')
+    wb1 = D.WriteBehind(dbase, sqlite_file, flush_interval=60)
+    wb2 = D.WriteBehind(dbase, sqlite_file, flush_interval=60)
+    wb1.put_many([('a:1', dict(x=1)), ('a:2', dict(x=2))])
+    wb2.put('b:1', dict(x=3))
+
+    # Each buffer flushes only its own writes.
+    wb2.flush()
+    assert dbase.get_many(['a:1', 'a:2', 'b:1']) == [None, None, dict(x=3)]
+    assert len(wb1) == 2 and len(wb2) == 0
+    wb1.flush()
+    assert dbase.get_many(['a:1', 'a:2']) == [dict(x=1), dict(x=2)]
+    assert len(wb1) == 0
+    wb1.close()
+    wb2.close()
+
+
+def test_WriteBehind_expired_lease(sqlite_file):
+    dbase = FlakyClient('my-project')
+    dbase.failing = True
+    # Never renews its lease, as if it had hung or died.
+    stale = D.WriteBehind(dbase, sqlite_file, flush_interval=60, lease=0.05)
+    stale.put('a:1', dict(x=1))
+    live = D.WriteBehind(dbase, sqlite_file, flush_interval=60)
+    assert len(live) == 0
+
+    time.sleep(0.1)
+    live._renew()
+    assert len(live) == 1
+    assert live.get('a:1') == dict(x=1)
+
+    # The stale buffer gives the write up rather than flushing it too.
+    dbase.failing = False
+    stale.flush()
+    assert len(stale) == 0 and stale.stats()['flushed'] == 0
+    assert dbase.get('a:1') is None
+    live.flush()
+    assert dbase.get('a:1') == dict(x=1)
+    stale.close()
+    live.close()
+
+
+def test_WriteBehind_delete(sqlite_file):
+    dbase = D.LocalClient('my-project')
+    wb = D.WriteBehind(dbase, sqlite_file, flush_interval=60)
+    wb.put_many([('a:1', dict(x=1)), ('a:2', dict(x=2))])
+    wb.flush()
+    wb.put('a:1', dict(x=11))
+    wb.delete_many(['a:1'])
+    assert wb.get('a:1') is None
+    wb.flush()
+    assert dbase.get('a:1') is None
+    assert wb.get('a:2') == dict(x=2)
+    wb.close()
+
+
+def add_counts(delta, later):
+    return delta + later
+
+
+def merge_count(uri, record, delta):
+    record = record or dict(n=0)
+    record['n'] += delta
+    return record
+
+
+def test_Accumulator():
+    dbase = D.LocalClient('my-project')
+    dbase.put('a:1', dict(n=5))
+    merged = []
+    acc = D.Accumulator(dbase, add_counts, merge_count,
+                        on_merge=lambda uri, rec: merged.append((uri, rec)),
+                        batch_size=2, flush_interval=60)
+    for uri in ['a:1', 'a:2', 'a:1', 'a:3']:
+        acc.add(uri, 1)
+
+    # Deltas for the same record are combined until flushed.
+    assert len(acc) == 3
+    assert dbase.get('a:1') == dict(n=5)
+    acc.flush()
+    assert len(acc) == 0
+    assert dbase.get_many(['a:1', 'a:2', 'a:3']) == [
+        dict(n=7), dict(n=1), dict(n=1)]
+    assert merged == [('a:1', dict(n=7)), ('a:2', dict(n=1)),
+                      ('a:3', dict(n=1))]
+    assert acc.stats()['merged'] == 3
+
+    # Closing merges what's left.
+    acc.add('a:2', 2)
+    acc.close()
+    assert dbase.get('a:2') == dict(n=3)
+    with pytest.raises(IOError):
+        acc.add('a:2', 1)
+
+
+def test_Accumulator_retry():
+    dbase = FlakyClient('my-project')
+    dbase.failing = True
+    acc = D.Accumulator(dbase, add_counts, merge_count, flush_interval=0.01,
+                        retry_delay=0.01)
+    acc.add('a:1', 1)
+    assert wait_until(lambda: acc.stats()['failures'] >= 2)
+    # Deltas added meanwhile are combined with those that failed.
+    acc.add('a:1', 2)
+
+    dbase.failing = False
+    assert wait_until(lambda: len(acc) == 0)
+    assert dbase.get('a:1') == dict(n=3)
+    acc.close()
@@ -0,0 +1,189 @@
+import pytest
+
+import json
+
+import pybackend.database as D
+import pybackend.ingest as ingest
+import pybackend.jobqueue as Q
+import pybackend.storage as S
+
+
+@pytest.fixture()
+def store(tmpdir):
+    return S.Storage('bucket', 'project', backend=S.LOCAL,
+                     local_dir=str(tmpdir))
+
+
+def test_derived_key():
+    assert ingest.derived_key('abc', 'peaks.json') == 'abc.peaks.json'
+
+
+def test_tile_key():
+    assert ingest.tile_key('abc', 256, 3) == 'abc.spectrogram.256.3.png'
+
+
+def test_run(store, sine_wav):
+    store.put('abc', sine_wav)
+    fields = ingest.run('abc', 'wav', store)
+    assert set(fields) == set(['peaks', 'spectrogram', 'preview'])
+    assert fields['peaks'] == ingest.derived_key('abc', 'peaks.json')
+
+    peaks = json.loads(store.get(fields['peaks']).decode('utf-8'))
+    assert peaks['sample_rate'] == 8000
+    assert peaks['length'] == 16000
+    assert peaks['levels'][0]['data'][:2] == [-64, 64]
+
+
+def test_run_undecodable(store):
+    store.put('abc', b'my file contents')
+    assert ingest.run('abc', 'wav', store) == dict()
+
+
+def test_run_no_decoders(store, sine_wav, monkeypatch):
+    monkeypatch.setattr(ingest.audio, 'AVAILABLE', False)
+    store.put('abc', sine_wav)
+    assert ingest.run('abc', 'wav', store) == dict()
+
+
+def test_run_spectrogram(store, sine_wav):
+    store.put('abc', sine_wav)
+    info = ingest.run('abc', 'wav', store)['spectrogram']
+    assert info['sample_rate'] == 8000
+    for level in info['levels']:
+        assert level['num_tiles'] >= 1
+        for index in range(level['num_tiles']):
+            key = ingest.tile_key('abc', level['hop_length'], index)
+            assert store.get(key).startswith(b'\x89PNG')
+
+
+def test_run_preview(store, sine_wav):
+    store.put('abc', sine_wav)
+    preview = ingest.run('abc', 'wav', store)['preview']
+    assert preview['key'] == ingest.derived_key('abc', 'preview.wav')
+    assert preview['file_ext'] == 'wav'
+    assert preview['sample_rate'] == 8000
+    # Stereo to mono, at the same rate and sample width.
+    assert preview['num_bytes'] == store.size(preview['key'])
+    assert preview['num_bytes'] < store.size('abc') / 1.9
+
+
+def test_run_preview_larger(store, sine_wav):
+    # Pretend the original is well compressed, by only running the preview
+    # stage over a stored copy of the clip that is smaller than the preview.
+    class SmallStore(object):
+        def __init__(self, store):
+            self.store = store
+            self.puts = []
+
+        def iter_range(self, key):
+            return self.store.iter_range(key)
+
+        def size(self, key):
+            return 100
+
+        def put_file(self, key, fp):
+            self.puts.append(key)
+
+    small = SmallStore(store)
+    store.put('abc', sine_wav)
+    fields = ingest.run('abc', 'wav', small, [ingest.PreviewStage])
+    assert fields == dict(preview=None)
+    assert small.puts == []
+
+
+def test_run_many(tmpdir, store, sine_wav):
+    store.put('abc', sine_wav)
+    store.put('xyz', b'my file contents')
+    kwargs = dict(name='bucket', project='project', backend=S.LOCAL,
+                  local_dir=str(tmpdir))
+    jobs = [('abc', 'wav'), ('xyz', 'wav'), ('missing', 'wav')]
+    results = dict(ingest.run_many(jobs, kwargs, processes=2))
+    assert set(results) == set(['abc', 'xyz', 'missing'])
+    assert set(results['abc']) == set(['peaks', 'spectrogram', 'preview'])
+    assert results['xyz'] == dict()
+    assert results['missing'] is None
+
+
+@pytest.fixture()
+def dbase(tmpdir):
+    return D.Database('project', backend='local',
+                      filepath=str(tmpdir.join('db.json')))
+
+
+@pytest.fixture()
+def queue(tmpdir):
+    return Q.JobQueue(filepath=str(tmpdir.join('queue.db')))
+
+
+def test_Workers(dbase, store, queue, sine_wav):
+    store.put('abc', sine_wav)
+    dbase.put('audio:abc', dict(file_ext='wav', status=ingest.PENDING))
+    workers = ingest.Workers(queue, dbase, store, num_workers=2)
+    try:
+        workers.submit('abc', 'wav')
+        assert workers.drain(timeout=10)
+    finally:
+        workers.close()
+
+    record = dbase.get('audio:abc')
+    assert record['status'] == ingest.READY
+    assert record['file_ext'] == 'wav'
+    assert set(['peaks', 'spectrogram', 'preview']) <= set(record)
+
+
+def test_Workers_retry(dbase, store, queue):
+    # Missing from storage, so every attempt fails.
+    dbase.put('audio:abc', dict(file_ext='wav', status=ingest.PENDING))
+    workers = ingest.Workers(queue, dbase, store, num_workers=1,
+                             max_attempts=2, retry_delay=0.01,
+                             poll_interval=0.01)
+    try:
+        workers.submit('abc', 'wav')
+        assert workers.drain(timeout=10)
+    finally:
+        workers.close()
+
+    assert dbase.get('audio:abc')['status'] == ingest.FAILED
+
+
+def test_Workers_resume(tmpdir, dbase, store, sine_wav):
+    # Jobs queued by a previous process are picked up on start.
+    store.put('abc', sine_wav)
+    dbase.put('audio:abc', dict(file_ext='wav', status=ingest.PENDING))
+    fpath = str(tmpdir.join('queue.db'))
+    queue = Q.JobQueue(filepath=fpath)
+    queue.put(dict(gid='abc', file_ext='wav'))
+    queue.close()
+
+    workers = ingest.Workers(Q.JobQueue(filepath=fpath), dbase, store,
+                             num_workers=1, poll_interval=0.01)
+    try:
+        assert workers.drain(timeout=10)
+    finally:
+        workers.close()
+    assert dbase.get('audio:abc')['status'] == ingest.READY
+
+
+def test_Workers_processes(tmpdir, dbase, store, queue, sine_wav):
+    store.put('abc', sine_wav)
+    dbase.put('audio:abc', dict(file_ext='wav', status=ingest.PENDING))
+    kwargs = dict(name='bucket', project='project', backend=S.LOCAL,
+                  local_dir=str(tmpdir))
+    workers = ingest.Workers(queue, dbase, store, num_workers=1,
+                             processes=1, storage_kwargs=kwargs)
+    try:
+        workers.submit('abc', 'wav')
+        assert workers.drain(timeout=10)
+    finally:
+        workers.close()
+    assert dbase.get('audio:abc')['status'] == ingest.READY
+
+
+def test_Workers_drain_timeout(dbase, store, queue):
+    queue.put(dict(gid='abc', file_ext='wav'))
+    workers = ingest.Workers(queue, dbase, store, num_workers=0,
+                             poll_interval=0.01)
+    try:
+        assert not workers.drain(timeout=0.05)
+    finally:
+        workers.close()
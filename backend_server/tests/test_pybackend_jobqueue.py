@@ -0,0 +1,88 @@
+import pytest
+
+import threading
+import time
+
+import pybackend.jobqueue as Q
+
+
+@pytest.fixture()
+def queue(tmpdir):
+    queue = Q.JobQueue(backend='sqlite', filepath=str(tmpdir.join('q.db')))
+    yield queue
+    queue.close()
+
+
+def test_SQLiteQueue_put_get_ack(queue):
+    assert queue.get() is None
+    queue.put(dict(x=1))
+    queue.put(dict(x=2))
+    assert len(queue) == 2
+
+    job = queue.get()
+    assert job.payload == dict(x=1)
+    assert job.attempts == 1
+    assert queue.get().payload == dict(x=2)
+    assert queue.get() is None
+
+    assert queue.ack(job)
+    assert not queue.ack(job)
+    assert len(queue) == 1
+
+
+def test_SQLiteQueue_release(queue):
+    queue.put(dict(x=1))
+    job = queue.get()
+    assert queue.release(job)
+    job = queue.get()
+    assert job.attempts == 2
+
+    assert queue.release(job, delay=60)
+    assert queue.get() is None
+    assert len(queue) == 1
+
+
+def test_SQLiteQueue_lease(tmpdir):
+    queue = Q.SQLiteQueue(str(tmpdir.join('q.db')), lease=0.05)
+    queue.put(dict(x=1))
+    first = queue.get()
+    assert queue.get() is None
+    time.sleep(0.1)
+
+    # Redelivered once the lease runs out; the first claim is now stale.
+    second = queue.get()
+    assert second.id == first.id
+    assert not queue.ack(first)
+    assert queue.ack(second)
+    assert len(queue) == 0
+
+
+def test_SQLiteQueue_persistent(tmpdir):
+    fpath = str(tmpdir.join('q.db'))
+    queue = Q.SQLiteQueue(fpath)
+    queue.put(dict(x=1))
+    queue.close()
+    assert Q.SQLiteQueue(fpath).get().payload == dict(x=1)
+
+
+def test_SQLiteQueue_threads(queue):
+    num_jobs = 200
+    for idx in range(num_jobs):
+        queue.put(dict(x=idx))
+
+    claimed = []
+
+    def work():
+        job = queue.get()
+        while job is not None:
+            claimed.append(job.payload['x'])
+            queue.ack(job)
+            job = queue.get()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == list(range(num_jobs))
+    assert len(queue) == 0
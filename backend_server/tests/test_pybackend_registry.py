@@ -0,0 +1,123 @@
+import pytest
+import os
+import time
+
+import pybackend.database as D
+import pybackend.registry as R
+import pybackend.storage as S
+
+
+@pytest.fixture()
+def registry(tmpdir):
+    return R.Registry(
+        'my-project',
+        database=dict(backend='local',
+                      filepath=os.path.join(str(tmpdir), 'db.json')),
+        storage=dict(name='my-bucket', backend='local',
+                     local_dir=str(tmpdir)))
+
+
+def test_Registry_database(registry):
+    assert isinstance(registry.database, D.LocalClient)
+    assert registry.database is registry.database
+
+
+def test_Registry_storage(registry):
+    assert isinstance(registry.storage, S.Storage)
+    assert registry.storage is registry.storage
+    assert registry.storage.client is registry.storage.client
+
+
+def test_Registry_close(registry):
+    dbase = registry.database
+    dbase.put('a:1', dict(x=1))
+    registry.close()
+    assert registry.database is not dbase
+    assert registry.database.get('a:1') == dict(x=1)
+
+
+def test_Registry_ingest(tmpdir):
+    registry = R.Registry(
+        'my-project',
+        database=dict(backend='local',
+                      filepath=os.path.join(str(tmpdir), 'db.json')),
+        storage=dict(name='my-bucket', backend='local',
+                     local_dir=str(tmpdir)),
+        ingest=dict(queue=dict(filepath=str(tmpdir.join('queue.db'))),
+                    num_workers=1))
+    workers = registry.ingest
+    assert workers is registry.ingest
+    assert workers.dbase is registry.database
+    assert workers.store is registry.storage
+    registry.close()
+    assert registry.ingest is not workers
+    registry.close()
+
+
+def test_Registry_no_ingest(registry):
+    assert registry.ingest is None
+
+
+def test_Registry_known_audio(registry):
+    registry.database.put('audio:abc', dict(file_ext='wav'))
+    registry.database.put('annotation:xyz', dict())
+    known = registry.known_audio
+    assert known is registry.known_audio
+    assert 'audio:abc' in known
+    assert 'annotation:xyz' not in known
+    registry.close()
+    assert registry.known_audio is not known
+
+
+def test_Registry_scheduler(tmpdir):
+    registry = R.Registry(
+        'my-project',
+        database=dict(backend='local',
+                      filepath=os.path.join(str(tmpdir), 'db.json')),
+        storage=dict(name='my-bucket', backend='local',
+                     local_dir=str(tmpdir)),
+        scheduler=dict(backend='priority', refresh_interval=0))
+    registry.database.put('audio:abc', dict(file_ext='wav'))
+    sched = registry.scheduler
+    assert 'audio:abc' in sched
+
+    # Audio from other processes is picked up in the background.
+    registry.database.put('audio:xyz', dict(file_ext='wav'))
+    assert registry.scheduler is sched
+    for _ in range(100):
+        if 'audio:xyz' in sched:
+            break
+        time.sleep(0.01)
+    assert 'audio:xyz' in sched
+    registry.close()
+    assert registry.scheduler is not sched
+
+
+def test_Registry_scheduler_no_refresh(registry):
+    registry.database.put('audio:abc', dict(file_ext='wav'))
+    sched = registry.scheduler
+    registry.database.put('audio:xyz', dict(file_ext='wav'))
+    assert registry.scheduler is sched
+    assert 'audio:xyz' not in sched
+
+
+def test_Registry_annotations(registry, tmpdir):
+    assert registry.annotations is registry.database
+
+    registry = R.Registry(
+        'my-project',
+        database=dict(backend='local',
+                      filepath=os.path.join(str(tmpdir), 'db.json')),
+        storage=dict(name='my-bucket', backend='local',
+                     local_dir=str(tmpdir)),
+        write_behind=dict(filepath=os.path.join(str(tmpdir), 'journal.db'),
+                          flush_interval=60))
+    assert isinstance(registry.annotations, D.WriteBehind)
+    assert registry.annotations is registry.annotations
+    dbase = registry.database
+    registry.annotations.put('annotation:abc', dict(x=1))
+    assert dbase.get('annotation:abc') is None
+
+    # Closing flushes pending writes.
+    registry.close()
+    assert dbase.get('annotation:abc') == dict(x=1)
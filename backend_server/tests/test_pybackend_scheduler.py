@@ -0,0 +1,122 @@
+import pytest
+
+import pybackend.scheduler as S
+
+
+def test_RandomScheduler___init__():
+    sched = S.RandomScheduler(['a:1', 'a:2', 'a:1'])
+    assert len(sched) == 2
+    assert 'a:1' in sched
+    assert S.RandomScheduler().sample() is None
+
+
+def test_RandomScheduler_add_discard():
+    uris = ['a:{}'.format(n) for n in range(10)]
+    sched = S.RandomScheduler(uris)
+    for uri in uris[:5]:
+        sched.discard(uri)
+    sched.discard('a:nope')
+
+    assert len(sched) == 5
+    assert set(sched._uris) == set(uris[5:])
+    for uri in uris[5:]:
+        assert sched._uris[sched._positions[uri]] == uri
+
+
+def test_RandomScheduler_sample():
+    uris = set(['a:{}'.format(n) for n in range(4)])
+    sched = S.RandomScheduler(uris)
+    samples = set([sched.sample() for _ in range(200)])
+    assert samples == uris
+
+
+def test_PriorityScheduler_sample():
+    sched = S.PriorityScheduler()
+    sched.add('a:0', count=2)
+    sched.add('a:1', count=1)
+    assert sched.sample() == 'a:1'
+
+    sched.add('a:2')
+    assert sched.sample() == 'a:2'
+    sched.discard('a:2')
+    assert sched.sample() == 'a:1'
+    assert S.PriorityScheduler().sample() is None
+
+
+def test_PriorityScheduler_record():
+    sched = S.PriorityScheduler()
+    sched.add('a:0')
+    sched.add('a:1')
+    sched.record('a:0')
+    assert sched.sample() == 'a:1'
+    sched.record('a:1')
+    sched.record('a:1')
+    assert sched.sample() == 'a:0'
+    sched.record('a:nope')
+    assert len(sched) == 2
+
+
+def test_PriorityScheduler_sync():
+    sched = S.PriorityScheduler(target=3)
+    sched.add('a:0')
+    sched.add('a:1')
+    # Counted elsewhere.
+    sched.sync('a:0', 2)
+    assert sched.sample() == 'a:1'
+    sched.sync('a:1', 3)
+    assert 'a:1' not in sched
+    assert sched.sample() == 'a:0'
+    sched.sync('a:nope', 1)
+    assert len(sched) == 1
+
+
+def test_PriorityScheduler_target():
+    sched = S.PriorityScheduler(target=2)
+    sched.add('a:0', count=2)
+    assert 'a:0' not in sched
+    sched.add('a:1', count=1)
+    assert sched.sample() == 'a:1'
+    sched.record('a:1')
+    assert 'a:1' not in sched
+    assert sched.sample() is None
+
+
+def test_PriorityScheduler_seed():
+    import pybackend.database as D
+    dbase = D.LocalClient('my-project')
+    dbase.put('audio:0', {S.COUNT_FIELD: 3})
+    dbase.put('audio:1', dict())
+    dbase.put('annotation:0', dict())
+
+    sched = S.PriorityScheduler()
+    sched.seed(dbase)
+    assert len(sched) == 2
+    assert sched.sample() == 'audio:1'
+
+
+def test_PriorityScheduler_reseed():
+    import pybackend.database as D
+    dbase = D.LocalClient('my-project')
+    dbase.put('audio:0', dict())
+    dbase.put('audio:1', {S.COUNT_FIELD: 1})
+
+    sched = S.PriorityScheduler(target=2)
+    sched.seed(dbase)
+    sched.record('audio:0')
+    sched.record('audio:1')
+    assert 'audio:1' not in sched
+
+    # Items added elsewhere are picked up, while known and retired items
+    # keep their local state.
+    dbase.put('audio:2', dict())
+    sched.seed(dbase)
+    assert len(sched) == 2
+    assert 'audio:1' not in sched
+    assert sched.sample() == 'audio:2'
+
+
+def test_Scheduler():
+    assert isinstance(S.Scheduler(), S.RandomScheduler)
+    sched = S.Scheduler(backend=S.PRIORITY, target=3)
+    assert isinstance(sched, S.PriorityScheduler)
+    assert sched.target == 3
@@ -1,4 +1,5 @@
 import pytest
+import io
 import os
 
 import pybackend.storage as S
@@ -28,6 +29,24 @@ def test_LocalBlob_download_as_string(tmpdir):
     assert blob.download_as_string() == sdata
 
 
+def test_LocalBlob_upload_from_file(tmpdir):
+    blob = S.LocalBlob('foobaz.ogg', str(tmpdir))
+    sdata = b"hooo boy, hooeee"
+    blob.upload_from_file(io.BytesIO(sdata), "application/octet-stream")
+    assert blob.download_as_string() == sdata
+    assert os.listdir(str(tmpdir)) == ['foobaz.ogg']
+
+
+def test_LocalBlob_download_as_string_range(tmpdir):
+    blob = S.LocalBlob('foobaz.json', str(tmpdir))
+    sdata = b"hooo boy, hooeee"
+    blob.upload_from_string(sdata, "application/octet-stream")
+    assert blob.size == len(sdata)
+    assert blob.download_as_string(start=5) == sdata[5:]
+    assert blob.download_as_string(start=5, end=7) == sdata[5:8]
+    assert blob.download_as_string(end=3) == sdata[:4]
+
+
 def test_LocalBucket_blob(tmpdir):
     bucket = S.LocalBucket('foobizbaz', str(tmpdir))
     key = "barbar.json"
@@ -87,3 +106,212 @@ def test_Storage_download(tmpdir):
     store.put(key, fdata)
     res = store.get(key)
     assert res == fdata
+
+
+def test_Storage_put_file(tmpdir):
+    store = S.Storage('blah-blah-5678', 'my-project-3', backend=S.LOCAL,
+                      local_dir=str(tmpdir))
+    fdata = b"hello darkness my old friend"
+    store.put_file('my_song', io.BytesIO(fdata))
+    assert store.get('my_song') == fdata
+
+
+def test_Storage_iter_range(tmpdir):
+    store = S.Storage('blah-blah-5678', 'my-project-3', backend=S.LOCAL,
+                      local_dir=str(tmpdir))
+    fdata = b"hello darkness my old friend"
+    store.put('my_song', fdata)
+    assert store.size('my_song') == len(fdata)
+
+    chunks = list(store.iter_range('my_song', chunk_size=5))
+    assert b''.join(chunks) == fdata
+    assert max(len(c) for c in chunks) == 5
+    assert b''.join(store.iter_range('my_song', 6, 14, 3)) == fdata[6:14]
+
+
+def test_BlobCache():
+    cache = S.BlobCache(10)
+    cache.put('a', b'1234')
+    cache.put('b', b'5678')
+    assert cache.get('a') == b'1234'
+    assert cache.get('c') is None
+
+    # 'b' is least recently used.
+    cache.put('c', b'90')
+    cache.put('d', b'ab')
+    assert 'b' not in cache
+    assert cache.peek('a') == b'1234'
+    assert cache.stats() == dict(hits=1, misses=1, evictions=1,
+                                 num_bytes=8, num_items=3)
+
+    cache.put('big', b'x' * 11)
+    assert 'big' not in cache
+    cache.discard('a')
+    assert cache.num_bytes == 4
+
+
+@pytest.mark.parametrize('cache_size', [0, 100])
+def test_Storage_exists_head(tmpdir, cache_size):
+    store = S.Storage(name='blah', project='foo', backend=S.LOCAL,
+                      local_dir=str(tmpdir), cache_size=cache_size)
+    assert not store.exists('my_song')
+    assert store.head('my_song') is None
+
+    store.put('my_song', b'never gonna give you up')
+    assert store.exists('my_song')
+    assert store.head('my_song') == dict(size=23)
+
+
+def test_Storage_cache(tmpdir):
+    store = S.Storage('blah-blah-5678', 'my-project-3', backend=S.LOCAL,
+                      local_dir=str(tmpdir), cache_size=1024)
+    fdata = b"hello darkness my old friend"
+    store.put('my_song', fdata)
+    blob_path = store.bucket.get_blob('my_song').path
+    os.remove(blob_path)
+
+    # Served entirely from memory.
+    assert store.get('my_song') == fdata
+    assert store.size('my_song') == len(fdata)
+    assert b''.join(store.iter_range('my_song', 6, 14, 3)) == fdata[6:14]
+    assert store.cache.stats()['hits'] == 2
+
+
+def test_Storage_cache_read_through(tmpdir):
+    store = S.Storage('blah-blah-5678', 'my-project-3', backend=S.LOCAL,
+                      local_dir=str(tmpdir), cache_size=1024)
+    fdata = b"hello darkness my old friend"
+    store.put_file('my_song', io.BytesIO(fdata))
+    assert 'my_song' not in store.cache
+
+    assert b''.join(store.iter_range('my_song')) == fdata
+    assert 'my_song' in store.cache
+    assert store.cache.stats()['misses'] == 1
+
+
+def _touch(path, data, mtime):
+    with open(path, 'wb') as fp:
+        fp.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def test_DiskTier(tmpdir):
+    root = str(tmpdir)
+    for n, name in enumerate(['c', 'a', 'b']):
+        _touch(os.path.join(root, name), b'x' * 4, 1000 + n)
+
+    # Existing files are indexed oldest-first; 'c' goes over budget.
+    tier = S.DiskTier(root, max_bytes=8)
+    assert sorted(os.listdir(root)) == ['a', 'b']
+    assert tier.num_bytes == 8
+
+    tier.touch(os.path.join(root, 'a'))
+    with open(os.path.join(root, 'd'), 'wb') as fp:
+        fp.write(b'x' * 4)
+    tier.add(os.path.join(root, 'd'))
+    assert sorted(os.listdir(root)) == ['a', 'd']
+
+    # Recency survives a restart; partial downloads are not indexed.
+    _touch(os.path.join(root, 'e.123.part'), b'x' * 4, 2000)
+    tier = S.DiskTier(root, max_bytes=4)
+    assert 'e.123.part' not in [os.path.basename(p) for p in tier._files]
+    assert sorted(os.listdir(root)) == ['d', 'e.123.part']
+
+
+@pytest.fixture()
+def tiered_client(tmpdir):
+    remote = S.LocalClient('my-project', os.path.join(str(tmpdir), 'remote'))
+    return S.TieredClient('my-project', os.path.join(str(tmpdir), 'local'),
+                          max_bytes=16, remote=remote)
+
+
+def test_TieredClient_write_through(tiered_client):
+    bucket = tiered_client.get_bucket('fluflu')
+    bucket.blob('a').upload_from_string(b'0123456789', 'audio/wav')
+    bucket.blob('b').upload_from_file(io.BytesIO(b'abcdefghij'), 'audio/wav')
+
+    remote = tiered_client.remote.get_bucket('fluflu')
+    assert remote.get_blob('a').download_as_string() == b'0123456789'
+    assert remote.get_blob('b').download_as_string() == b'abcdefghij'
+
+    # Only the most recent fits in the budget locally.
+    assert not os.path.exists(bucket.blob('a').path)
+    assert os.path.exists(bucket.blob('b').path)
+
+
+def test_TieredClient_read_through(tiered_client):
+    bucket = tiered_client.get_bucket('fluflu')
+    bucket.blob('a').upload_from_string(b'0123456789', 'audio/wav')
+    bucket.blob('b').upload_from_string(b'abcdefghij', 'audio/wav')
+
+    blob = bucket.get_blob('a')
+    assert blob.size == 10
+    assert blob.download_as_string(start=2, end=4) == b'234'
+    assert os.path.exists(blob.path)
+    assert not os.path.exists(bucket.blob('b').path)
+
+
+def test_TieredBlob_evicted_during_read(tiered_client, monkeypatch):
+    bucket = tiered_client.get_bucket('fluflu')
+    bucket.blob('a').upload_from_string(b'0123456789', 'audio/wav')
+    blob = bucket.get_blob('a')
+    assert os.path.exists(blob.path)
+
+    # Another thread evicts the file as this one marks it used.
+    touch = tiered_client.tier.touch
+
+    def evicting_touch(path):
+        touch(path)
+        os.remove(path)
+
+    monkeypatch.setattr(tiered_client.tier, 'touch', evicting_touch)
+    assert blob.download_as_string(start=2, end=4) == b'234'
+
+    # Gone locally; a miss fetches it again.
+    monkeypatch.setattr(tiered_client.tier, 'touch', touch)
+    assert blob.size == 10
+    assert blob.download_as_string() == b'0123456789'
+    assert os.path.exists(blob.path)
+
+
+def test_TieredBlob_size_evicted(tiered_client):
+    bucket = tiered_client.get_bucket('fluflu')
+    bucket.blob('a').upload_from_string(b'0123456789', 'audio/wav')
+    remote = tiered_client.remote.get_bucket('fluflu')
+
+    class Unfetched(object):
+        size = None
+
+    class RemoteBucket(object):
+        # Like cloud buckets, blobs made without a fetch carry no metadata.
+        def blob(self, name):
+            return Unfetched()
+
+        def get_blob(self, name):
+            return remote.get_blob(name)
+
+    blob = S.TieredBlob('a', bucket.path, RemoteBucket(), tiered_client.tier)
+    assert os.path.exists(blob.path)
+    os.remove(blob.path)
+    assert blob.size == 10
+
+
+def test_TieredBlob_exists(tiered_client):
+    bucket = tiered_client.get_bucket('fluflu')
+    assert not bucket.blob('a').exists()
+    bucket.blob('a').upload_from_string(b'0123456789', 'audio/wav')
+    bucket.blob('b').upload_from_string(b'abcdefghij', 'audio/wav')
+
+    # Evicted locally, but still held remotely.
+    assert not os.path.exists(bucket.blob('a').path)
+    assert bucket.blob('a').exists()
+    assert bucket.blob('b').exists()
+
+
+def test_Storage_tiered(tmpdir):
+    with pytest.raises(ValueError):
+        S.Storage('blah-blah', 'my-project', backend=S.TIERED,
+                  local_dir=str(tmpdir))
+    store = S.Storage('blah-blah', 'my-project', backend=S.TIERED,
+                      local_dir=str(tmpdir), local_size=1024)
+    assert store._client_kwargs['max_bytes'] == 1024
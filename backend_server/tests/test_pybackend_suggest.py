@@ -0,0 +1,140 @@
+import pytest
+
+import json
+import numpy as np
+import os
+
+import pybackend.suggest as S
+import pybackend.taxonomy as T
+
+JAMENDO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                           'data', 'jamendo')
+TRACKS_FILE = os.path.join(JAMENDO_DIR, 'jamendo-instruments-per-track.json')
+PER_CATEGORY = os.path.join(JAMENDO_DIR,
+                            'instruments_taxonomy_per_category.json')
+TAGS = ['bass', 'drums', 'guitar', 'piano', 'vocals']
+
+
+@pytest.fixture(scope='module')
+def hierarchy():
+    return T.Hierarchy(PER_CATEGORY)
+
+
+@pytest.fixture()
+def engine(hierarchy):
+    return S.CoOccurrence(TAGS, hierarchy, num_suggestions=2)
+
+
+def test_load_tracks(tmpdir):
+    fpath = str(tmpdir.join('tracks.json'))
+    with open(fpath, 'w') as fp:
+        json.dump({'1': ['drum', 'voice'], '2': []}, fp)
+    assert sorted(S.load_tracks(fpath)) == [[], ['drum', 'voice']]
+
+
+@pytest.mark.parametrize('response, expected',
+                         [(dict(annotations=[dict(annotation='guitar'),
+                                             dict(annotation=''),
+                                             'piano', 3]),
+                           ['guitar', 'piano']),
+                          (dict(annotations='guitar'), []),
+                          (dict(), []),
+                          (None, [])])
+def test_annotation_tags(response, expected):
+    assert S.annotation_tags(response) == expected
+
+
+def test_CoOccurrence_tag_id(engine):
+    assert engine.tag_id('guitar') == 2
+    assert engine.tag_id('electric guitar') == 2
+    assert engine.tag_id('ElectricGuitar') == 2
+    assert engine.tag_id('classical guitar') == 2
+    assert engine.tag_id('double bass') == 0
+    assert engine.tag_id('acoustic bass guitar') == 0
+    assert engine.tag_id('drum') == 1
+    assert engine.tag_id('hang') == 1
+    assert engine.tag_id('voice') == 4
+    assert engine.tag_id('kazoo') is None
+    assert engine.encode(['voice', 'vocals', 'bass', 'kazoo', 7]).tolist() \
+        == [0, 4]
+
+
+def test_CoOccurrence_tag_id_no_hierarchy():
+    engine = S.CoOccurrence(TAGS)
+    assert engine.tag_id('guitar') == 2
+    assert engine.tag_id('voice') == 4
+    assert engine.tag_id('electric guitar') is None
+
+
+def test_CoOccurrence_add(engine):
+    engine.add(['guitar', 'vocals'])
+    engine.add(['guitar', 'drums'])
+    engine.add(['guitar', 'drums', 'bass'])
+    engine.add(['kazoo'])
+    assert engine.counts[2, 2] == 3
+    assert engine.counts[2, 1] == engine.counts[1, 2] == 2
+    assert engine.counts.sum() == 4 + 4 + 9
+
+    assert engine.suggest() == ['guitar', 'drums']
+    assert engine.suggest(['guitar']) == ['drums', 'bass']
+    assert engine.suggest(['guitar', 'drums'], num=3) == [
+        'bass', 'vocals', 'piano']
+    assert engine.suggest(['kazoo']) == ['guitar', 'drums']
+
+    # Cached rankings follow new data.
+    engine.add(['guitar', 'vocals'])
+    engine.add(['guitar', 'vocals'])
+    assert engine.suggest(['guitar']) == ['vocals', 'drums']
+
+
+def test_CoOccurrence_update(engine):
+    tag_sets = [['guitar', 'vocals'], [], ['guitar', 'drums'], ['kazoo'],
+                ['guitar', 'drums', 'bass']]
+    expected = S.CoOccurrence(TAGS)
+    for tags in tag_sets:
+        expected.add(tags)
+
+    S.BATCH_SIZE, batch_size = 2, S.BATCH_SIZE
+    try:
+        assert engine.update(iter(tag_sets)) == 3
+    finally:
+        S.BATCH_SIZE = batch_size
+    assert np.array_equal(engine.counts, expected.counts)
+
+
+def test_CoOccurrence_tally(engine):
+    counts, count = engine.tally([['guitar', 'vocals'], ['kazoo'], []])
+    assert count == 1
+    assert counts[2, 4] == counts[2, 2] == 1
+    assert counts.sum() == 4
+    assert engine.counts.sum() == 0
+
+
+def test_CoOccurrence_record(engine, hierarchy):
+    engine.add(['guitar', 'vocals'])
+    engine.add(['guitar', 'drums'])
+    record = engine.to_record()
+    assert record['tags'] == TAGS
+    assert len(record['counts']) == len(TAGS) ** 2
+    assert json.loads(json.dumps(record)) == record
+
+    other = S.CoOccurrence(TAGS, hierarchy)
+    other.load(record)
+    assert np.array_equal(other.counts, engine.counts)
+    assert other.suggest(['guitar'], 3) == engine.suggest(['guitar'], 3)
+
+    # Counts follow tags across vocabularies; others are dropped.
+    other = S.CoOccurrence(['vocals', 'guitar', 'kazoo'])
+    counts = other.from_record(record)
+    assert counts.tolist() == [[1, 1, 0], [1, 2, 0], [0, 0, 0]]
+
+    with pytest.raises(ValueError):
+        engine.from_record(dict(tags=TAGS, counts=[1, 2, 3]))
+
+
+def test_CoOccurrence_jamendo(hierarchy):
+    engine = S.CoOccurrence(TAGS, hierarchy)
+    assert engine.update(S.load_tracks(TRACKS_FILE)) > 10000
+    suggestions = engine.suggest(['guitar'])
+    assert 'guitar' not in suggestions
+    assert set(suggestions) == set(TAGS) - set(['guitar'])
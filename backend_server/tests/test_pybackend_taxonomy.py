@@ -0,0 +1,173 @@
+import pytest
+
+import json
+import os
+import time
+
+import pybackend.taxonomy as T
+
+TAXONOMY_FILE = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                             'data', 'instrument_taxonomy_v0.json')
+
+
+def schema(instruments):
+    return {T.INSTRUMENT_FIELD: dict(value=dict(enum=instruments))}
+
+
+@pytest.fixture()
+def tax_file(tmpdir):
+    fpath = str(tmpdir.join('taxonomy.json'))
+    with open(fpath, 'w') as fp:
+        json.dump(schema(['guitar', 'piano']), fp)
+    return fpath
+
+
+def wait_for(tax, timeout=5):
+    # Let any background refresh run to completion.
+    deadline = time.time() + timeout
+    while tax._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_parse():
+    assert T.parse(schema(['a', 'b'])) == ['a', 'b']
+
+
+@pytest.mark.parametrize('data', [dict(), schema([]), schema([1, 2]),
+                                  {T.INSTRUMENT_FIELD: []}, None])
+def test_parse_malformed(data):
+    with pytest.raises(ValueError):
+        T.parse(data)
+
+
+def test_Taxonomy_bundled():
+    tax = T.Taxonomy(TAXONOMY_FILE)
+    assert 'guitar' in tax.instruments
+    assert json.loads(tax.json.decode('utf-8')) == tax.instruments
+
+
+def test_Taxonomy(tax_file):
+    tax = T.Taxonomy(tax_file)
+    assert tax.instruments == ['guitar', 'piano']
+    assert tax.json == b'["guitar", "piano"]'
+    # Callers can't modify the cached copy.
+    tax.instruments.append('kazoo')
+    assert tax.instruments == ['guitar', 'piano']
+
+
+def test_Taxonomy_refresh(tax_file):
+    tax = T.Taxonomy(tax_file, ttl=0.05)
+    with open(tax_file, 'w') as fp:
+        json.dump(schema(['kazoo']), fp)
+
+    # Stale data is served while the refresh runs in the background.
+    assert tax.instruments == ['guitar', 'piano']
+    time.sleep(0.1)
+    tax.instruments
+    wait_for(tax)
+    assert tax.instruments == ['kazoo']
+    assert tax.json == b'["kazoo"]'
+
+
+def test_Taxonomy_refresh_failure(tax_file):
+    tax = T.Taxonomy(tax_file, ttl=0.05)
+    with open(tax_file, 'w') as fp:
+        fp.write('not json')
+
+    time.sleep(0.1)
+    tax.instruments
+    wait_for(tax)
+    assert tax.instruments == ['guitar', 'piano']
+
+
+def test_Taxonomy_missing(tmpdir):
+    with pytest.raises(IOError):
+        T.Taxonomy(str(tmpdir.join('missing.json')))
+    with pytest.raises(ValueError):
+        T.Taxonomy(None)
+
+
+def test_Taxonomy_url(monkeypatch):
+    class Response(object):
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return schema(['kazoo'])
+
+    urls = []
+
+    def get(url, timeout):
+        urls.append(url)
+        return Response()
+
+    monkeypatch.setattr(T.requests, 'get', get)
+    tax = T.Taxonomy(None, url='http://example.com/taxonomy.json')
+    assert tax.instruments == ['kazoo']
+    assert urls == ['http://example.com/taxonomy.json']
+
+
+JAMENDO_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                           'data', 'jamendo')
+PER_CATEGORY = os.path.join(JAMENDO_DIR,
+                            'instruments_taxonomy_per_category.json')
+PER_INSTRUMENT = os.path.join(JAMENDO_DIR,
+                              'instruments_taxonomy_per_instrument.json')
+
+
+@pytest.fixture(scope='module')
+def hierarchy():
+    return T.Hierarchy(PER_CATEGORY, PER_INSTRUMENT)
+
+
+def test_Hierarchy_lookups(hierarchy):
+    assert hierarchy.categories('electric guitar') == ('electric', 'popular')
+    assert 'electric guitar' in hierarchy.instruments('popular')
+    assert hierarchy.categories('kazoo') == ('wind',)
+    assert hierarchy.categories('nope') == ()
+    assert hierarchy.instruments('nope') == ()
+
+
+def test_Hierarchy_consistent(hierarchy):
+    for cat in hierarchy.all_categories:
+        for inst in hierarchy.instruments(cat):
+            assert cat in hierarchy.categories(inst)
+    for inst_id, inst in enumerate(hierarchy.all_instruments):
+        assert hierarchy.instrument_id(inst) == inst_id
+        for cat_id in hierarchy.category_ids(inst_id):
+            assert inst_id in hierarchy.instrument_ids(cat_id)
+
+
+@pytest.mark.parametrize('alias, expected',
+                         [('Electric-Guitar', 'electric guitar'),
+                          ('bongos', 'bongo'),
+                          ('cymbals', 'cymbal'),
+                          ('drums', 'drums'),
+                          ('Jews Harp', "jew's-harp"),
+                          ('classicalguitar', 'acoustic guitar'),
+                          ('synth', 'synthesizer'),
+                          ('kitchen sink', None)])
+def test_Hierarchy_normalize(hierarchy, alias, expected):
+    assert hierarchy.normalize(alias) == expected
+    assert (alias in hierarchy) == (expected is not None)
+
+
+def test_Hierarchy_interned(hierarchy):
+    inst = hierarchy.instruments('popular')[0]
+    assert any(inst is name for name in hierarchy.all_instruments)
+
+
+def test_Hierarchy_disagree(tmpdir):
+    per_category = str(tmpdir.join('per_category.json'))
+    per_instrument = str(tmpdir.join('per_instrument.json'))
+    with open(per_category, 'w') as fp:
+        json.dump(dict(string=['cello', 'violin']), fp)
+    with open(per_instrument, 'w') as fp:
+        json.dump(dict(cello=['string']), fp)
+
+    hier = T.Hierarchy(per_category, aliases={})
+    assert hier.instruments('string') == ('cello', 'violin')
+    with pytest.raises(ValueError):
+        T.Hierarchy(per_category, per_instrument, aliases={})
+    with pytest.raises(ValueError):
+        T.Hierarchy(per_category, aliases=dict(fiddle='viola'))
@@ -1,6 +1,12 @@
 from __future__ import print_function
 import pytest
 
+import io
+import json
+import numpy as np
+import struct
+import zlib
+
 import pybackend.utils
 
 
@@ -14,6 +20,64 @@ def test_utils_uuid():
     assert uuid1 != pybackend.utils.uuid('foobar')
 
 
+@pytest.mark.parametrize('max_size', [0, 5, 2 ** 20])
+def test_utils_spool(max_size):
+    data = b'some audio bytes' * 100
+    fp, uuid, num_bytes = pybackend.utils.spool(
+        io.BytesIO(data), chunk_size=7, max_size=max_size)
+    assert uuid == pybackend.utils.uuid(data)
+    assert num_bytes == len(data)
+    assert fp.read() == data
+
+
+def test_chunks():
+    chunks = list(pybackend.utils.chunks(range(7), 3))
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(pybackend.utils.chunks([], 3)) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 2 ** 16])
+def test_iter_json_items(chunk_size):
+    obj = {'a:1': dict(x=12345, y=['d', 'e']), 'b:2': 3.25,
+           'c:3': 'a "quoted" } string', 'd:4': [], 'e:5': None}
+    fp = io.StringIO(u' \n' + json.dumps(obj, indent=2))
+    items = list(pybackend.utils.iter_json_items(fp, chunk_size=chunk_size))
+    assert dict(items) == obj
+    assert [k for k, v in items] == list(obj.keys())
+
+    assert list(pybackend.utils.iter_json_items(io.StringIO(u'{ }'))) == []
+
+
+@pytest.mark.parametrize('data', [u'', u'[1, 2]', u'{"a": 1', u'{"a" 1}',
+                                  u'{"a": 1 "b": 2}', u'{1: 2}'])
+def test_iter_json_items_malformed(data):
+    with pytest.raises(ValueError):
+        list(pybackend.utils.iter_json_items(io.StringIO(data), chunk_size=2))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 2 ** 16])
+def test_iter_json_array(chunk_size):
+    items = [dict(x=12345, y=['d', 'e']), 3.25, 'a "quoted" ] string', [],
+             None, 17]
+    fp = io.StringIO(u' \n' + json.dumps(items, indent=2))
+    assert list(pybackend.utils.iter_json_array(
+        fp, chunk_size=chunk_size)) == items
+
+    assert list(pybackend.utils.iter_json_array(io.StringIO(u'[ ]'))) == []
+
+
+@pytest.mark.parametrize('data', [u'', u'{"a": 1}', u'[1, 2', u'[1 2]',
+                                  u'[1,, 2]', u'[nope]'])
+def test_iter_json_array_malformed(data):
+    with pytest.raises(ValueError):
+        list(pybackend.utils.iter_json_array(io.StringIO(data), chunk_size=2))
+
+
+def test_max_rss():
+    rss = pybackend.utils.max_rss()
+    assert rss is None or rss > 0
+
+
 def test_check_connection():
     assert not pybackend.utils.check_connection("http://blahblah")
     assert pybackend.utils.check_connection("http://google.com")
@@ -24,3 +88,16 @@ def test_mimetype_for_file():
     mtypes = ['application/json', 'application/octet-stream']
     for fn, m in zip(fnames, mtypes):
         assert pybackend.utils.mimetype_for_file(fn) == m
+
+
+def test_encode_png():
+    image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    data = pybackend.utils.encode_png(image)
+    assert data.startswith(b'\x89PNG\r\n\x1a\n')
+    assert data.endswith(b'IEND\xaeB`\x82')
+
+    width, height = struct.unpack('>II', data[16:24])
+    assert (width, height) == (4, 3)
+    size = struct.unpack('>I', data[33:37])[0]
+    rows = zlib.decompress(data[41:41 + size])
+    assert rows == b''.join(b'\x00' + row.tobytes() for row in image)
@@ -25,11 +25,17 @@ values for `filename` and `metadata`:
 ```
 
 See `data/audio/filelist.json` for a more complete example.
+
+Before uploading, every file is hashed locally to the ID the server would
+assign it, and the server is asked which of these it already has; only the
+missing files are sent. Skipped files are logged as successful uploads, with
+their existing URI. Pass `--force` to upload everything regardless.
 """
 from __future__ import print_function
 
 import argparse
 import datetime
+import hashlib
 import joblib
 import json
 import logging
@@ -37,10 +43,74 @@ from requests.packages.urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 import requests
 from six.moves.urllib.parse import urlparse
+import uuid
 
 LOG = logging.getLogger('audio_uploader')
 
 
+def _session(url):
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=Retry(total=8, backoff_factor=0.02))
+    session.mount('{}://'.format(urlparse(url).scheme), adapter)
+    return session
+
+
+def content_id(filename, chunk_size=2 ** 20):
+    """Compute the ID of an audio file's content, without loading it all.
+
+    This must match the server's `pybackend.utils.uuid`.
+
+    Parameters
+    ----------
+    filename : str
+        Path to an audio file on disk.
+
+    chunk_size : int, default=1MB
+        Number of bytes to read at a time.
+
+    Returns
+    -------
+    gid : str
+        The file's content ID.
+    """
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            md5.update(chunk)
+    return str(uuid.UUID(hex=md5.hexdigest(), version=4))
+
+
+def check_exists(gids, url, batch_size=500):
+    """Ask the CMS which content IDs it already has.
+
+    Parameters
+    ----------
+    gids : list of str
+        Content IDs to check.
+
+    url : str
+        Destination for uploading data; existence is checked at
+        `<url>/exists`.
+
+    batch_size : int, default=500
+        Number of IDs to check per request.
+
+    Returns
+    -------
+    exists : dict
+        Map from each content ID to whether the CMS has it.
+    """
+    session = _session(url)
+    exists_url = '{}/exists'.format(url.rstrip('/'))
+    exists = dict()
+    for idx in range(0, len(gids), batch_size):
+        response = session.post(
+            exists_url, json=dict(gids=gids[idx:idx + batch_size]))
+        response.raise_for_status()
+        exists.update(response.json()['exists'])
+    return exists
+
+
 def upload(filename, metadata, url):
     """Upload an audio file and corresponding metadata to the CMS.
 
@@ -62,9 +132,7 @@ def upload(filename, metadata, url):
         the newly minted object.
     """
     start = datetime.datetime.now()
-    session = requests.Session()
-    adapter = HTTPAdapter(max_retries=Retry(total=8, backoff_factor=0.02))
-    session.mount('{}://'.format(urlparse(url).scheme), adapter)
+    session = _session(url)
 
     response = session.post(
         url,
@@ -78,6 +146,24 @@ def upload(filename, metadata, url):
     LOG.info(json.dumps(result))
 
 
+def skip(filename, gid):
+    """Log a file the CMS already has as successfully uploaded.
+
+    Parameters
+    ----------
+    filename : str
+        Path to an audio file on disk.
+
+    gid : str
+        The file's content ID.
+    """
+    start = datetime.datetime.now()
+    result = dict(status=200, time_elapsed=str(datetime.timedelta(0)),
+                  start_time=str(start), filename=filename,
+                  uri='audio:{}'.format(gid), message="Already uploaded.")
+    LOG.info(json.dumps(result))
+
+
 def init_logger(log_file, level=logging.INFO):
     logging.basicConfig(level=level)
     handler = logging.FileHandler(log_file)
@@ -110,10 +196,28 @@ if __name__ == '__main__':
     parser.add_argument(
         "--n_jobs", type=int, default=-2,
         help="Number of parallel jobs to run; -1 for all, -2 for all but one.")
+    parser.add_argument(
+        "--force", action='store_true',
+        help="Upload every file, even those the CMS already has.")
 
     args = parser.parse_args()
     audio_files = json.load(open(args.audio_files))
     init_logger(args.log_file)
-    joblib.Parallel(n_jobs=args.n_jobs, verbose=args.verbose)(
-        joblib.delayed(upload)(url=args.upload_url, **record)
-        for record in audio_files)
+    parallel = joblib.Parallel(n_jobs=args.n_jobs, verbose=args.verbose)
+
+    if not args.force:
+        gids = parallel(joblib.delayed(content_id)(record['filename'])
+                        for record in audio_files)
+        exists = check_exists(gids, args.upload_url)
+        remaining = []
+        for record, gid in zip(audio_files, gids):
+            if exists.get(gid):
+                skip(record['filename'], gid)
+            else:
+                remaining.append(record)
+        print("Skipping {} of {} files already uploaded."
+              .format(len(audio_files) - len(remaining), len(audio_files)))
+        audio_files = remaining
+
+    parallel(joblib.delayed(upload)(url=args.upload_url, **record)
+             for record in audio_files)
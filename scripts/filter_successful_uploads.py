@@ -34,7 +34,7 @@ def filter_successes(filelist, upload_results):
         `upload_results`.
     """
     successful_files = set([res['filename'] for res in upload_results
-                            if res['status'] == 200])
+                            if res['status'] in (200, 202)])
     remaining_files = [fdata for fdata in filelist
                        if fdata['filename'] not in successful_files]
     return remaining_files